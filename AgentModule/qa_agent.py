@@ -125,6 +125,7 @@ class QA_Agent:
         retriever=None,
         return_details: bool = False,
         username: str = "anonymous",
+        context: str | None = None,
     ) -> str | tuple[str, bool, bool]:
         print("\n" + "=" * 80)
         print("🤔 用户问题:")
@@ -132,8 +133,10 @@ class QA_Agent:
         self.logger.info(f"User Question: {question}")
 
         used_retriever = False
-        if retriever:
-            context = get_context_or_empty(question, retriever)
+        if retriever or context is not None:
+            # 调用方（如异步接口）可以预先检索好 context
+            if context is None:
+                context = get_context_or_empty(question, retriever)
             if context:
                 print(f"\n📚 从RAG检索到的上下文 (长度: {len(context)} 字符):")
                 print(
@@ -3,7 +3,7 @@ import os
 from datetime import date, timedelta, datetime
 from langchain_openai import ChatOpenAI
 from tools.rag_service import RAGService
-from tools.rag_utils import get_context_or_empty
+from tools.rag_utils import get_context_or_empty, get_contexts_or_empty
 from tools.llm_logger import get_llm_logger
 from dotenv import load_dotenv
 
@@ -49,6 +49,7 @@ class Plan_Agent:
         critical_areas, moderate_areas, good_areas = self.analyze_quiz_results(
             quiz_results
         )
+        contexts = self._topic_contexts(critical_areas + moderate_areas + good_areas)
         plan_start_date = date.today()
         plan = []
 
@@ -58,7 +59,9 @@ class Plan_Agent:
                     "date": plan_start_date + timedelta(days=i * 2),
                     "priority": "High priority",
                     "topic": topic,
-                    "materials": self.recommend_materials(topic),
+                    "materials": self.recommend_materials(
+                        topic, context=contexts[topic]
+                    ),
                 }
             )
 
@@ -69,7 +72,9 @@ class Plan_Agent:
                     "date": plan_start_date + timedelta(days=i * 2),
                     "priority": "Medium priority",
                     "topic": topic,
-                    "materials": self.recommend_materials(topic),
+                    "materials": self.recommend_materials(
+                        topic, context=contexts[topic]
+                    ),
                 }
             )
 
@@ -80,19 +85,27 @@ class Plan_Agent:
                     "date": plan_start_date + timedelta(days=i * 2),
                     "priority": "Low priority",
                     "topic": topic,
-                    "materials": self.recommend_materials(topic),
+                    "materials": self.recommend_materials(
+                        topic, context=contexts[topic]
+                    ),
                 }
             )
 
         self.learning_plan = plan
         return plan
 
-    def recommend_materials(self, topic, retriever=None):
-        retriever = retriever or self.retriever
-        if retriever is None:
-            retriever = RAGService().get_retriever()
-
-        ctx = get_context_or_empty(topic, retriever)
+    def _topic_contexts(self, topics):
+        # 计划中所有主题的上下文一次批量检索
+        retriever = self.retriever or RAGService().get_retriever()
+        return dict(zip(topics, get_contexts_or_empty(list(topics), retriever)))
+
+    def recommend_materials(self, topic, retriever=None, context=None):
+        ctx = context
+        if ctx is None:
+            retriever = retriever or self.retriever
+            if retriever is None:
+                retriever = RAGService().get_retriever()
+            ctx = get_context_or_empty(topic, retriever)
         if ctx:
             ctx += "\n\n"
 
@@ -130,13 +143,16 @@ class Plan_Agent:
         plan = []
 
         goals = user_input.get("goals", [])
+        contexts = self._topic_contexts(goals)
         for i, goal in enumerate(goals):
             plan.append(
                 {
                     "date": plan_start_date + timedelta(days=i * 2),
                     "priority": "User-defined",
                     "topic": goal,
-                    "materials": self.recommend_materials(goal),
+                    "materials": self.recommend_materials(
+                        goal, context=contexts[goal]
+                    ),
                 }
             )
 
@@ -1,10 +1,10 @@
 from tools.quiz_prompts import generate_topic_list_prompt, generate_questions_prompt
 from langchain_openai import ChatOpenAI
-from langchain_core.runnables import RunnableLambda, RunnableParallel
+from langchain_core.runnables import RunnableLambda
 from LearningPlanModule.learning_plan import LearningPlan
 from tools.auto_answer import auto_answer
 from tools.rag_service import RAGService
-from tools.rag_utils import get_context_or_empty
+from tools.rag_utils import get_context_or_empty, get_contexts_or_empty
 from tools.llm_logger import get_llm_logger
 import logging
 from dotenv import load_dotenv
@@ -60,36 +60,21 @@ def prepare_quiz_questions(
 
     questions_per_topic = max_questions // max_topics
 
-    if retriever:
-
-        def _topic_ctx(inputs):
-            return get_context_or_empty(inputs["topic"], retriever)
-
-        context_chain = RunnableLambda(_topic_ctx)
-        prompt_chain = RunnableLambda(
-            lambda inputs: generate_questions_prompt(
-                inputs["topic"], language=language
-            ).format_prompt(topic=inputs["topic"])
-        )
-        question_chain = (
-            RunnableParallel({"ctx": context_chain, "prompt": prompt_chain})
-            | RunnableLambda(
-                lambda d: (d["ctx"] + "\n\n" if d["ctx"] else "")
-                + d["prompt"].to_string()
-            )
-            | llm
-        )
-    else:
-        question_chain = (
-            RunnableLambda(
-                lambda inputs: generate_questions_prompt(
-                    inputs["topic"], language=language
-                ).format_prompt(topic=inputs["topic"])
-            )
-            | llm
+    # 所有主题的上下文一次批量检索，代替逐个主题的检索往返
+    contexts = get_contexts_or_empty(topics, retriever)
+    question_chain = (
+        RunnableLambda(
+            lambda inputs: (inputs["ctx"] + "\n\n" if inputs["ctx"] else "")
+            + generate_questions_prompt(inputs["topic"], language=language)
+            .format_prompt(topic=inputs["topic"])
+            .to_string()
         )
+        | llm
+    )
 
-    question_sets = question_chain.batch([{"topic": t} for t in topics])
+    question_sets = question_chain.batch(
+        [{"topic": t, "ctx": c} for t, c in zip(topics, contexts)]
+    )
 
     llm_logger = get_llm_logger()
     for topic, qset in zip(topics, question_sets):
@@ -66,6 +66,7 @@ Respond in {language}.
         language: str = "en",
         retriever=None,
         username: str = "anonymous",
+        context: str | None = None,
     ) -> tuple[str, bool]:
         lang = (
             LanguageHandler.choose_or_detect(input_text)
@@ -73,11 +74,13 @@ Respond in {language}.
             else language
         )
 
-        retriever = retriever or self.retriever
-        if retriever is None:
-            retriever = RAGService().get_retriever()
-
-        ctx = get_context_or_empty(input_text, retriever)
+        if context is None:
+            retriever = retriever or self.retriever
+            if retriever is None:
+                retriever = RAGService().get_retriever()
+            ctx = get_context_or_empty(input_text, retriever)
+        else:
+            ctx = context
         used_retriever = bool(ctx)
         if ctx:
             input_text = f"{ctx}\n\n### 主题:\n{input_text}"
@@ -12,7 +12,9 @@ from fastapi.responses import FileResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from langchain_core.documents import Document
 from typing import List, Optional, Dict, Any
 import json
 import os
@@ -30,7 +32,9 @@ from SummaryModule.summary_agent import Summary_Agent
 from CoordinatorAgentModule.coordinator_agent import Coordinator_Agent
 from QuizModule import generate_learning_plan_from_quiz
 from tools.language_handler import LanguageHandler
-from tools.rag_service import get_rag_service
+from tools.ingest import user_upload_dir
+from tools.rag_service import COURSE_NAMESPACE, get_rag_service, user_namespace
+from tools.rag_utils import aget_context_or_empty
 from tools.covert_resource import convert_to_pdf
 from tools.llm_logger import get_llm_logger
 from tools.ocr_service import get_ocr_service
@@ -51,7 +55,6 @@ app.mount("/static", StaticFiles(directory="backend/static"), name="static")
 app.mount("/data", StaticFiles(directory="data"), name="data")
 
 rag_service = get_rag_service()
-retriever = rag_service.get_retriever()
 logger = logging.getLogger(__name__)
 KNOWLEDGE_JSON_PATH = "data/course/big_data.json"
 CURRENT_NODE = None
@@ -74,6 +77,18 @@ def get_current_user(
     return session_manager.get_session(session_id)
 
 
+def get_rag_namespaces(session: Optional[Dict[str, Any]]) -> List[str]:
+    """检索时可见的向量集合：课程语料 + 学生自己的上传"""
+    if not session:
+        return rag_service.visible_namespaces()
+    return rag_service.visible_namespaces(session["username"], session["user_type"])
+
+
+def get_session_retriever(session: Optional[Dict[str, Any]]):
+    """未选择 PDF 时的默认检索器，同样覆盖当前用户可见的全部向量集合"""
+    return rag_service.get_retriever(namespaces=get_rag_namespaces(session))
+
+
 def get_user_knowledge_path(username: str) -> str:
     return user_manager.get_user_course_path(username)
 
@@ -308,40 +323,23 @@ async def chat(data: ChatMessage, session_id: Optional[str] = Cookie(None)):
 
     current_retriever = None
     if CURRENT_PDF_PATH and os.path.exists(CURRENT_PDF_PATH):
-        from langchain_core.vectorstores import VectorStoreRetriever
-        from langchain_core.callbacks import CallbackManagerForRetrieverRun
-
-        class FilteredRetriever(VectorStoreRetriever):
-            """只检索当前PDF的retriever"""
-
-            pdf_path: str
-
-            def _get_relevant_documents(
-                self, query: str, *, run_manager: CallbackManagerForRetrieverRun = None
-            ):
-
-                vectorstore = rag_service._get_vectorstore()
-
-                docs = vectorstore.similarity_search(
-                    query, k=4, filter={"source": self.pdf_path}
-                )
-                logger.info(
-                    f"🔍 Filtered retrieval: found {len(docs)} docs from {self.pdf_path}"
-                )
-                return docs
-
-        current_retriever = FilteredRetriever(
-            vectorstore=rag_service._get_vectorstore(),
-            search_kwargs={"k": 4},
-            pdf_path=CURRENT_PDF_PATH,
+        current_retriever = rag_service.scoped_retriever(
+            [CURRENT_PDF_PATH], k=4, namespaces=get_rag_namespaces(session)
         )
-        logger.info(f"✅ Created filtered retriever for: {CURRENT_PDF_PATH}")
+        logger.info(f"✅ Using filtered retriever for: {CURRENT_PDF_PATH}")
     else:
-        current_retriever = retriever
+        current_retriever = get_session_retriever(session)
         logger.info(f"⚠️ No current PDF, using global retriever")
 
-    result, used_fallback, used_retriever = qa_agent.chat(
-        message, retriever=current_retriever, return_details=True, username=username
+    # 异步检索，随后在线程池中运行同步的 Agent，避免阻塞事件循环
+    context = await aget_context_or_empty(message, current_retriever)
+    result, used_fallback, used_retriever = await run_in_threadpool(
+        qa_agent.chat,
+        message,
+        retriever=current_retriever,
+        return_details=True,
+        username=username,
+        context=context,
     )
 
     logger.info(
@@ -468,9 +466,6 @@ async def start_quiz(data: QuizStart, session_id: Optional[str] = Cookie(None)):
 
     current_retriever = None
     if CURRENT_PDF_PATH and os.path.exists(CURRENT_PDF_PATH):
-        from langchain_core.vectorstores import VectorStoreRetriever
-        from langchain_core.callbacks import CallbackManagerForRetrieverRun
-
         children_index = find_children_index_for_pdf(CURRENT_PDF_PATH)
         logger.info(f"🔍 Current PDF belongs to children[{children_index}]")
 
@@ -483,53 +478,36 @@ async def start_quiz(data: QuizStart, session_id: Optional[str] = Cookie(None)):
                 logger.warning(f"⚠️ Question file not found: {question_file_path}")
                 question_file_path = None
 
-        class QuizFilteredRetriever(VectorStoreRetriever):
-            """Quiz专用retriever：检索当前PDF和对应的Question文件"""
-
-            pdf_path: str
-            question_file_content: str = ""
-
-            def _get_relevant_documents(
-                self, query: str, *, run_manager: CallbackManagerForRetrieverRun = None
-            ):
-
-                vectorstore = rag_service._get_vectorstore()
-
-                docs = vectorstore.similarity_search(
-                    query, k=3, filter={"source": self.pdf_path}
-                )
-                logger.info(f"🔍 Found {len(docs)} docs from current PDF")
-
-                if self.question_file_content:
-                    from langchain_core.documents import Document
-
-                    question_doc = Document(
-                        page_content=self.question_file_content[:2000],
-                        metadata={"source": "question_bank"},
-                    )
-                    docs.append(question_doc)
-                    logger.info("✅ Added question bank content to context")
-
-                return docs
-
-        question_content = ""
+        # Quiz专用retriever：检索当前PDF，并附加对应的Question文件内容
+        extra_documents = []
         if question_file_path and os.path.exists(question_file_path):
             with open(question_file_path, "r", encoding="utf-8") as f:
                 question_content = f.read()
+            if question_content:
+                extra_documents.append(
+                    Document(
+                        page_content=question_content[:2000],
+                        metadata={"source": "question_bank"},
+                    )
+                )
 
-        current_retriever = QuizFilteredRetriever(
-            vectorstore=rag_service._get_vectorstore(),
-            search_kwargs={"k": 3},
-            pdf_path=CURRENT_PDF_PATH,
-            question_file_content=question_content,
+        current_retriever = rag_service.scoped_retriever(
+            [CURRENT_PDF_PATH],
+            k=3,
+            extra_documents=extra_documents,
+            namespaces=get_rag_namespaces(session),
         )
-        logger.info(f"✅ Created quiz retriever for: {CURRENT_PDF_PATH}")
+        logger.info(f"✅ Using quiz retriever for: {CURRENT_PDF_PATH}")
     else:
-        current_retriever = retriever
+        current_retriever = get_session_retriever(session)
         logger.info(f"⚠️ No current PDF, using global retriever")
 
-    questions, used_retriever = quiz_agent.prepare_quiz_questions(
-        data.subject, language=language, retriever=current_retriever, username=username
+    questions, used_retriever = await run_in_threadpool(
+        quiz_agent.prepare_quiz_questions,
+        data.subject,
+        language=language,
+        retriever=current_retriever,
+        username=username,
     )
 
     if not questions:
@@ -634,11 +612,15 @@ async def create_learning_plan(
     if session and session["user_type"] == "student":
         username = session["username"]
 
-    plan_agent = Plan_Agent(user_name=username, user_language=language)
+    plan_agent = Plan_Agent(
+        user_name=username,
+        user_language=language,
+        retriever=get_session_retriever(session),
+    )
     goals_list = [g.strip() for g in data.goals.split(";") if g.strip()]
     user_input = {"goals": goals_list}
 
-    plan_agent.generate_plan_from_prompt(user_input)
+    await run_in_threadpool(plan_agent.generate_plan_from_prompt, user_input)
 
     deadline_days = data.deadline_days if hasattr(data, "deadline_days") else 7
     deadline_date = (datetime.now() + timedelta(days=deadline_days)).strftime(
@@ -674,8 +656,14 @@ async def create_learning_plan_from_quiz(
     if session and session["user_type"] == "student":
         username = session["username"]
 
-    plan_agent = Plan_Agent(user_name=username, user_language=language)
-    generated_plan = plan_agent.generate_plan_from_quiz(data.state["scores"])
+    plan_agent = Plan_Agent(
+        user_name=username,
+        user_language=language,
+        retriever=get_session_retriever(session),
+    )
+    generated_plan = await run_in_threadpool(
+        plan_agent.generate_plan_from_quiz, data.state["scores"]
+    )
     plan_agent.save_to_file()
 
     return {
@@ -699,79 +687,32 @@ async def generate_summary(
 
     current_retriever = None
     if CURRENT_PDF_PATH and os.path.exists(CURRENT_PDF_PATH):
-        from langchain_core.vectorstores import VectorStoreRetriever
-        from langchain_core.callbacks import CallbackManagerForRetrieverRun
-
         related_pdfs = find_grandchild_and_collect_pdfs(CURRENT_PDF_PATH)
 
         if related_pdfs:
+            # Summary专用retriever：一次 $in 过滤查询覆盖grandchild下所有PDF
             logger.info(f"📚 Summary will use {len(related_pdfs)} related PDFs")
-
-            class SummaryFilteredRetriever(VectorStoreRetriever):
-                """Summary专用retriever：检索grandchild下所有great-grandchildren的PDF"""
-
-                pdf_paths: List[str]
-
-                def _get_relevant_documents(
-                    self,
-                    query: str,
-                    *,
-                    run_manager: CallbackManagerForRetrieverRun = None,
-                ):
-
-                    vectorstore = rag_service._get_vectorstore()
-
-                    all_docs = []
-                    for pdf_path in self.pdf_paths:
-                        docs = vectorstore.similarity_search(
-                            query, k=2, filter={"source": pdf_path}
-                        )
-                        all_docs.extend(docs)
-
-                    logger.info(
-                        f"🔍 Summary retrieval: found {len(all_docs)} docs from {len(self.pdf_paths)} PDFs"
-                    )
-
-                    return all_docs[:8]
-
-            current_retriever = SummaryFilteredRetriever(
-                vectorstore=rag_service._get_vectorstore(),
-                search_kwargs={"k": 8},
-                pdf_paths=related_pdfs,
+            current_retriever = rag_service.scoped_retriever(
+                related_pdfs, k=8, namespaces=get_rag_namespaces(session)
             )
-            logger.info(f"✅ Created summary retriever for {len(related_pdfs)} PDFs")
+            logger.info(f"✅ Using summary retriever for {len(related_pdfs)} PDFs")
         else:
             logger.info(f"⚠️ No related PDFs found, using current PDF only")
-
-            from langchain_core.vectorstores import VectorStoreRetriever
-            from langchain_core.callbacks import CallbackManagerForRetrieverRun
-
-            class SinglePDFRetriever(VectorStoreRetriever):
-                pdf_path: str
-
-                def _get_relevant_documents(
-                    self,
-                    query: str,
-                    *,
-                    run_manager: CallbackManagerForRetrieverRun = None,
-                ):
-                    vectorstore = rag_service._get_vectorstore()
-                    docs = vectorstore.similarity_search(
-                        query, k=4, filter={"source": self.pdf_path}
-                    )
-                    return docs
-
-            current_retriever = SinglePDFRetriever(
-                vectorstore=rag_service._get_vectorstore(),
-                search_kwargs={"k": 4},
-                pdf_path=CURRENT_PDF_PATH,
+            current_retriever = rag_service.scoped_retriever(
+                [CURRENT_PDF_PATH], k=4, namespaces=get_rag_namespaces(session)
             )
     else:
-        current_retriever = retriever
+        current_retriever = get_session_retriever(session)
         logger.info(f"⚠️ No current PDF, using global retriever")
 
-    summary, used_retriever = summary_agent.generate_summary(
-        data.topic, language=language, retriever=current_retriever, username=username
+    context = await aget_context_or_empty(data.topic, current_retriever)
+    summary, used_retriever = await run_in_threadpool(
+        summary_agent.generate_summary,
+        data.topic,
+        language=language,
+        retriever=current_retriever,
+        username=username,
+        context=context,
     )
 
     return {"summary": summary, "used_retriever": used_retriever}
@@ -889,17 +830,21 @@ async def upload_files(
     session = get_current_user(session_id)
     if session and session["user_type"] == "student":
         knowledge_path = get_user_knowledge_path(session["username"])
+        rag_namespace = user_namespace(session["username"])
+        # 学生文件放在各自目录，课程目录的批量导入不会把它们并入课程语料
+        save_dir = user_upload_dir(session["username"])
     else:
         knowledge_path = KNOWLEDGE_JSON_PATH
+        rag_namespace = COURSE_NAMESPACE
+        save_dir = Path("data/RAG_files")
 
-    save_dir = Path("data/RAG_files")
     save_dir.mkdir(parents=True, exist_ok=True)
 
     supported_conversion_exts = [".doc", ".docx", ".ppt", ".pptx"]
     newly_added_paths = []
 
     for file in files:
-        filename = file.filename
+        filename = Path(file.filename).name
         file_ext = Path(filename).suffix.lower()
         temp_path = save_dir / filename
 
@@ -949,7 +894,9 @@ async def upload_files(
         with open(knowledge_path, "w", encoding="utf-8") as f:
             json.dump(graph_data, f, indent=2, ensure_ascii=False)
 
-        ingest_error = rag_service.ingest_paths(newly_added_paths)
+        ingest_error = await run_in_threadpool(
+            rag_service.ingest_paths, newly_added_paths, rag_namespace
+        )
         if ingest_error:
             return {
                 "message": "Files uploaded but RAG indexing failed",
@@ -1394,6 +1341,19 @@ async def log_llm_call(data: LLMLogRequest, session_id: Optional[str] = Cookie(N
         raise HTTPException(status_code=500, detail=f"Failed to log LLM call: {str(e)}")
 
 
+@app.on_event("startup")
+async def warm_up_ocr_models():
+    """启动时在后台预热 OCR 模型（默认关闭，RAG_OCR_WARMUP=true 开启）"""
+    if os.getenv("RAG_OCR_WARMUP", "false").lower() in {"1", "true", "yes"}:
+        get_ocr_service().warm_up()
+
+
+@app.get("/api/ocr/models")
+async def get_ocr_models():
+    """返回已注册 OCR 模型的加载状态、加载耗时与常驻内存"""
+    return {"success": True, "models": get_ocr_service().model_stats()}
+
+
 @app.post("/api/ocr/extract")
 async def extract_text_from_image(image: UploadFile = File(...)):
     """从上传的图片中提取文本"""
@@ -1401,7 +1361,9 @@ async def extract_text_from_image(image: UploadFile = File(...)):
         image_data = await image.read()
 
         ocr_service = get_ocr_service()
-        extracted_text = ocr_service.extract_text_from_image(image_data)
+        extracted_text = await run_in_threadpool(
+            ocr_service.extract_text_from_image, image_data
+        )
 
         logger.info(f"✅ OCR extraction successful, text length: {len(extracted_text)}")
 
@@ -0,0 +1,131 @@
+import importlib
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from langchain_core.documents import Document
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.embedding_backends import HashingEmbeddings
+from tools.rag_service import RAGService, user_namespace
+
+# 后端依赖 gradio（资源转换）与 python-multipart（表单上传）
+pytest.importorskip("gradio")
+pytest.importorskip("python_multipart")
+
+
+@pytest.fixture
+def app_module(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("model_name", os.getenv("model_name") or "gpt-test")
+    monkeypatch.setenv("RAG_EMBEDDING_BACKEND", "hash")
+    module = importlib.import_module("backend.app")
+    service = RAGService(
+        embeddings=HashingEmbeddings(size=64),
+        persist_directory=str(tmp_path / "db"),
+        use_multiquery=False,
+        embedding_cache=False,
+        near_duplicates=False,
+    )
+    monkeypatch.setattr(module, "rag_service", service)
+    monkeypatch.setattr(module, "CURRENT_PDF_PATH", None)
+    monkeypatch.setattr(
+        module.session_manager,
+        "get_session",
+        lambda session_id: {"username": "alice", "user_type": "student"},
+    )
+    return module
+
+
+def test_chat_without_pdf_searches_student_uploads(app_module, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    service = app_module.rag_service
+    service.ingest_documents(
+        [Document(page_content="HDFS 课程讲义", metadata={"source": "course.pdf"})]
+    )
+    service.ingest_documents(
+        [Document(page_content="alice 的 HDFS 复习笔记", metadata={"source": "notes.pdf"})],
+        namespace=user_namespace("alice"),
+    )
+    calls = []
+
+    def fake_chat(message, retriever=None, context=None, **kwargs):
+        calls.append(context)
+        return "answer", False, True
+
+    monkeypatch.setattr(app_module.qa_agent, "chat", fake_chat)
+    client = TestClient(app_module.app)
+    client.cookies.set("session_id", "s1")
+    response = client.post("/api/chat", json={"message": "HDFS 复习笔记"})
+
+    assert response.status_code == 200
+    assert "alice 的 HDFS 复习笔记" in calls[0]
+    assert "HDFS 课程讲义" in calls[0]
+
+
+def test_ocr_warm_up_only_when_enabled(app_module, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    calls = []
+
+    class FakeOCRService:
+        def warm_up(self):
+            calls.append(1)
+
+    monkeypatch.setattr(app_module, "get_ocr_service", FakeOCRService)
+    monkeypatch.delenv("RAG_OCR_WARMUP", raising=False)
+    with TestClient(app_module.app):
+        pass
+    assert calls == []
+
+    monkeypatch.setenv("RAG_OCR_WARMUP", "true")
+    with TestClient(app_module.app):
+        pass
+    assert calls == [1]
+
+
+def test_student_upload_stays_out_of_course_folder_ingest(
+    app_module, monkeypatch, tmp_path
+):
+    import fitz
+    from fastapi.testclient import TestClient
+
+    import tools.ingest as ingest
+    from tools.rag_service import COURSE_NAMESPACE
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("RAG_OCR_CACHE", "0")
+    knowledge = tmp_path / "alice_course.json"
+    knowledge.write_text(
+        json.dumps({"children": [{"grandchildren": [{"name": "HDFS"}]}]}),
+        encoding="utf-8",
+    )
+    monkeypatch.setattr(
+        app_module, "get_user_knowledge_path", lambda name: str(knowledge)
+    )
+    pdf = fitz.open()
+    text = "alice private HDFS notes: " + "block replication " * 5
+    pdf.new_page().insert_text((72, 72), text)
+    data = pdf.tobytes()
+
+    client = TestClient(app_module.app)
+    client.cookies.set("session_id", "s1")
+    response = client.post(
+        "/api/upload?node_name=HDFS",
+        files={"files": ("notes.pdf", data, "application/pdf")},
+    )
+    assert response.status_code == 200
+    [path] = response.json()["paths"]
+    assert Path(path).parent == Path("data/RAG_files/users/alice")
+
+    service = app_module.rag_service
+    monkeypatch.setattr(ingest, "get_rag_service", lambda: service)
+    ingest.ingest_folder("data/RAG_files", workers=1, report_interval=0)
+
+    course = service._get_vectorstore(COURSE_NAMESPACE).get()["documents"]
+    private = service._get_vectorstore(user_namespace("alice")).get()["documents"]
+    assert not any("alice private" in text for text in course)
+    assert any("alice private" in text for text in private)
@@ -0,0 +1,91 @@
+import os
+import sys
+
+import fitz
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from langchain_core.documents import Document
+from tools.chunking import StructuredChunker
+from tools.pdf_ocr_loader import PDFOCRLoader
+
+
+def _words(text):
+    return len(text.split())
+
+
+def _page(text, page, headings=None, source="a.pdf"):
+    metadata = {"source": source, "page": page}
+    if headings:
+        metadata["headings"] = "\n".join(f"{level}\t{t}" for level, t in headings)
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_chunks_start_at_headings_and_span_pages():
+    docs = [
+        _page("Intro\n\none two three four", 1, [(1, "Intro")]),
+        _page("five six seven eight\n\nDetails\n\nnine ten eleven", 2, [(2, "Details")]),
+    ]
+    chunker = StructuredChunker(max_tokens=20, min_tokens=5, counter=_words)
+    chunks = chunker.split_documents(docs)
+
+    assert [c.page_content for c in chunks] == [
+        "Intro\none two three four\nfive six seven eight",
+        "Details\nnine ten eleven",
+    ]
+    assert chunks[0].metadata["page_start"] == 1
+    assert chunks[0].metadata["page_end"] == 2
+    assert chunks[0].metadata["section"] == "Intro"
+    assert chunks[1].metadata["page"] == 2
+    assert chunks[1].metadata["section"] == "Details"
+    assert "headings" not in chunks[0].metadata
+
+
+def test_small_sections_are_merged_until_min_tokens():
+    docs = [_page("1. A\n\nalpha\n\n2. B\n\nbeta\n\n3. C\n\ngamma delta epsilon", 1)]
+    chunker = StructuredChunker(max_tokens=50, min_tokens=4, counter=_words)
+    chunks = chunker.split_documents(docs)
+    assert [c.page_content for c in chunks] == [
+        "1. A\nalpha\n2. B\nbeta",
+        "3. C\ngamma delta epsilon",
+    ]
+    assert chunks[0].metadata["section"] == "1. A"
+
+
+def test_oversized_blocks_split_by_sentence_within_token_limit():
+    text = "这是第一句话。" * 30
+    chunker = StructuredChunker(max_tokens=50, min_tokens=10)
+    chunks = chunker.split_documents([_page(text, 3)])
+    assert len(chunks) > 1
+    assert all(chunker.counter(c.page_content) <= 50 for c in chunks)
+    assert "".join(c.page_content.replace("\n", "") for c in chunks) == text
+
+
+def test_sources_are_chunked_separately_with_overlap():
+    docs = [
+        _page("a b c\n\nd e f\n\ng h i", 1, source="x.pdf"),
+        _page("j k l", 1, source="y.pdf"),
+    ]
+    chunker = StructuredChunker(max_tokens=6, min_tokens=1, overlap_tokens=3, counter=_words)
+    chunks = chunker.split_documents(docs)
+    assert [(c.metadata["source"], c.page_content) for c in chunks] == [
+        ("x.pdf", "a b c\nd e f"),
+        ("x.pdf", "d e f\ng h i"),
+        ("y.pdf", "j k l"),
+    ]
+
+
+def test_pdf_loader_records_font_headings(tmp_path):
+    path = tmp_path / "doc.pdf"
+    pdf = fitz.open()
+    page = pdf.new_page()
+    page.insert_text((72, 72), "Chapter One", fontsize=20)
+    page.insert_text((72, 110), "Body text line that is long enough to count.", fontsize=11)
+    page.insert_text((72, 130), "More body text to pass the OCR threshold here.", fontsize=11)
+    pdf.save(str(path))
+    pdf.close()
+
+    [doc] = PDFOCRLoader(str(path)).load()
+    assert doc.metadata["headings"] == "1\tChapter One"
+    [chunk] = StructuredChunker().split_documents([doc])
+    assert chunk.metadata["section"] == "Chapter One"
+    assert chunk.page_content.startswith("Chapter One\n")
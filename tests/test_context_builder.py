@@ -0,0 +1,180 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from langchain_core.documents import Document
+from tools.context_builder import build_context, estimate_tokens
+from tools.rag_utils import get_context_or_empty, get_context_with_sources
+
+
+def _words(text):
+    return len(text.split())
+
+
+def test_estimate_tokens_counts_cjk_and_words():
+    assert estimate_tokens("HDFS是分布式文件系统") == 8 + 2
+    assert estimate_tokens("") == 0
+
+
+def _offline_tiktoken(monkeypatch, get_encoding):
+    import types
+
+    import tools.context_builder as context_builder
+
+    fake = types.SimpleNamespace(get_encoding=get_encoding)
+    monkeypatch.setitem(sys.modules, "tiktoken", fake)
+    monkeypatch.setattr(context_builder, "_encoder", None)
+    monkeypatch.setattr(context_builder, "_encoder_loaded", False)
+    return context_builder
+
+
+def test_count_tokens_estimates_when_vocabulary_unavailable(monkeypatch):
+    calls = []
+
+    def get_encoding(name):
+        calls.append(name)
+        raise ConnectionError("offline")
+
+    context_builder = _offline_tiktoken(monkeypatch, get_encoding)
+    text = "HDFS是分布式文件系统"
+    assert context_builder.count_tokens(text) == estimate_tokens(text)
+    assert context_builder.count_tokens(text) == estimate_tokens(text)
+    # 只尝试加载一次
+    assert calls == ["cl100k_base"]
+
+
+def test_count_tokens_does_not_wait_for_a_hanging_download(monkeypatch):
+    import threading
+
+    release = threading.Event()
+    context_builder = _offline_tiktoken(monkeypatch, lambda name: release.wait(30))
+    monkeypatch.setenv("RAG_TOKENIZER_TIMEOUT", "0.1")
+    try:
+        assert context_builder.count_tokens("map reduce") == estimate_tokens("map reduce")
+    finally:
+        release.set()
+
+
+def test_build_context_drops_duplicates_and_contained_chunks():
+    docs = [
+        Document(page_content="alpha beta gamma delta"),
+        Document(page_content="alpha  beta gamma delta"),
+        Document(page_content="beta gamma"),
+        Document(page_content="other text"),
+    ]
+    built = build_context(docs, counter=_words)
+    assert built.text == "alpha beta gamma delta\n\nother text"
+    assert built.dropped_chunks == 2
+
+
+def test_build_context_merges_adjacent_pages_and_collapses_overlap():
+    overlap = "shared overlap between both chunks"
+    docs = [
+        Document(
+            page_content=f"{overlap} tail",
+            metadata={"source": "a.pdf", "page": 2},
+        ),
+        Document(page_content="unrelated", metadata={"source": "b.pdf", "page": 1}),
+        Document(
+            page_content=f"first part {overlap}",
+            metadata={"source": "a.pdf", "page": 1},
+        ),
+        Document(page_content="far away", metadata={"source": "a.pdf", "page": 9}),
+    ]
+    built = build_context(docs, counter=_words)
+    assert built.chunks[0].text == f"first part {overlap} tail"
+    assert built.chunks[0].source == "a.pdf"
+    assert built.chunks[0].pages == [1, 2]
+    assert [c.source for c in built.chunks] == ["a.pdf", "b.pdf", "a.pdf"]
+
+
+def test_build_context_orders_by_score_and_respects_budget():
+    docs = [
+        Document(page_content="low " * 10, metadata={"score": 0.1}),
+        Document(page_content="high " * 10, metadata={"score": 0.9}),
+        Document(page_content="mid " * 10, metadata={"rrf_score": 0.5}),
+    ]
+    built = build_context(docs, max_tokens=20, separator="\n\n", counter=_words)
+    assert built.text.split()[0] == "high"
+    assert built.tokens <= 20
+    assert [c.score for c in built.chunks] == [0.9, 0.5]
+
+
+def test_build_context_ranks_by_order_when_any_score_is_missing():
+    docs = [
+        Document(page_content="first " * 10, metadata={"score": 0.2}),
+        Document(page_content="second " * 10),
+        Document(page_content="third " * 10, metadata={"score": 0.9}),
+    ]
+    built = build_context(docs, counter=_words)
+    # 相似度分数与名次分数不可比，统一按检索顺序
+    assert [c.text.split()[0] for c in built.chunks] == ["first", "second", "third"]
+    assert [c.score for c in built.chunks] == [1.0, 2 / 3, 1 / 3]
+
+
+def test_build_context_truncates_first_block_over_budget():
+    built = build_context(
+        [Document(page_content="word " * 100)], max_tokens=10, counter=_words
+    )
+    assert _words(built.text) == 10
+
+
+class DummyRetriever:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def get_relevant_documents(self, query):
+        return self._docs
+
+
+def test_get_context_with_sources_reports_provenance(monkeypatch):
+    monkeypatch.setenv("RAG_CONTEXT_MAX_TOKENS", "0")
+    retriever = DummyRetriever(
+        [
+            Document(
+                page_content="Spark 基于内存计算",
+                metadata={"source": "spark.pdf", "page": 3, "doc_hash": "h1"},
+            )
+        ]
+    )
+    built = get_context_with_sources("spark", retriever)
+    assert built.text == "Spark 基于内存计算"
+    assert built.sources == [
+        {
+            "source": "spark.pdf",
+            "pages": [3],
+            "score": 1.0,
+            "tokens": built.chunks[0].tokens,
+            "ids": ["h1"],
+        }
+    ]
+
+
+def test_get_context_or_empty_applies_budget():
+    retriever = DummyRetriever([Document(page_content="x " * 5000)])
+    context = get_context_or_empty("q", retriever, max_tokens=100)
+    assert 0 < len(context.split()) <= 100
+
+
+def test_async_context_is_built_off_the_event_loop(monkeypatch):
+    import asyncio
+    import threading
+
+    import tools.rag_utils as rag_utils
+
+    class AsyncRetriever(DummyRetriever):
+        async def ainvoke(self, query):
+            return self._docs
+
+    threads = []
+
+    def recording_build(docs, max_tokens=None):
+        threads.append(threading.get_ident())
+        return build_context(docs, max_tokens=max_tokens, counter=_words)
+
+    monkeypatch.setattr(rag_utils, "build_context", recording_build)
+    retriever = AsyncRetriever([Document(page_content="map reduce")])
+    context = asyncio.run(rag_utils.aget_context_or_empty("q", retriever))
+    assert context == "map reduce"
+    # asyncio.run 在当前线程运行事件循环，构建应发生在其他线程
+    assert threads and threading.get_ident() not in threads
@@ -0,0 +1,84 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from langchain_core.documents import Document
+from tools.context_compressor import ContextCompressor, split_sentences
+from tools.embedding_backends import HashingEmbeddings
+from tools.rag_utils import get_context_with_sources
+
+PAGE = (
+    "本页介绍课程安排。"
+    "HDFS 默认块大小为 128MB。"
+    "期末考试占总评的百分之六十。"
+    "HDFS 的每个块默认保存三个副本。"
+    "实验报告需要在第十周提交。"
+    "课堂签到使用小程序完成。"
+)
+
+
+class DummyRetriever:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def get_relevant_documents(self, query):
+        return self._docs
+
+
+def test_split_sentences_handles_chinese_and_latin():
+    assert split_sentences("第一句。第二句！\nThird one. Fourth?") == [
+        "第一句。",
+        "第二句！",
+        "Third one.",
+        "Fourth?",
+    ]
+
+
+def test_compressor_keeps_query_sentences_in_order():
+    compressor = ContextCompressor(ratio=0.3, min_sentences=2)
+    doc = Document(page_content=PAGE, metadata={"source": "hdfs.pdf", "page": 1})
+    [compressed], stats = compressor.compress_with_stats([doc], "HDFS 块大小 副本")
+    assert compressed.page_content == (
+        "HDFS 默认块大小为 128MB。\nHDFS 的每个块默认保存三个副本。"
+    )
+    assert compressed.metadata["source"] == "hdfs.pdf"
+    assert compressed.metadata["compressed"] is True
+    assert stats.kept_sentences == 2
+    assert stats.ratio < 0.5
+    assert stats.seconds >= 0
+
+
+def test_compressor_passes_short_documents_through():
+    compressor = ContextCompressor(ratio=0.1, min_sentences=2)
+    doc = Document(page_content="只有一句话。")
+    assert compressor.compress_documents([doc], "无关") == [doc]
+    assert compressor.last_stats.ratio == 1.0
+
+
+def test_compressor_token_target_keeps_one_sentence_per_document():
+    compressor = ContextCompressor(ratio=1.0, max_tokens=1, min_sentences=1)
+    docs = [Document(page_content=PAGE), Document(page_content=PAGE)]
+    compressed, stats = compressor.compress_with_stats(docs, "HDFS 副本")
+    assert [d.page_content for d in compressed] == ["HDFS 的每个块默认保存三个副本。"] * 2
+    assert stats.kept_sentences == 2
+
+
+def test_compressor_with_embeddings_runs():
+    compressor = ContextCompressor(
+        ratio=0.3, embeddings=HashingEmbeddings(size=64), embedding_weight=0.3
+    )
+    [compressed] = compressor.compress_documents(
+        [Document(page_content=PAGE)], "HDFS 块大小"
+    )
+    assert "128MB" in compressed.page_content
+
+
+def test_get_context_with_sources_reports_compression():
+    retriever = DummyRetriever([Document(page_content=PAGE)])
+    built = get_context_with_sources(
+        "HDFS 副本", retriever, compressor=ContextCompressor(ratio=0.3)
+    )
+    assert "副本" in built.text
+    assert "签到" not in built.text
+    assert 0 < built.compression["ratio"] < 1
+    assert built.compression["original_tokens"] > built.compression["compressed_tokens"]
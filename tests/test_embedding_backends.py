@@ -0,0 +1,35 @@
+import pytest
+from langchain_core.embeddings import FakeEmbeddings
+
+from tools.embedding_backends import (
+    EMBEDDING_BACKENDS,
+    HashingEmbeddings,
+    create_embeddings,
+    embeddings_namespace,
+    register_embedding_backend,
+)
+
+
+def test_hashing_embeddings_are_deterministic_and_normalized():
+    emb = create_embeddings("hash", size=64)
+    assert isinstance(emb, HashingEmbeddings)
+    first = emb.embed_query("分布式文件系统 HDFS")
+    assert first == HashingEmbeddings(size=64).embed_documents(["分布式文件系统 HDFS"])[0]
+    assert abs(sum(v * v for v in first) - 1.0) < 1e-5
+
+
+def test_registry_and_namespace(monkeypatch):
+    monkeypatch.setitem(EMBEDDING_BACKENDS, "fake", lambda **kw: FakeEmbeddings(size=8))
+    assert isinstance(create_embeddings("fake"), FakeEmbeddings)
+    assert embeddings_namespace(FakeEmbeddings(size=8)) == "FakeEmbeddings:8"
+
+    with pytest.raises(ValueError):
+        create_embeddings("missing")
+
+    @register_embedding_backend("custom")
+    def _custom(**kwargs):
+        return HashingEmbeddings(size=16)
+
+    monkeypatch.setenv("RAG_EMBEDDING_BACKEND", "custom")
+    assert create_embeddings().size == 16
+    EMBEDDING_BACKENDS.pop("custom")
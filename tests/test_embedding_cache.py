@@ -0,0 +1,90 @@
+from langchain_core.embeddings import Embeddings
+
+from tools.disk_cache import DiskLRUCache
+from tools.embedding_cache import CachedEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+
+    def embed_query(self, text):
+        self.calls.append([text])
+        return [float(len(text)), 0.5]
+
+
+def test_cached_embeddings_hits_after_first_call(tmp_path):
+    base = CountingEmbeddings()
+    cache = DiskLRUCache(str(tmp_path / "emb.sqlite"))
+    emb = CachedEmbeddings(base, cache, namespace="m1")
+
+    first = emb.embed_documents(["cats", "dogs", "cats"])
+    second = emb.embed_documents(["dogs", "cats"])
+
+    assert first == [[4.0, 1.0], [4.0, 1.0], [4.0, 1.0]]
+    assert second == [[4.0, 1.0], [4.0, 1.0]]
+    assert base.calls == [["cats", "dogs"]]
+
+    assert emb.embed_query("hello") == [5.0, 0.5]
+    assert emb.embed_query("hello") == [5.0, 0.5]
+    assert base.calls[-1] == ["hello"]
+    assert len(base.calls) == 2
+
+    stats = emb.stats()
+    assert stats["hits"] == 4
+    assert stats["misses"] == 3
+
+
+def test_cache_is_shared_and_namespaced(tmp_path):
+    path = str(tmp_path / "emb.sqlite")
+    CachedEmbeddings(CountingEmbeddings(), DiskLRUCache(path), "m1").embed_query("x")
+
+    other = CountingEmbeddings()
+    CachedEmbeddings(other, DiskLRUCache(path), "m1").embed_query("x")
+    assert other.calls == []
+
+    CachedEmbeddings(other, DiskLRUCache(path), "m2").embed_query("x")
+    assert other.calls == [["x"]]
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskLRUCache(str(tmp_path / "c.sqlite"), max_bytes=30)
+    cache.set("a", b"x" * 10)
+    cache.set("b", b"x" * 10)
+    cache.get("a")
+    cache.set("c", b"x" * 15)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.size_bytes() <= 30
+
+
+def test_async_query_does_cache_io_off_the_event_loop(tmp_path):
+    import asyncio
+    import threading
+
+    class RecordingCache(DiskLRUCache):
+        threads = []
+
+        def get(self, key):
+            self.threads.append(threading.get_ident())
+            return super().get(key)
+
+        def set(self, key, value):
+            self.threads.append(threading.get_ident())
+            return super().set(key, value)
+
+    base = CountingEmbeddings()
+    cache = RecordingCache(str(tmp_path / "emb.sqlite"))
+    emb = CachedEmbeddings(base, cache, namespace="m1")
+
+    assert asyncio.run(emb.aembed_query("hello")) == [5.0, 0.5]
+    assert asyncio.run(emb.aembed_query("hello")) == [5.0, 0.5]
+    assert len(base.calls) == 1
+    # 读、写、再读各一次，均不在事件循环线程上
+    assert len(cache.threads) == 3
+    assert threading.get_ident() not in cache.threads
@@ -0,0 +1,65 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.index_benchmark import exact_top_k, hit_rate, main, recall_at_k
+
+
+def test_exact_top_k_and_recall():
+    corpus = np.eye(4, dtype=np.float32)
+    queries = np.array([[0.9, 0.1, 0, 0], [0, 0, 0.2, 1.0]], dtype=np.float32)
+    exact = exact_top_k(corpus, queries, 2)
+    assert exact.tolist() == [[0, 1], [3, 2]]
+    assert recall_at_k([["0", "1"], ["3", "0"]], exact) == 0.75
+    assert hit_rate([["0", "1"], ["3", "0"]], np.array([1, 2])) == 0.5
+    assert hit_rate([["0", "1"], ["3", "0"]], np.array([1, -1])) == 1.0
+    assert hit_rate([["0"]], None) is None
+
+
+def test_benchmark_sweep_writes_json(tmp_path):
+    output = tmp_path / "bench.json"
+    results = main(
+        [
+            "--synthetic", "300", "--dim", "16", "--num-queries", "20",
+            "--m", "8", "--ef-search", "10,50", "--k", "2,4", "--fetch-k", "10",
+            "--backends", "chroma,numpy", "--output", str(output),
+        ]
+    )
+    # 2 个 ef_search × 2 个 k × (相似度 + MMR) + numpy 的 2 个 k
+    assert len(results) == 10
+    similarity = [r for r in results if r.mode == "similarity"]
+    assert all(r.recall > 0.9 and r.p95_ms >= r.p50_ms > 0 for r in similarity)
+    assert all(r.overlap is None and r.hit_rate > 0.9 for r in similarity)
+    # MMR 不以精确 top-k 为目标：只报告重叠率，相关性看命中率
+    mmr = [r for r in results if r.mode == "mmr"]
+    assert all(r.recall is None and 0 <= r.overlap <= 1 for r in mmr)
+    assert all(r.hit_rate > 0.9 for r in mmr)
+    data = json.loads(output.read_text())
+    assert data["corpus"] == 300
+    assert {r["backend"] for r in data["results"]} == {"chroma", "numpy"}
+
+
+def test_load_store_vectors_uses_public_accessor(monkeypatch, tmp_path):
+    import tools.index_benchmark as index_benchmark
+    import tools.rag_service as rag_module
+    from langchain_core.documents import Document
+    from tools.embedding_backends import HashingEmbeddings
+
+    for backend in ("chroma", "numpy"):
+        service = rag_module.RAGService(
+            embeddings=HashingEmbeddings(size=16),
+            persist_directory=str(tmp_path / backend),
+            use_multiquery=False,
+            embedding_cache=False,
+            vector_backend=backend,
+        )
+        assert service.namespace_embeddings().shape == (0, 0)
+        service.ingest_documents(
+            [Document(page_content=f"chunk {i}", metadata={"source": "a.pdf"}) for i in range(3)]
+        )
+        monkeypatch.setattr(rag_module, "get_rag_service", lambda: service)
+        vectors = index_benchmark.load_store_vectors(rag_module.COURSE_NAMESPACE, limit=2)
+        assert vectors.shape == (2, 16) and vectors.dtype == np.float32
@@ -0,0 +1,210 @@
+import os
+import time
+
+import pytest
+
+import tools.ingest as ingest
+
+
+class DummyService:
+    def __init__(self, persist_directory="db"):
+        self.persist_directory = persist_directory
+        self.chunks = []
+        self.deleted = set()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.persist_directory, "ingest_manifest.json")
+
+    def ingest_documents(self, documents):
+        self.chunks.extend(documents)
+        return [d.metadata["doc_hash"] for d in self.chunks]
+
+    def delete_documents(self, ids):
+        self.deleted.update(ids)
+
+
+def test_ingest_folder_streams_chunks(monkeypatch, tmp_path):
+    service = DummyService(str(tmp_path / "db"))
+    tmp_path = tmp_path / "files"
+    tmp_path.mkdir()
+    (tmp_path / "a.txt").write_text("alpha notes", encoding="utf-8")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b.txt").write_text("beta notes", encoding="utf-8")
+    monkeypatch.setattr(ingest, "get_rag_service", lambda: service)
+
+    docs, chunks = ingest.ingest_folder(str(tmp_path), workers=1, report_interval=0)
+
+    assert (docs, chunks) == (2, 2)
+    assert sorted(c.page_content for c in service.chunks) == [
+        "alpha notes",
+        "beta notes",
+    ]
+    assert {c.metadata["source"] for c in service.chunks} == {
+        str(tmp_path / "a.txt"),
+        str(tmp_path / "sub" / "b.txt"),
+    }
+
+
+def test_ingest_folder_skips_student_uploads(monkeypatch, tmp_path):
+    service = DummyService(str(tmp_path / "db"))
+    monkeypatch.setattr(ingest, "get_rag_service", lambda: service)
+    folder = tmp_path / "files"
+    folder.mkdir()
+    (folder / "course.txt").write_text("course notes", encoding="utf-8")
+    upload = ingest.user_upload_dir("alice", str(folder))
+    upload.mkdir(parents=True)
+    (upload / "private.txt").write_text("alice private notes", encoding="utf-8")
+
+    assert ingest.ingest_folder(str(folder), workers=1, report_interval=0) == (1, 1)
+    assert [c.page_content for c in service.chunks] == ["course notes"]
+
+
+def test_iter_chunk_batches_with_process_pool(tmp_path):
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"{i}.txt"
+        path.write_text(f"file {i}", encoding="utf-8")
+        paths.append(path)
+
+    batches = list(ingest.iter_chunk_batches(paths, workers=2))
+
+    assert sorted(b.path for b in batches if b.done) == paths
+    assert not any(b.error for b in batches)
+    chunks = {b.path: b.chunks for b in batches if b.chunks}
+    assert chunks[paths[3]][0].page_content == "file 3"
+    assert chunks[paths[3]][0].metadata["doc_hash"]
+
+
+def test_process_pool_does_not_wait_for_the_first_file(monkeypatch, tmp_path):
+    from langchain_core.documents import Document
+
+    flag = tmp_path / "b-received"
+
+    def load(path, ocr_workers=None):
+        if path.name == "b.pdf":
+            yield Document(page_content="small notes")
+            return
+        yield Document(page_content="big book, page 1")
+        # 调用方收到 b 的 chunk 后才创建标记；按路径顺序消费时 b 会排在 a 之后而等到超时
+        for _ in range(100):
+            if flag.exists():
+                break
+            time.sleep(0.05)
+        yield Document(page_content="seen" if flag.exists() else "timeout")
+
+    monkeypatch.setattr(ingest, "iter_file", load)
+    texts = []
+    paths = [tmp_path / "a.pdf", tmp_path / "b.pdf"]
+    for batch in ingest.iter_chunk_batches(paths, workers=2, chunk_batch=1):
+        if batch.path.name == "b.pdf" and batch.chunks:
+            flag.touch()
+        texts.extend(c.page_content for c in batch.chunks)
+
+    assert "small notes" in texts
+    assert any(t.endswith("seen") for t in texts)
+
+
+def test_default_workers_do_not_scale_with_cpu_count(monkeypatch, tmp_path):
+    service = DummyService(str(tmp_path / "db"))
+    monkeypatch.setattr(ingest, "get_rag_service", lambda: service)
+    monkeypatch.setattr(ingest.os, "cpu_count", lambda: 64)
+    monkeypatch.delenv("RAG_INGEST_WORKERS", raising=False)
+    seen = []
+
+    def fake_batches(paths, workers, ocr_workers):
+        seen.append(workers)
+        return iter(())
+
+    monkeypatch.setattr(ingest, "iter_chunk_batches", fake_batches)
+    (tmp_path / "files").mkdir()
+    (tmp_path / "files" / "a.txt").write_text("alpha", encoding="utf-8")
+    ingest.ingest_folder(str(tmp_path / "files"), report_interval=0)
+    monkeypatch.setenv("RAG_INGEST_WORKERS", "3")
+    ingest.ingest_folder(str(tmp_path / "files"), report_interval=0)
+    assert seen == [2, 3]
+
+
+def test_empty_folder(monkeypatch, tmp_path):
+    service = DummyService(str(tmp_path / "db"))
+    monkeypatch.setattr(ingest, "get_rag_service", lambda: service)
+    (tmp_path / "files").mkdir()
+    assert ingest.ingest_folder(str(tmp_path / "files"), workers=1) == (0, 0)
+
+
+def test_manifest_skips_unchanged_and_syncs_deletions(monkeypatch, tmp_path):
+    service = DummyService(str(tmp_path / "db"))
+    monkeypatch.setattr(ingest, "get_rag_service", lambda: service)
+    folder = tmp_path / "files"
+    folder.mkdir()
+    (folder / "a.txt").write_text("alpha notes", encoding="utf-8")
+    (folder / "b.txt").write_text("beta notes", encoding="utf-8")
+    (folder / "c.txt").write_text("gamma notes", encoding="utf-8")
+    ingest.ingest_folder(str(folder), workers=1, report_interval=0)
+    old_b = service.chunks[1].metadata["doc_hash"]
+    old_c = service.chunks[2].metadata["doc_hash"]
+
+    service.chunks.clear()
+    (folder / "b.txt").write_text("beta notes, revised", encoding="utf-8")
+    (folder / "c.txt").unlink()
+    docs, _ = ingest.ingest_folder(str(folder), workers=1, report_interval=0)
+
+    assert docs == 1
+    assert [c.page_content for c in service.chunks] == ["beta notes, revised"]
+    assert service.deleted == {old_b, old_c}
+
+    service.chunks.clear()
+    assert ingest.ingest_folder(str(folder), workers=1, report_interval=0) == (0, 0)
+    assert service.chunks == []
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_file_failing_mid_stream_is_retried_next_run(monkeypatch, tmp_path, workers):
+    service = DummyService(str(tmp_path / "db"))
+    monkeypatch.setattr(ingest, "get_rag_service", lambda: service)
+    folder = tmp_path / "files"
+    folder.mkdir()
+    (folder / "good.txt").write_text("good notes", encoding="utf-8")
+    (folder / "bad.txt").write_text("bad notes", encoding="utf-8")
+    iter_file = ingest.iter_file
+
+    def flaky(path, ocr_workers=None):
+        yield from iter_file(path, ocr_workers)
+        if path.name == "bad.txt":
+            raise RuntimeError("corrupt page")
+
+    monkeypatch.setattr(ingest, "iter_file", flaky)
+    assert ingest.ingest_folder(str(folder), workers=workers, report_interval=0) == (2, 1)
+
+    service.chunks.clear()
+    monkeypatch.setattr(ingest, "iter_file", iter_file)
+    ingest.ingest_folder(str(folder), workers=workers, report_interval=0)
+    assert [c.page_content for c in service.chunks] == ["bad notes"]
+
+
+def test_cli_dispatches_snapshot_commands(monkeypatch, tmp_path):
+    calls = []
+
+    class SnapshotService(DummyService):
+        snapshot_directory = str(tmp_path)
+
+        def export_snapshot(self, path=None, namespace="course"):
+            calls.append(("export", path, namespace))
+            return path or "latest.rag.npz"
+
+        def latest_snapshot_path(self, namespace="course"):
+            return "latest.rag.npz"
+
+        def import_snapshot(self, path, namespace="course", check_model=True):
+            calls.append(("import", path, namespace, check_model))
+            return 3
+
+    monkeypatch.setattr(ingest, "get_rag_service", lambda: SnapshotService())
+
+    ingest.main(["export", "out.rag.npz"])
+    ingest.main(["import", "--namespace", "user:alice", "--ignore-model"])
+
+    assert calls == [
+        ("export", "out.rag.npz", "course"),
+        ("import", "latest.rag.npz", "user:alice", False),
+    ]
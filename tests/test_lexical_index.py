@@ -0,0 +1,100 @@
+import os
+
+from langchain_core.documents import Document
+
+from tools.hybrid_retriever import reciprocal_rank_fusion
+from tools.lexical_index import BM25Index, tokenize
+
+
+def test_tokenize_mixed_chinese_and_english():
+    tokens = tokenize("HDFS是分布式文件系统")
+    assert "hdfs" in tokens
+    assert any("文件" in t for t in tokens)
+
+
+def test_bm25_ranks_exact_terms_and_filters_sources(tmp_path):
+    index = BM25Index(str(tmp_path / "lex.json"))
+    index.add(
+        ["a", "b", "c"],
+        ["DIKW 模型描述了数据到智慧的层次", "数据仓库与数据湖", "HDFS 的块大小"],
+        [{"source": "x.pdf"}, {"source": "x.pdf"}, {"source": "y.pdf"}],
+    )
+    hits = index.search("什么是DIKW", k=2)
+    assert hits[0][0].page_content.startswith("DIKW")
+
+    assert index.search("HDFS", sources=["x.pdf"]) == []
+    index.save()
+
+    reloaded = BM25Index(str(tmp_path / "lex.json"))
+    reloaded.remove(["c"])
+    assert len(reloaded) == 2
+    assert reloaded.search("HDFS") == []
+
+
+def test_bm25_save_merges_changes_from_other_processes(tmp_path):
+    path = str(tmp_path / "lex.json")
+    server = BM25Index(path)
+    server.add(["a", "b"], ["HDFS 块大小", "数据仓库"])
+    server.save()
+
+    cli = BM25Index(path)
+    cli.add(["c"], ["DIKW 金字塔"])
+    cli.remove(["b"])
+    cli.save()
+
+    # 服务端未重新加载就保存，也不能抹掉命令行写入的内容
+    server.add(["d"], ["Spark 内存计算"])
+    server.save()
+    assert sorted(BM25Index(path)._docs) == ["a", "c", "d"]
+    assert server.search("DIKW")[0][0].page_content == "DIKW 金字塔"
+
+    cli.add(["e"], ["MapReduce"])
+    cli.save()
+    assert server.refresh()
+    assert server.search("MapReduce")
+    assert not server.refresh()
+
+
+def test_bm25_save_appends_deltas_and_loads_without_tokenizing(tmp_path, monkeypatch):
+    import tools.lexical_index as lexical_index
+    from tools.file_lock import file_stamp
+
+    path = str(tmp_path / "lex.json")
+    server = BM25Index(path)
+    server.add(["a", "b"], ["HDFS 块大小 数据仓库 数据湖", "Spark 内存计算 RDD 宽依赖"])
+    server.save()
+    base = file_stamp(path)
+
+    cli = BM25Index(path)
+    cli.add(["c"], ["DIKW"])
+    cli.remove(["b"])
+    cli.save()
+    # 小批量只追加到日志，基础文件保持不变
+    assert file_stamp(path) == base
+    assert os.path.getsize(path + ".log") > 0
+
+    def no_tokenize(text):
+        raise AssertionError("stored term counts should be reused")
+
+    monkeypatch.setattr(lexical_index, "tokenize", no_tokenize)
+    assert server.refresh()
+    assert sorted(server._docs) == ["a", "c"]
+    assert sorted(BM25Index(path)._docs) == ["a", "c"]
+    monkeypatch.undo()
+
+    # 日志超过基础文件后合并回基础文件
+    cli.add(["d"], ["MapReduce " * 200])
+    cli.save()
+    assert file_stamp(path) != base
+    assert not os.path.exists(path + ".log")
+    assert server.refresh()
+    assert server.search("mapreduce")[0][0].page_content.startswith("MapReduce")
+
+
+def test_reciprocal_rank_fusion_prefers_shared_hits():
+    a = Document(page_content="a", metadata={"doc_hash": "a"})
+    b = Document(page_content="b", metadata={"doc_hash": "b"})
+    c = Document(page_content="c", metadata={"doc_hash": "c"})
+    fused = reciprocal_rank_fusion([[a, b], [c, b]], k=2)
+    assert [d.page_content for d in fused] == ["b", "a"]
+    assert fused[0].metadata["rrf_score"] > fused[1].metadata["rrf_score"]
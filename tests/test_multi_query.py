@@ -0,0 +1,84 @@
+import threading
+import time
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableLambda
+
+from tools.memory_cache import TTLCache
+from tools.multi_query import CachedMultiQueryRetriever, is_keyword_query
+
+
+class SlowRetriever(BaseRetriever):
+    delay: float = 0.2
+    seen: list = []
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        self.seen.append((query, threading.get_ident()))
+        time.sleep(self.delay)
+        return [Document(page_content=f"doc for {query}")]
+
+
+def _retriever(llm_calls, base):
+    def fake_llm(inputs):
+        llm_calls.append(inputs["question"])
+        return ["变体一", "变体二", "变体三"]
+
+    return CachedMultiQueryRetriever(
+        retriever=base,
+        llm_chain=RunnableLambda(fake_llm),
+        query_cache=TTLCache(),
+        max_workers=4,
+    )
+
+
+def test_keyword_heuristic():
+    assert is_keyword_query("HDFS")
+    assert is_keyword_query("大数据技术概述")
+    assert not is_keyword_query("数据挖掘的主要步骤有哪些？")
+    assert not is_keyword_query("How does HDFS replicate blocks across racks?")
+
+
+def test_variants_are_cached_and_searched_in_parallel():
+    llm_calls = []
+    base = SlowRetriever(seen=[])
+    retriever = _retriever(llm_calls, base)
+
+    start = time.perf_counter()
+    docs = retriever.invoke("数据挖掘的主要步骤有哪些？")
+    elapsed = time.perf_counter() - start
+
+    assert len(docs) == 3
+    assert elapsed < 0.5
+    assert len({thread for _, thread in base.seen}) > 1
+
+    retriever.invoke("  数据挖掘的主要步骤有哪些 ")
+    assert llm_calls == ["数据挖掘的主要步骤有哪些？"]
+
+
+def test_keyword_queries_bypass_expansion():
+    llm_calls = []
+    base = SlowRetriever(delay=0, seen=[])
+    docs = _retriever(llm_calls, base).invoke("HDFS")
+    assert llm_calls == []
+    assert [d.page_content for d in docs] == ["doc for HDFS"]
+
+
+def test_retrieve_many_sends_all_variants_in_one_batch():
+    class BatchRetriever(SlowRetriever):
+        batches: list = []
+
+        def retrieve_many(self, queries):
+            self.batches.append(list(queries))
+            return [[Document(page_content=f"doc for {q}")] for q in queries]
+
+    llm_calls = []
+    base = BatchRetriever(batches=[])
+    retriever = _retriever(llm_calls, base)
+
+    results = retriever.retrieve_many(["数据挖掘的主要步骤有哪些？", "HDFS"])
+
+    assert base.batches == [["变体一", "变体二", "变体三", "HDFS"]]
+    assert [len(docs) for docs in results] == [3, 1]
+    assert results[1][0].page_content == "doc for HDFS"
+    assert llm_calls == ["数据挖掘的主要步骤有哪些？"]
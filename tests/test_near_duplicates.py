@@ -0,0 +1,67 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.near_duplicates import NearDuplicateIndex
+
+BODY = (
+    "分布式文件系统将大文件切分为固定大小的数据块，并在多个数据节点上保存副本，"
+    "名称节点负责维护命名空间与数据块的映射关系，客户端读取时就近选择副本。"
+)
+
+
+def test_finds_near_duplicates_but_not_different_text(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "nd.npz"), min_chars=20)
+    index.add("a", "第 12 页  " + BODY, source="book.pdf")
+
+    assert index.find("第 13 页 " + BODY, source="book.pdf") == "a"
+    assert index.find(BODY.replace("名称节点", "主节点"), source="book.pdf") == "a"
+    assert index.find("MapReduce 将计算拆分为 Map 和 Reduce 两个阶段，" * 3, source="book.pdf") is None
+    # 默认只在同一来源内比较
+    assert index.find(BODY, source="other.pdf") is None
+    assert index.find("太短", source="book.pdf") is None
+
+
+def test_namespace_scope_and_persistence(tmp_path):
+    path = str(tmp_path / "nd.npz")
+    index = NearDuplicateIndex(path, min_chars=20, per_source=False)
+    index.add("a", BODY, source="x.pdf")
+    index.add("b", "HDFS 的副本放置策略兼顾可靠性与写入带宽。" * 4, source="y.pdf")
+    index.save()
+
+    reloaded = NearDuplicateIndex(path, min_chars=20, per_source=False)
+    assert len(reloaded) == 2
+    assert reloaded.find(BODY, source="z.pdf") == "a"
+    assert reloaded.source_of("a") == "x.pdf"
+
+    reloaded.remove(["a"])
+    reloaded.add("c", "新增的内容只在回滚前可见，" * 5)
+    reloaded.rollback()
+    assert reloaded.find(BODY) is None
+    assert reloaded.find("新增的内容只在回滚前可见，" * 5) is None
+    assert len(reloaded) == 1
+
+
+def test_save_merges_signatures_from_other_processes(tmp_path):
+    path = str(tmp_path / "nd.npz")
+    other = "MapReduce 将计算拆分为 Map 和 Reduce 两个阶段，" * 3
+    server = NearDuplicateIndex(path, min_chars=20)
+    server.add("a", BODY, source="x.pdf")
+    server.save()
+
+    cli = NearDuplicateIndex(path, min_chars=20)
+    cli.add("b", other, source="y.pdf")
+    cli.remove(["a"])
+    cli.save()
+
+    # 服务端在未重新加载时保存，命令行登记的签名不能丢
+    server.add("c", "HDFS 的副本放置策略兼顾可靠性与写入带宽。" * 4, source="x.pdf")
+    server.save()
+    assert server.find(other, source="y.pdf") == "b"
+    assert server.find(BODY, source="x.pdf") is None
+    assert len(NearDuplicateIndex(path, min_chars=20)) == 2
+
+    cli.add("d", BODY, source="z.pdf")
+    cli.save()
+    assert server.refresh()
+    assert server.find(BODY, source="z.pdf") == "d"
@@ -0,0 +1,151 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.numpy_index import NumpyVectorIndex
+
+
+def _fill(index):
+    index.upsert(
+        ids=["a1", "a2", "b1"],
+        embeddings=[[1.0, 0.0, 0.0], [0.8, 0.6, 0.0], [0.0, 0.0, 2.0]],
+        metadatas=[
+            {"source": "a.pdf", "page": 1, "doc_hash": "a1"},
+            {"source": "a.pdf", "page": 2, "doc_hash": "a2"},
+            {"source": "b.pdf", "page": 1, "doc_hash": "b1"},
+        ],
+        documents=["alpha one", "alpha two", "beta"],
+    )
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_numpy_index_search_and_filter(tmp_path, dtype):
+    index = NumpyVectorIndex(str(tmp_path), dtype=dtype)
+    _fill(index)
+
+    results = index.similarity_search_by_vector_with_relevance_scores([1, 0, 0], k=2)
+    assert [doc.page_content for doc, _ in results] == ["alpha one", "alpha two"]
+    assert results[0][1] == pytest.approx(0.0, abs=0.01)
+
+    docs = index.similarity_search_by_vector([1, 0, 0], k=5, filter={"source": "b.pdf"})
+    assert [d.page_content for d in docs] == ["beta"]
+    docs = index.similarity_search_by_vector(
+        [0, 0, 1], k=5, filter={"source": {"$in": ["a.pdf", "missing.pdf"]}}
+    )
+    assert {d.metadata["source"] for d in docs} == {"a.pdf"}
+
+
+def test_numpy_index_persists_as_memory_map(tmp_path):
+    index = NumpyVectorIndex(str(tmp_path))
+    _fill(index)
+    index.persist()
+
+    loaded = NumpyVectorIndex(str(tmp_path))
+    assert isinstance(loaded._vectors, np.memmap)
+    assert loaded._vectors.dtype == np.float16
+    assert len(loaded) == 3
+    assert loaded.get(where={"doc_hash": {"$in": ["b1"]}})["documents"] == ["beta"]
+
+    loaded.upsert(ids=["c1"], embeddings=[[0, 1, 0]], metadatas=[{"source": "c.pdf"}], documents=["gamma"])
+    assert loaded.similarity_search_by_vector([0, 1, 0], k=1)[0].page_content == "gamma"
+
+
+def test_numpy_index_upsert_replaces_and_delete_removes(tmp_path):
+    index = NumpyVectorIndex(str(tmp_path))
+    _fill(index)
+    index.upsert(ids=["b1"], embeddings=[[1, 0, 0]], metadatas=[{"source": "b.pdf"}], documents=["beta v2"])
+    assert len(index) == 3
+    assert index.similarity_search_by_vector([1, 0, 0], k=1, filter={"source": "b.pdf"})[0].page_content == "beta v2"
+
+    index.delete(where={"doc_hash": {"$in": ["a1", "a2"]}})
+    assert index.get()["ids"] == ["b1"]
+
+
+def test_numpy_index_mmr_prefers_diverse_results(tmp_path):
+    index = NumpyVectorIndex(str(tmp_path))
+    index.upsert(
+        ids=["x", "x2", "y"],
+        embeddings=[[1, 0.1, 0], [1, 0.11, 0], [0.6, 0, 0.8]],
+        documents=["x", "x copy", "y"],
+    )
+    docs = index.max_marginal_relevance_search_by_vector([1, 0, 0], k=2, fetch_k=3, lambda_mult=0.3)
+    assert [d.page_content for d in docs] == ["x", "y"]
+
+
+def test_numpy_index_non_resident_matches_resident(tmp_path):
+    rng = np.random.default_rng(0)
+    resident = NumpyVectorIndex(str(tmp_path / "r"))
+    lazy = NumpyVectorIndex(str(tmp_path / "l"), resident=False)
+    vectors = rng.normal(size=(50, 8))
+    for index in (resident, lazy):
+        index.upsert(ids=[str(i) for i in range(50)], embeddings=vectors, documents=[str(i) for i in range(50)])
+    query = rng.normal(size=8)
+    assert [d.page_content for d in resident.similarity_search_by_vector(query, k=5)] == [
+        d.page_content for d in lazy.similarity_search_by_vector(query, k=5)
+    ]
+    assert lazy._dense is None
+
+
+def test_numpy_index_persist_merges_other_writers(tmp_path):
+    server = NumpyVectorIndex(str(tmp_path))
+    _fill(server)
+    server.persist()
+
+    cli = NumpyVectorIndex(str(tmp_path))
+    cli.upsert(ids=["c1"], embeddings=[[0, 1, 0]], metadatas=[{"source": "c.pdf"}], documents=["gamma"])
+    cli.delete(ids=["a2"])
+    cli.persist()
+
+    assert server.refresh()
+    assert sorted(server.get()["ids"]) == ["a1", "b1", "c1"]
+    assert not server.refresh()
+
+    # 未刷新的进程保存时合并磁盘上的新内容，而不是用旧副本覆盖
+    stale = NumpyVectorIndex(str(tmp_path))
+    cli.upsert(ids=["d1"], embeddings=[[0, 1, 1]], metadatas=[{"source": "d.pdf"}], documents=["delta"])
+    cli.persist()
+    stale.upsert(ids=["e1"], embeddings=[[1, 1, 0]], metadatas=[{"source": "e.pdf"}], documents=["eps"])
+    stale.delete(ids=["b1"])
+    stale.persist()
+
+    assert sorted(NumpyVectorIndex(str(tmp_path)).get()["ids"]) == ["a1", "c1", "d1", "e1"]
+    assert stale.similarity_search_by_vector([0, 1, 1], k=1)[0].page_content == "delta"
+
+
+def test_numpy_index_get_limit_and_offset(tmp_path):
+    index = NumpyVectorIndex(str(tmp_path))
+    _fill(index)
+    assert index.get(limit=2)["ids"] == ["a1", "a2"]
+    assert index.get(limit=2, offset=2)["ids"] == ["b1"]
+    assert index.get(include=["embeddings"], limit=1)["embeddings"].shape == (1, 3)
+
+
+def test_numpy_index_grows_buffers_geometrically(tmp_path):
+    rng = np.random.default_rng(0)
+    index = NumpyVectorIndex(str(tmp_path))
+    vectors = rng.normal(size=(1000, 8))
+    buffers = set()
+    for start in range(0, 1000, 10):
+        index.upsert(
+            ids=[str(i) for i in range(start, start + 10)],
+            embeddings=vectors[start : start + 10],
+            documents=[str(i) for i in range(start, start + 10)],
+        )
+        # 常驻矩阵随写入增量更新，中途查询也能命中刚写入的行
+        [hit] = index.similarity_search_by_vector(vectors[start], k=1)
+        assert hit.page_content == str(start)
+        buffers.add(id(index._buffers["vectors"]))
+    # 逐批追加只在容量用尽时重新分配，而不是每批复制整个矩阵
+    assert len(buffers) <= 6
+    assert len(index) == 1000 and index._dense.shape == (1000, 8)
+
+    index.upsert(ids=["5"], embeddings=[vectors[999]], documents=["moved"])
+    docs = index.similarity_search_by_vector(vectors[999], k=2)
+    assert sorted(d.page_content for d in docs) == ["999", "moved"]
+    index.persist()
+    reloaded = NumpyVectorIndex(str(tmp_path))
+    assert len(reloaded) == 1000
+    assert reloaded.get(ids=["5"])["documents"] == ["moved"]
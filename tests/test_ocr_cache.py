@@ -0,0 +1,71 @@
+import io
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fitz
+import numpy as np
+from PIL import Image
+
+from tools.ocr_cache import OCRCache, cache_directory, get_ocr_cache
+from tools.ocr_service import OCRService
+from tools.pdf_ocr_loader import PDFOCRLoader
+
+
+def test_key_depends_on_content_and_languages():
+    image = np.zeros((4, 5, 3), dtype=np.uint8)
+    key = OCRCache.key(image, ["en", "ch_sim"])
+    assert key == OCRCache.key(image.copy(), ["ch_sim", "en"])
+    assert key != OCRCache.key(image, ["en"])
+    assert key != OCRCache.key(image.reshape(5, 4, 3), ["en", "ch_sim"])
+    assert OCRCache.key(b"png", ["en"]) != OCRCache.key(b"jpg", ["en"])
+
+
+def test_loader_and_service_reuse_cached_results(monkeypatch, tmp_path):
+    monkeypatch.setenv("RAG_OCR_CACHE_PATH", str(tmp_path / "ocr.sqlite"))
+    created = []
+
+    class Reader:
+        def readtext(self, image, detail=1):
+            return ["扫描页文字"] if detail == 0 else [([0, 0], "上传图片文字", 0.9)]
+
+    def factory(languages, gpu):
+        created.append(tuple(languages))
+        return Reader()
+
+    path = tmp_path / "scan.pdf"
+    pdf = fitz.open()
+    for _ in range(2):
+        page = pdf.new_page()
+        page.draw_rect(fitz.Rect(50, 50, 200, 200), color=(0, 0, 0), fill=(0, 0, 0))
+    pdf.save(str(path))
+    pdf.close()
+
+    first = PDFOCRLoader(str(path), reader_factory=factory).load()
+    second = PDFOCRLoader(str(path), reader_factory=factory).load()
+    assert [d.page_content for d in first] == [d.page_content for d in second] == ["扫描页文字"] * 2
+    # 两页内容相同：第一次加载只识别一次，第二次加载完全命中缓存、不加载模型
+    assert created == [("ch_sim", "en")]
+    stats = get_ocr_cache().stats()
+    assert stats["hits"] == 3 and stats["misses"] == 1 and stats["entries"] == 1
+
+    service = OCRService(reader=Reader())
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), (255, 255, 255)).save(buffer, format="PNG")
+    assert service.extract_text_from_image(buffer.getvalue()) == "上传图片文字"
+    service.reader = None
+    assert service.extract_text_from_image(buffer.getvalue()) == "上传图片文字"
+
+
+def test_default_path_is_outside_working_and_persist_directories(monkeypatch, tmp_path):
+    monkeypatch.delenv("RAG_OCR_CACHE_PATH", raising=False)
+    monkeypatch.delenv("RAG_CACHE_DIR", raising=False)
+    monkeypatch.chdir(tmp_path)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = get_ocr_cache().cache.path
+    assert path == os.path.join(root, "data", "cache", "ocr_cache.sqlite")
+    assert "chroma_db" not in path
+
+    monkeypatch.setenv("RAG_CACHE_DIR", str(tmp_path / "cache"))
+    assert cache_directory() == str(tmp_path / "cache")
+    assert get_ocr_cache().cache.path == str(tmp_path / "cache" / "ocr_cache.sqlite")
@@ -0,0 +1,81 @@
+import io
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fitz
+import numpy as np
+import pytest
+from PIL import Image
+
+from tools.ocr_images import decode_image, pixmap_array
+from tools.ocr_service import OCRService
+
+
+def test_pixmap_array_views_samples_without_encoding():
+    pdf = fitz.open()
+    page = pdf.new_page(width=60, height=40)
+    page.draw_rect(fitz.Rect(0, 0, 30, 40), color=(1, 0, 0), fill=(1, 0, 0))
+    pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
+
+    array = pixmap_array(pix)
+    decoded = np.array(Image.open(io.BytesIO(pix.tobytes("png"))).convert("RGB"))
+
+    assert array.shape == (80, 120, 3)
+    assert np.array_equal(array, decoded)
+    assert np.shares_memory(array, np.frombuffer(pix.samples_mv, dtype=np.uint8))
+    assert tuple(array[40, 10]) == (255, 0, 0)
+
+
+def test_ocr_service_decodes_uploads_once_into_rgb_arrays(monkeypatch, tmp_path):
+    monkeypatch.setenv("RAG_OCR_CACHE", "0")
+    seen = []
+
+    class Reader:
+        def readtext(self, image):
+            seen.append(image)
+            return [([0, 0], "识别结果", 0.9)]
+
+    service = OCRService(reader=Reader())
+    buffer = io.BytesIO()
+    Image.new("RGBA", (8, 6), (0, 0, 255, 255)).save(buffer, format="PNG")
+    path = tmp_path / "upload.png"
+    path.write_bytes(buffer.getvalue())
+
+    assert service.extract_text_from_image(buffer.getvalue()) == "识别结果"
+    assert service.extract_text_from_image(str(path)) == "识别结果"
+    for image in seen:
+        assert isinstance(image, np.ndarray) and image.shape == (6, 8, 3)
+        assert tuple(image[0, 0]) == (0, 0, 255)
+    assert decode_image(buffer.getvalue()).dtype == np.uint8
+
+
+def test_decode_image_handles_gif_and_transparent_png(monkeypatch):
+    import cv2
+
+    gif = io.BytesIO()
+    Image.new("RGB", (5, 4), (255, 0, 0)).convert("P").save(gif, format="GIF")
+    image = decode_image(gif.getvalue())
+    assert image.shape == (4, 5, 3) and image.dtype == np.uint8
+    assert tuple(image[0, 0]) == (255, 0, 0)
+    # 不支持 GIF 的 OpenCV 构建返回 None，此时改用 PIL 解码
+    with monkeypatch.context() as m:
+        m.setattr(cv2, "imdecode", lambda *args: None)
+        assert np.array_equal(decode_image(gif.getvalue()), image)
+
+    # 透明背景上的黑字：透明区域应变成白色而不是黑色
+    rgba = Image.new("RGBA", (6, 3), (0, 0, 0, 0))
+    rgba.putpixel((0, 0), (0, 0, 0, 255))
+    rgba.putpixel((1, 0), (0, 0, 255, 128))
+    png = io.BytesIO()
+    rgba.save(png, format="PNG")
+    image = decode_image(png.getvalue())
+    assert image.shape == (3, 6, 3)
+    assert tuple(image[0, 0]) == (0, 0, 0)
+    assert tuple(image[2, 5]) == (255, 255, 255)
+    assert tuple(image[0, 1]) == (127, 127, 255)
+
+
+def test_decode_image_rejects_garbage():
+    with pytest.raises(ValueError):
+        decode_image(b"not an image")
@@ -0,0 +1,122 @@
+import os
+import sys
+import weakref
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fitz
+
+from tools import ocr_registry
+from tools.ocr_registry import OCRModelRegistry
+from tools.ocr_service import OCRService
+from tools.pdf_ocr_loader import PDFOCRLoader
+
+
+class FakeReader:
+    def __init__(self, languages):
+        self.languages = languages
+
+    def readtext(self, image, detail=1):
+        return ["扫描页"] if detail == 0 else [([0, 0], "上传图片", 0.9)]
+
+
+def test_readers_are_shared_warmed_and_unloaded_when_idle():
+    loads = []
+
+    def factory(languages, gpu):
+        loads.append(list(languages))
+        return FakeReader(languages)
+
+    registry = OCRModelRegistry(factory=factory, idle_seconds=60)
+    try:
+        registry.warm_up(["ch_sim", "en"]).join()
+        reader = registry.get(["en", "ch_sim"])
+        assert registry.get(["ch_sim", "en"]) is reader
+        assert registry.get(["en"]) is not reader
+        assert loads == [["ch_sim", "en"], ["en"]]
+
+        [stats] = [s for s in registry.stats() if s["languages"] == ["ch_sim", "en"]]
+        assert stats["loaded"] and stats["loads"] == 1 and stats["uses"] == 3
+        assert stats["load_seconds"] >= 0 and "resident_bytes" in stats
+
+        last_used = max(e.last_used for e in registry._entries.values())
+        assert registry.unload_idle(now=last_used + 1) == []
+        assert sorted(registry.unload_idle(now=last_used + 61)) == [("ch_sim", "en"), ("en",)]
+        assert not any(s["loaded"] for s in registry.stats())
+
+        assert registry.get(["ch_sim", "en"]) is not reader
+        assert len(loads) == 3
+    finally:
+        registry.close()
+
+
+def test_reader_in_use_is_not_unloaded_as_idle(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(ocr_registry.time, "monotonic", lambda: clock[0])
+    registry = OCRModelRegistry(
+        factory=lambda languages, gpu: FakeReader(languages), idle_seconds=60
+    )
+    try:
+        with registry.use(["en"]) as reader:
+            # 长时间识别期间不能被当作空闲卸载
+            clock[0] += 600
+            assert registry.unload_idle() == []
+            assert registry.stats()[0]["active"] == 1
+        # 空闲时间从任务结束时算起
+        clock[0] += 30
+        assert registry.unload_idle() == []
+        assert registry.get(["en"]) is reader
+        clock[0] += 61
+        assert registry.unload_idle() == [("en",)]
+        assert registry.stats()[0]["active"] == 0
+    finally:
+        registry.close()
+
+
+def test_ocr_service_and_pdf_loader_share_one_reader(monkeypatch, tmp_path):
+    monkeypatch.setenv("RAG_OCR_CACHE", "0")
+    loads = []
+
+    def factory(languages, gpu):
+        loads.append(list(languages))
+        return FakeReader(languages)
+
+    registry = OCRModelRegistry(factory=factory, idle_seconds=0)
+    monkeypatch.setattr(ocr_registry, "get_ocr_registry", lambda: registry)
+    monkeypatch.setattr("tools.ocr_service.get_ocr_registry", lambda: registry)
+
+    path = tmp_path / "scan.pdf"
+    pdf = fitz.open()
+    pdf.new_page().draw_rect(fitz.Rect(10, 10, 90, 90), color=(0, 0, 0), fill=(0, 0, 0))
+    pdf.save(str(path))
+    pdf.close()
+
+    [page] = PDFOCRLoader(str(path)).load()
+    service = OCRService()
+    service.warm_up(background=False)
+    assert service.extract_text_from_image(fitz.open(str(path))[0].get_pixmap().tobytes("png")) == "上传图片"
+
+    assert page.page_content == "扫描页"
+    assert loads == [["ch_sim", "en"]]
+    assert service.model_stats()[0]["uses"] == 3
+
+
+def test_pdf_loader_does_not_keep_reader_alive(monkeypatch, tmp_path):
+    monkeypatch.setenv("RAG_OCR_CACHE", "0")
+    registry = OCRModelRegistry(
+        factory=lambda languages, gpu: FakeReader(languages), idle_seconds=0
+    )
+    monkeypatch.setattr(ocr_registry, "get_ocr_registry", lambda: registry)
+
+    path = tmp_path / "scan.pdf"
+    pdf = fitz.open()
+    pdf.new_page().draw_rect(fitz.Rect(10, 10, 90, 90), color=(0, 0, 0), fill=(0, 0, 0))
+    pdf.save(str(path))
+    pdf.close()
+
+    loader = PDFOCRLoader(str(path))
+    assert [d.page_content for d in loader.load()] == ["扫描页"]
+    reader = weakref.ref(registry.get(["ch_sim", "en"]))
+    # 注册表卸载后模型应被回收，加载器不再持有引用
+    registry.unload()
+    assert reader() is None
+    assert loader.load()[0].page_content == "扫描页"
@@ -0,0 +1,98 @@
+import io
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fitz
+import numpy as np
+from PIL import Image
+
+from tools.pdf_ocr_loader import PDFOCRLoader, shutdown_ocr_pools
+
+COLORS = {"red": (1, 0, 0), "green": (0, 1, 0), "blue": (0, 0, 1)}
+
+
+class ColorReader:
+    """Stands in for easyocr: "reads" the colour filling the page."""
+
+    def readtext(self, image, detail=0):
+        if isinstance(image, bytes):
+            image = np.array(Image.open(io.BytesIO(image)).convert("RGB"))
+        r, g, b = image[image.shape[0] // 2, image.shape[1] // 2][:3]
+        name = {(255, 0, 0): "red", (0, 255, 0): "green", (0, 0, 255): "blue"}[
+            (int(r), int(g), int(b))
+        ]
+        return [name, f"{os.getpid()}:{id(self)}"]
+
+
+_readers = {}
+
+
+def color_reader(languages, gpu):
+    # 与默认的 shared_reader 一样，每个进程只创建一个 reader
+    return _readers.setdefault(os.getpid(), ColorReader())
+
+
+def _scanned_pdf(path, colors):
+    pdf = fitz.open()
+    for color in colors:
+        page = pdf.new_page()
+        if color == "text":
+            page.insert_text((72, 72), "Text layer page with more than fifty characters on it.")
+        else:
+            page.draw_rect(page.rect, color=COLORS[color], fill=COLORS[color])
+    pdf.save(str(path))
+    pdf.close()
+
+
+def test_parallel_ocr_preserves_page_order(monkeypatch, tmp_path):
+    monkeypatch.setenv("RAG_OCR_CACHE", "0")
+    path = tmp_path / "scan.pdf"
+    colors = ["red", "text", "green", "blue", "red", "green"]
+    _scanned_pdf(path, colors)
+
+    serial = PDFOCRLoader(str(path), workers=1, reader_factory=color_reader).load()
+    loader = PDFOCRLoader(str(path), workers=2, reader_factory=color_reader)
+    try:
+        docs = loader.load()
+        again = PDFOCRLoader(str(path), workers=2, reader_factory=color_reader).load()
+    finally:
+        shutdown_ocr_pools()
+
+    for result in (serial, docs):
+        assert [d.metadata["page"] for d in result] == [1, 2, 3, 4, 5, 6]
+        assert [d.page_content.split("\n")[0] for d in result] == [
+            c if c != "text" else "Text layer page with more than fifty characters on it."
+            for c in colors
+        ]
+    assert sorted(loader.page_timings) == [1, 2, 3, 4, 5, 6]
+    assert all(seconds >= 0 for seconds in loader.page_timings.values())
+
+    # 每个工作进程只创建一个 reader，并在多个 PDF 之间复用
+    readers = {}
+    for doc in docs + again:
+        if doc.metadata["page"] == 2:
+            continue
+        pid, reader = doc.page_content.split("\n")[1].split(":")
+        readers.setdefault(pid, set()).add(reader)
+    assert str(os.getpid()) not in readers
+    assert all(len(ids) == 1 for ids in readers.values())
+
+
+def test_lazy_load_yields_pages_before_later_ones_are_ocrd(monkeypatch, tmp_path):
+    monkeypatch.setenv("RAG_OCR_CACHE", "0")
+    path = tmp_path / "scan.pdf"
+    _scanned_pdf(path, ["red", "green", "text", "blue"])
+    calls = []
+
+    class CountingReader(ColorReader):
+        def readtext(self, image, detail=0):
+            calls.append(1)
+            return super().readtext(image, detail)[:1]
+
+    pages = PDFOCRLoader(str(path), workers=1, reader_factory=lambda l, g: CountingReader()).lazy_load()
+
+    first = next(pages)
+    assert (first.metadata["page"], first.page_content, len(calls)) == (1, "red", 1)
+    assert [d.metadata["page"] for d in pages] == [2, 3, 4]
+    assert len(calls) == 3
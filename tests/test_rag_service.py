@@ -6,6 +6,7 @@ from langchain_core.documents import Document
 from langchain_community.embeddings import FakeEmbeddings
 from langchain_community.document_loaders import UnstructuredFileLoader
 from docx import Document as DocxDocument
+from hashlib import sha256
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -97,7 +98,8 @@ def test_ingest_paths_import_error(monkeypatch, tmp_path, caplog):
     assert "Failed to load" in caplog.text
 
 
-def test_ingest_pdf(tmp_path):
+def test_ingest_pdf(monkeypatch, tmp_path):
+    monkeypatch.setenv("RAG_OCR_CACHE_PATH", str(tmp_path / "ocr.sqlite"))
     pdf_b64 = (
         "JVBERi0xLjUKMSAwIG9iaiA8PCAvVHlwZSAvQ2F0YWxvZyAvUGFnZXMgMiAwIFIgPj4gZW5k"
         "b2JqCjIgMCBvYmogPDwgL1R5cGUgL1BhZ2VzIC9LaWRzIFszIDAgUl0gL0NvdW50IDEgPj4g"
@@ -140,3 +142,605 @@ def test_ingest_docx(tmp_path):
     assert err is None
     docs = service.get_retriever().get_relevant_documents("playful")
     assert any("Cats are playful animals" in d.page_content for d in docs)
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    calls: list = []
+    failures: int = 0
+
+    def embed_documents(self, texts):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("rate limited")
+        self.calls.append(list(texts))
+        return super().embed_documents(texts)
+
+
+def _counting_service(monkeypatch, tmp_path, embeddings, **kwargs):
+    monkeypatch.setenv("RAG_EMBED_BACKOFF", "0")
+    return RAGService(
+        embeddings=embeddings,
+        persist_directory=str(tmp_path),
+        use_multiquery=False,
+        embedding_cache=False,
+        **kwargs,
+    )
+
+
+def test_ingest_documents_batches_and_upserts(monkeypatch, tmp_path):
+    embeddings = CountingEmbeddings(size=32, calls=[])
+    service = _counting_service(
+        monkeypatch, tmp_path, embeddings, embed_batch_size=2, embed_workers=2
+    )
+    docs = [Document(page_content=f"chunk {i}") for i in range(5)]
+    docs.append(Document(page_content="chunk 0"))
+
+    ids = service.ingest_documents(docs)
+    assert ids == [
+        sha256(f"chunk {i}".encode("utf-8")).hexdigest() for i in range(5)
+    ]
+    assert sorted(len(c) for c in embeddings.calls) == [1, 2, 2]
+    assert sorted(service._get_vectorstore().get()["ids"]) == sorted(ids)
+
+    embeddings.calls.clear()
+    again = [Document(page_content=f"chunk {i}") for i in range(6)]
+    service.ingest_documents(again)
+    assert embeddings.calls == [["chunk 5"]]
+
+
+def test_ingest_documents_retries_failed_batches(monkeypatch, tmp_path):
+    embeddings = CountingEmbeddings(size=32, calls=[], failures=2)
+    service = _counting_service(monkeypatch, tmp_path, embeddings, embed_retries=2)
+
+    service.ingest_documents([Document(page_content="Cats are great pets")])
+    assert embeddings.calls == [["Cats are great pets"]]
+
+
+def test_delete_documents(monkeypatch, tmp_path):
+    service = _counting_service(monkeypatch, tmp_path, CountingEmbeddings(size=32))
+    ids = service.ingest_documents(
+        [Document(page_content="keep me"), Document(page_content="drop me")]
+    )
+    service.delete_documents([ids[1]])
+    assert service._get_vectorstore().get()["ids"] == [ids[0]]
+
+
+def test_hybrid_retriever_finds_exact_terms(monkeypatch, tmp_path):
+    service = _counting_service(monkeypatch, tmp_path, CountingEmbeddings(size=32))
+    service.ingest_documents(
+        [Document(page_content=f"第{i}章 数据挖掘概述") for i in range(10)]
+        + [Document(page_content="DIKW 金字塔模型")]
+    )
+    retriever = service.get_retriever(k=2, mode="hybrid")
+    docs = retriever.invoke("DIKW")
+    assert docs[0].page_content == "DIKW 金字塔模型"
+    assert set(retriever.last_timings) >= {"vector", "lexical", "fusion"}
+
+    service.delete_documents([docs[0].metadata["doc_hash"]])
+    assert service.lexical_index().search("DIKW") == []
+
+
+def test_lexical_index_shared_between_service_instances(monkeypatch, tmp_path):
+    server = _counting_service(monkeypatch, tmp_path, CountingEmbeddings(size=32))
+    server.ingest_documents([Document(page_content="HDFS 分布式文件系统")])
+    assert server.lexical_index().search("HDFS")
+
+    cli = _counting_service(monkeypatch, tmp_path, CountingEmbeddings(size=32))
+    cli.ingest_documents([Document(page_content="DIKW 金字塔模型")])
+    # 服务端能看到另一实例导入的 chunk，且随后的保存不会把它们抹掉
+    assert server.lexical_index().search("DIKW")
+    server.ingest_documents([Document(page_content="Spark 内存计算框架")])
+
+    restarted = _counting_service(monkeypatch, tmp_path, CountingEmbeddings(size=32))
+    for term in ("HDFS", "DIKW", "Spark"):
+        assert restarted.lexical_index().search(term), term
+
+
+def test_scoped_retriever_single_filtered_query(monkeypatch, tmp_path):
+    service = _counting_service(monkeypatch, tmp_path, CountingEmbeddings(size=32))
+    service.ingest_documents(
+        [
+            Document(page_content=f"{name} page {i}", metadata={"source": name})
+            for name in ("a.pdf", "b.pdf", "c.pdf")
+            for i in range(3)
+        ]
+    )
+    queries = []
+    monkeypatch.setattr(
+        CountingEmbeddings,
+        "embed_query",
+        lambda self, text: queries.append(text) or [0.1] * 32,
+    )
+    bank = Document(page_content="Q1", metadata={"source": "question_bank"})
+
+    retriever = service.scoped_retriever(["b.pdf", "a.pdf"], k=10, extra_documents=[bank])
+    docs = retriever.invoke("page")
+
+    assert queries == ["page"]
+    assert {d.metadata["source"] for d in docs[:-1]} == {"a.pdf", "b.pdf"}
+    assert len(docs) == 7 and docs[-1] is bank
+    assert service.scoped_retriever(["a.pdf", "b.pdf"], k=10, extra_documents=[bank]) is retriever
+    assert service.scoped_retriever(["c.pdf"], k=10) is not retriever
+
+
+def test_scoped_retriever_compresses_documents(monkeypatch, tmp_path):
+    service = _counting_service(monkeypatch, tmp_path, CountingEmbeddings(size=32))
+    page = "课程介绍。HDFS 块大小为 128MB。签到规则说明。实验安排说明。作业提交说明。"
+    service.ingest_documents([Document(page_content=page, metadata={"source": "a.pdf"})])
+
+    retriever = service.scoped_retriever(["a.pdf"], k=1, compress=True)
+    docs = retriever.invoke("HDFS 块大小")
+
+    assert retriever is not service.scoped_retriever(["a.pdf"], k=1)
+    assert "128MB" in docs[0].page_content
+    assert len(docs[0].page_content) < len(page)
+    assert retriever.last_compression["ratio"] < 1
+    assert "compression" in retriever.last_timings
+
+
+def test_numpy_vector_backend_round_trip(monkeypatch, tmp_path):
+    from tools.embedding_backends import HashingEmbeddings
+
+    service = _counting_service(
+        monkeypatch, tmp_path, HashingEmbeddings(size=64), vector_backend="numpy"
+    )
+    service.ingest_documents(
+        [
+            Document(page_content="HDFS 分布式文件系统", metadata={"source": "a.pdf", "page": 1}),
+            Document(page_content="Spark 内存计算框架", metadata={"source": "b.pdf", "page": 1}),
+        ]
+    )
+    assert os.path.exists(tmp_path / "numpy_index" / "vectors.npy")
+
+    reloaded = _counting_service(
+        monkeypatch, tmp_path, HashingEmbeddings(size=64), vector_backend="numpy"
+    )
+    docs = reloaded.search("Spark 计算", k=1)
+    assert docs[0].metadata["source"] == "b.pdf"
+    assert reloaded.search("Spark", k=2, sources=["a.pdf"])[0].metadata["source"] == "a.pdf"
+
+    reloaded.delete_documents([docs[0].metadata["doc_hash"]])
+    assert [d.metadata["source"] for d in reloaded.search("Spark", k=2)] == ["a.pdf"]
+
+
+def test_numpy_backend_shared_between_processes(monkeypatch, tmp_path):
+    from tools.embedding_backends import HashingEmbeddings
+
+    def _service():
+        return _counting_service(
+            monkeypatch, tmp_path, HashingEmbeddings(size=64), vector_backend="numpy"
+        )
+
+    def _doc(name):
+        return Document(page_content=f"{name} 的内容", metadata={"source": name})
+
+    server, cli = _service(), _service()
+    server.ingest_documents([_doc("a.pdf")])
+    cli.ingest_documents([_doc("b.pdf")])
+    # 服务端随后写入时不能覆盖掉命令行刚导入的内容
+    server.ingest_documents([_doc("c.pdf")])
+    assert {d.metadata["source"] for d in server.search("内容", k=5)} == {
+        "a.pdf",
+        "b.pdf",
+        "c.pdf",
+    }
+
+    restarted = _service()
+    sources = {m["source"] for m in restarted._get_vectorstore().get()["metadatas"]}
+    assert sources == {"a.pdf", "b.pdf", "c.pdf"}
+
+
+def test_namespaces_isolate_user_uploads(monkeypatch, tmp_path):
+    from tools.embedding_backends import HashingEmbeddings
+    from tools.rag_service import COURSE_NAMESPACE, user_namespace
+
+    service = _counting_service(monkeypatch, tmp_path, HashingEmbeddings(size=64))
+    service.ingest_documents(
+        [Document(page_content="HDFS 分布式文件系统", metadata={"source": "course.pdf"})]
+    )
+    service.ingest_documents(
+        [Document(page_content="HDFS 课堂笔记 alice", metadata={"source": "alice.pdf"})],
+        namespace=user_namespace("alice"),
+    )
+    service.ingest_documents(
+        [Document(page_content="HDFS 课堂笔记 张三", metadata={"source": "bob.pdf"})],
+        namespace=user_namespace("张三"),
+    )
+
+    assert service.visible_namespaces("alice", "teacher") == [COURSE_NAMESPACE]
+    alice = service.visible_namespaces("alice", "student")
+    assert alice == [COURSE_NAMESPACE, user_namespace("alice")]
+
+    assert [d.metadata["source"] for d in service.search("HDFS", k=5)] == ["course.pdf"]
+    sources = {d.metadata["source"] for d in service.search("HDFS", k=5, namespaces=alice)}
+    assert sources == {"course.pdf", "alice.pdf"}
+    hybrid = service.search("HDFS", k=5, namespaces=alice, search_type="hybrid")
+    assert {d.metadata["source"] for d in hybrid} == {"course.pdf", "alice.pdf"}
+
+    retriever = service.scoped_retriever(["alice.pdf"], k=2, namespaces=alice)
+    assert [d.metadata["source"] for d in retriever.invoke("HDFS")] == ["alice.pdf"]
+    assert retriever is not service.scoped_retriever(["alice.pdf"], k=2)
+
+
+def test_snapshot_export_import_skips_embedding(monkeypatch, tmp_path):
+    monkeypatch.setenv("RAG_SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    source = _counting_service(monkeypatch, tmp_path / "a", CountingEmbeddings(size=32))
+    source.ingest_documents(
+        [Document(page_content=f"chunk {i}", metadata={"source": "a.pdf"}) for i in range(5)]
+    )
+    path = source.export_snapshot()
+    assert source.latest_snapshot_path() == path
+
+    embeddings = CountingEmbeddings(size=32, calls=[])
+    target = _counting_service(monkeypatch, tmp_path / "b", embeddings)
+    assert target.import_snapshot(path) == 5
+    assert embeddings.calls == []
+    assert sorted(target._get_vectorstore().get()["ids"]) == sorted(
+        source._get_vectorstore().get()["ids"]
+    )
+    assert target.search("chunk 3", k=5, search_type="hybrid")
+
+
+def test_corrupted_store_restored_from_latest_snapshot(monkeypatch, tmp_path):
+    import tools.rag_service as rag_module
+
+    monkeypatch.setenv("RAG_SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    service = _counting_service(monkeypatch, tmp_path / "old", CountingEmbeddings(size=32))
+    service.ingest_documents([Document(page_content="kept", metadata={"source": "a.pdf"})])
+    service.export_snapshot()
+
+    real_chroma = rag_module.Chroma
+    failures = []
+
+    def flaky_chroma(*args, **kwargs):
+        if not failures:
+            failures.append(True)
+            raise RuntimeError("corrupted")
+        return real_chroma(*args, **kwargs)
+
+    monkeypatch.setattr(rag_module, "Chroma", flaky_chroma)
+    restored = _counting_service(monkeypatch, tmp_path / "db", CountingEmbeddings(size=32))
+    assert [d.page_content for d in restored.search("kept", k=1)] == ["kept"]
+    assert failures == [True]
+
+
+def test_corruption_restores_user_namespaces_and_reports_lost_ones(
+    monkeypatch, tmp_path, caplog
+):
+    import logging
+
+    import tools.rag_service as rag_module
+    from tools.rag_service import user_namespace
+
+    monkeypatch.setenv("RAG_SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    service = _counting_service(monkeypatch, tmp_path / "db", CountingEmbeddings(size=32))
+    service.ingest_documents([Document(page_content="course", metadata={"source": "a.pdf"})])
+    for name in ("alice", "bob"):
+        service.ingest_documents(
+            [Document(page_content=f"{name} notes", metadata={"source": f"{name}.pdf"})],
+            namespace=user_namespace(name),
+        )
+    service.export_snapshot()
+    service.export_snapshot(namespace=user_namespace("alice"))
+    # 模拟新进程：释放 Chroma 在进程内缓存的数据库连接
+    from chromadb.api.client import SharedSystemClient
+
+    SharedSystemClient.clear_system_cache()
+
+    real_chroma = rag_module.Chroma
+    failures = []
+
+    def flaky_chroma(*args, **kwargs):
+        if not failures:
+            failures.append(True)
+            raise RuntimeError("corrupted")
+        return real_chroma(*args, **kwargs)
+
+    monkeypatch.setattr(rag_module, "Chroma", flaky_chroma)
+    with caplog.at_level(logging.ERROR, logger="tools.rag_service"):
+        restored = _counting_service(
+            monkeypatch, tmp_path / "db", CountingEmbeddings(size=32)
+        )
+        restored._get_vectorstore()
+    assert failures == [True]
+
+    def contents(namespace):
+        return restored._get_vectorstore(namespace).get()["documents"]
+
+    assert contents(rag_module.COURSE_NAMESPACE) == ["course"]
+    assert contents(user_namespace("alice")) == ["alice notes"]
+    assert contents(user_namespace("bob")) == []
+    lost = [r.getMessage() for r in caplog.records if "user collection" in r.getMessage()]
+    assert len(lost) == 1 and "user_bob" in lost[0] and "user_alice" not in lost[0]
+
+
+def test_restored_snapshot_keeps_ingest_manifest(monkeypatch, tmp_path):
+    import tools.ingest as ingest
+    import tools.rag_service as rag_module
+
+    monkeypatch.setenv("RAG_SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    folder = tmp_path / "files"
+    folder.mkdir()
+    (folder / "a.txt").write_text("manifest notes", encoding="utf-8")
+    service = _counting_service(monkeypatch, tmp_path / "old", CountingEmbeddings(size=32))
+    monkeypatch.setattr(ingest, "get_rag_service", lambda: service)
+    assert ingest.ingest_folder(str(folder), workers=1, report_interval=0) == (1, 1)
+    service.export_snapshot()
+
+    real_chroma = rag_module.Chroma
+    failures = []
+
+    def flaky_chroma(*args, **kwargs):
+        if not failures:
+            failures.append(True)
+            raise RuntimeError("corrupted")
+        return real_chroma(*args, **kwargs)
+
+    monkeypatch.setattr(rag_module, "Chroma", flaky_chroma)
+    embeddings = CountingEmbeddings(size=32, calls=[])
+    restored = _counting_service(monkeypatch, tmp_path / "db", embeddings)
+    restored._get_vectorstore()
+    assert failures == [True]
+    assert os.path.exists(restored.manifest_path)
+
+    # 恢复后清单仍在，未改动的文件不会被重新嵌入
+    monkeypatch.setattr(ingest, "get_rag_service", lambda: restored)
+    assert ingest.ingest_folder(str(folder), workers=1, report_interval=0) == (0, 0)
+    assert embeddings.calls == []
+
+
+def test_embedding_cache_survives_store_rebuild(monkeypatch, tmp_path):
+    import tools.rag_service as rag_module
+
+    monkeypatch.delenv("RAG_EMBED_CACHE_PATH", raising=False)
+    monkeypatch.delenv("RAG_CACHE_DIR", raising=False)
+    monkeypatch.setenv("RAG_SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    embeddings = CountingEmbeddings(size=32, calls=[])
+
+    def _service():
+        return RAGService(
+            embeddings=embeddings,
+            persist_directory=str(tmp_path / "db"),
+            use_multiquery=False,
+            embedding_cache=True,
+        )
+
+    _service().ingest_documents([Document(page_content="cached chunk")])
+    assert os.path.exists(tmp_path / "cache" / "embedding_cache.sqlite")
+
+    real_chroma = rag_module.Chroma
+    failures = []
+
+    def flaky_chroma(*args, **kwargs):
+        if not failures:
+            failures.append(True)
+            raise RuntimeError("corrupted")
+        return real_chroma(*args, **kwargs)
+
+    monkeypatch.setattr(rag_module, "Chroma", flaky_chroma)
+    # 持久化目录被整个删除重建后，重新导入仍命中嵌入缓存
+    _service().ingest_documents([Document(page_content="cached chunk")])
+    assert failures == [True]
+    assert embeddings.calls == [["cached chunk"]]
+
+
+def test_search_results_cached_until_index_changes(monkeypatch, tmp_path):
+    service = _counting_service(monkeypatch, tmp_path, CountingEmbeddings(size=32))
+    service.ingest_documents([Document(page_content="alpha", metadata={"source": "a"})])
+    queries = []
+    monkeypatch.setattr(
+        CountingEmbeddings,
+        "embed_query",
+        lambda self, text: queries.append(text) or [0.1] * 32,
+    )
+
+    first = service.search("Alpha?", k=4, sources=["a"])
+    timings = {}
+    second = service.search("alpha", k=4, sources=["a"], timings=timings)
+    assert [d.page_content for d in first] == [d.page_content for d in second]
+    assert len(queries) == 1 and "cache" in timings
+
+    service.ingest_documents([Document(page_content="beta", metadata={"source": "a"})])
+    third = service.search("alpha", k=4, sources=["a"])
+    assert len(queries) == 2
+    assert {d.page_content for d in third} == {"alpha", "beta"}
+    assert service.retrieval_cache_stats()["hits"] == 1
+
+
+def test_embedding_backend_registry(tmp_path):
+    service = RAGService(
+        persist_directory=str(tmp_path),
+        use_multiquery=False,
+        embedding_backend="hash",
+    )
+    assert service._embeddings.namespace.endswith("hash-256")
+    service.ingest_documents(
+        [Document(page_content="HDFS 副本机制"), Document(page_content="数据可视化")]
+    )
+    docs = service.search("HDFS 副本", k=1)
+    assert docs[0].page_content == "HDFS 副本机制"
+
+
+def test_async_search_matches_sync(tmp_path):
+    import asyncio
+    from tools.rag_utils import aget_context_or_empty
+
+    service = RAGService(
+        persist_directory=str(tmp_path),
+        use_multiquery=False,
+        embedding_backend="hash",
+    )
+    service.ingest_documents(
+        [
+            Document(page_content="MapReduce 编程模型", metadata={"source": "a.pdf"}),
+            Document(page_content="数据可视化工具", metadata={"source": "b.pdf"}),
+        ]
+    )
+    retriever = service.scoped_retriever(["a.pdf"], k=1)
+
+    async def _context():
+        context = await aget_context_or_empty("编程模型", retriever)
+        # 统计只在发起检索的任务内可见
+        return context, retriever.last_timings
+
+    async def _run():
+        return await asyncio.gather(
+            service.asearch("MapReduce", k=1, search_type="hybrid"),
+            _context(),
+        )
+
+    docs, (context, timings) = asyncio.run(_run())
+    assert docs[0].page_content == "MapReduce 编程模型"
+    assert context == "MapReduce 编程模型"
+    assert "vector" in timings
+    assert retriever.last_timings == {}
+
+
+def test_shared_retriever_keeps_stats_per_request(monkeypatch, tmp_path):
+    import asyncio
+
+    service = _counting_service(monkeypatch, tmp_path, CountingEmbeddings(size=32))
+    service.ingest_documents([Document(page_content="HDFS", metadata={"source": "a.pdf"})])
+    retriever = service.scoped_retriever(["a.pdf"], k=1)
+    real_asearch = service.asearch
+
+    async def asearch(query, timings=None, **kwargs):
+        docs = await real_asearch(query, timings=timings, **kwargs)
+        timings["query"] = len(query)
+        return docs
+
+    monkeypatch.setattr(service, "asearch", asearch)
+
+    async def request(query, done, other):
+        await retriever.ainvoke(query)
+        done.set()
+        # 等另一个请求也用同一个检索器检索完，再读本请求的统计
+        await other.wait()
+        return retriever.last_timings["query"]
+
+    async def _run():
+        first, second = asyncio.Event(), asyncio.Event()
+        return await asyncio.gather(
+            request("x", first, second), request("yyy", second, first)
+        )
+
+    assert asyncio.run(_run()) == [1, 3]
+
+
+def test_ingest_drops_near_duplicate_chunks(monkeypatch, tmp_path):
+    embeddings = CountingEmbeddings(size=32, calls=[])
+    service = _counting_service(monkeypatch, tmp_path, embeddings)
+    body = "数据仓库面向主题、集成、相对稳定并反映历史变化，用于支持管理决策。" * 3
+    docs = [
+        Document(page_content=f"第{i}页 {body}", metadata={"source": "a.pdf", "page": i})
+        for i in range(3)
+    ]
+    ids = service.ingest_documents(docs)
+    assert len(set(ids)) == 1
+    assert docs[1].metadata["duplicate_of"] == ids[0]
+    assert sum(len(c) for c in embeddings.calls) == 1
+    assert len(service._get_vectorstore().get()["ids"]) == 1
+
+    # 同一来源的新版本替换旧版本，而不是被当作重复丢弃
+    updated = Document(page_content=f"修订 {body}", metadata={"source": "a.pdf"})
+    [new_id] = service.ingest_documents([updated])
+    assert new_id != ids[0]
+    service.delete_documents([ids[0]])
+    assert service.near_duplicate_index().find(docs[0].page_content, "a.pdf") == new_id
+
+
+def test_hnsw_parameters_and_tune(monkeypatch, tmp_path):
+    monkeypatch.setenv("RAG_HNSW_M", "24")
+    service = _counting_service(
+        monkeypatch, tmp_path, CountingEmbeddings(size=32), hnsw_ef_search=30
+    )
+    service.ingest_documents([Document(page_content="hnsw", metadata={"source": "a"})])
+    params = service.search_params()
+    assert params["hnsw"]["max_neighbors"] == 24
+    assert params["hnsw"]["ef_search"] == 30
+
+    params = service.tune(k=7, mmr_fetch_k=40, ef_search=80)
+    assert params["k"] == 7
+    assert params["mmr_fetch_k"] == 40
+    assert params["hnsw"]["ef_search"] == 80
+    assert len(service.search("hnsw")) == 1
+
+
+
+def test_retrieve_many_batches_embedding_and_search(monkeypatch, tmp_path):
+    from tools.embedding_backends import HashingEmbeddings
+
+    class BatchCounting(HashingEmbeddings):
+        batches: list = []
+
+        def embed_queries(self, texts):
+            self.batches.append(list(texts))
+            return super().embed_queries(texts)
+
+    monkeypatch.setenv("RAG_RESULT_CACHE_SIZE", "0")
+    queries = ["Spark RDD", "HDFS 数据块", "HBase RowKey", "Spark RDD"]
+    scope = ["a.pdf", "b.pdf"]
+    for backend in ("chroma", "numpy"):
+        embeddings = BatchCounting(size=64)
+        service = _counting_service(
+            monkeypatch, tmp_path / backend, embeddings, vector_backend=backend
+        )
+        service.ingest_documents(
+            [
+                Document(page_content="HDFS 分布式文件系统 数据块", metadata={"source": "a.pdf"}),
+                Document(page_content="Spark 内存计算框架 RDD", metadata={"source": "b.pdf"}),
+                Document(page_content="HBase 列式存储 RowKey", metadata={"source": "b.pdf"}),
+            ]
+        )
+
+        for search_type in ("similarity", "mmr", "hybrid"):
+            embeddings.batches.clear()
+            batched = service.retrieve_many(queries, scope=scope, k=2, search_type=search_type)
+            assert embeddings.batches == [["Spark RDD", "HDFS 数据块", "HBase RowKey"]]
+            for query, docs in zip(queries, batched):
+                single = service.search(query, k=2, sources=scope, search_type=search_type)
+                assert {d.page_content for d in docs} == {d.page_content for d in single}
+                if search_type in ("similarity", "mmr"):
+                    assert [d.page_content for d in docs] == [d.page_content for d in single]
+                if search_type == "similarity":
+                    assert abs(docs[0].metadata["score"] - single[0].metadata["score"]) < 1e-3
+
+        only_a = service.retrieve_many(["Spark"], scope=["a.pdf"], k=2)[0]
+        assert [d.metadata["source"] for d in only_a] == ["a.pdf"]
+
+        retriever = service.scoped_retriever(["b.pdf"], k=1)
+        assert [docs[0].page_content for docs in retriever.retrieve_many(["Spark", "HBase"])] == [
+            "Spark 内存计算框架 RDD",
+            "HBase 列式存储 RowKey",
+        ]
+
+
+def test_retrieve_many_keeps_mmr_selection_order(monkeypatch, tmp_path):
+    from langchain_core.embeddings import Embeddings
+
+    # near 与 top 几乎重复，MMR 先选更多样的 other，与相似度顺序不同
+    vectors = {
+        "top": [0.95, 0.31, 0.0],
+        "near": [0.94, 0.34, 0.0],
+        "other": [0.8, -0.6, 0.0],
+    }
+
+    class FixedEmbeddings(Embeddings):
+        def embed_documents(self, texts):
+            return [vectors[t] for t in texts]
+
+        def embed_query(self, text):
+            return [1.0, 0.0, 0.0]
+
+    monkeypatch.setenv("RAG_RESULT_CACHE_SIZE", "0")
+    for backend in ("chroma", "numpy"):
+        service = _counting_service(
+            monkeypatch, tmp_path / backend, FixedEmbeddings(), vector_backend=backend
+        )
+        service.ingest_documents(
+            [Document(page_content=t, metadata={"source": "a.pdf"}) for t in vectors]
+        )
+        single = service.search("q", k=3, search_type="mmr")
+        batched = service.retrieve_many(["q"], k=3, search_type="mmr")[0]
+        assert [d.page_content for d in single] == ["top", "other", "near"]
+        assert [d.page_content for d in batched] == ["top", "other", "near"]
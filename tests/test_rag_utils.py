@@ -3,7 +3,7 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from langchain_core.documents import Document
-from tools.rag_utils import get_context_or_empty
+from tools.rag_utils import get_context_or_empty, get_contexts_or_empty
 
 
 class DummyRetriever:
@@ -33,3 +33,20 @@ def test_get_context_or_empty_filters_irrelevant():
     retriever = DummyRetriever([Document(page_content="quantum physics notes")])
 
     assert get_context_or_empty("art history", retriever) == "quantum physics notes"
+
+
+def test_get_contexts_or_empty_uses_batched_retrieval():
+    class BatchRetriever(DummyRetriever):
+        calls = []
+
+        def retrieve_many(self, queries):
+            self.calls.append(list(queries))
+            return [[Document(page_content=f"ctx {q}")] if q != "none" else [] for q in queries]
+
+    retriever = BatchRetriever([])
+    assert get_contexts_or_empty(["a", "none", "b"], retriever) == ["ctx a", "", "ctx b"]
+    assert retriever.calls == [["a", "none", "b"]]
+
+    plain = DummyRetriever([Document(page_content="x")])
+    assert get_contexts_or_empty(["a", "b"], plain) == ["x", "x"]
+    assert get_contexts_or_empty(["a"], None) == [""]
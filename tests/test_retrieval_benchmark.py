@@ -0,0 +1,169 @@
+import json
+import os
+import sys
+
+import fitz
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.retrieval_benchmark import (
+    MODES,
+    BenchmarkQuery,
+    CourseMap,
+    build_query_set,
+    evaluate_mode,
+    first_hit_rank,
+    log_queries,
+    main,
+    parse_question_file,
+)
+from langchain_core.documents import Document
+
+QUESTIONS = """一、单选题
+1. HDFS 的数据块默认有几个副本? ( B )
+A. 1
+B. 3
+2. (   ) 负责管理 HDFS 的命名空间.   (A)
+NameNode
+DataNode
+
+二、判断题
+MapReduce 的 Map 阶段输出键值对。   ( √ )
+"""
+
+HDFS = (
+    "HDFS 分布式文件系统把文件切分为数据块，每个数据块默认保存三个副本。"
+    "NameNode 管理命名空间和数据块映射，DataNode 保存数据块并定期发送心跳。"
+)
+MAPREDUCE = (
+    "MapReduce 计算模型把任务分为 Map 和 Reduce 两个阶段。Map 阶段读取输入分片"
+    "并输出中间键值对，Reduce 阶段按键归并并输出最终结果。"
+)
+
+
+def _pdf(path, text):
+    pdf = fitz.open()
+    page = pdf.new_page()
+    page.insert_textbox(fitz.Rect(50, 50, 550, 800), text, fontname="china-s", fontsize=11)
+    pdf.save(str(path))
+    pdf.close()
+
+
+def _fixture(tmp_path):
+    books = tmp_path / "Book"
+    books.mkdir()
+    _pdf(books / "1.pdf", HDFS)
+    _pdf(books / "2.pdf", MAPREDUCE)
+    tree = {
+        "root_name": "大数据",
+        "children": [
+            {
+                "name": "数据存储系统",
+                "grandchildren": [
+                    {"name": "HDFS架构", "resource_path": ["data/Book/1.PDF"]},
+                ],
+            },
+            {
+                "name": "数据处理系统",
+                "grandchildren": [
+                    {"name": "MapReduce计算模型", "resource_path": ["data/Book/2.PDF"]},
+                ],
+            },
+        ],
+    }
+    course = tmp_path / "course.json"
+    course.write_text(json.dumps(tree, ensure_ascii=False), encoding="utf-8")
+    questions = tmp_path / "Question"
+    questions.mkdir()
+    (questions / "Q1.txt").write_text(QUESTIONS, encoding="utf-8")
+    log = tmp_path / "llm_log.json"
+    log.write_text(
+        json.dumps(
+            [
+                {
+                    "module": "frontend.quizpage",
+                    "metadata": {"function": "generateQuestions", "topic": "MapReduce计算模型"},
+                },
+                {
+                    "module": "AgentModule.edu_agent",
+                    "metadata": {"function": "run_agent"},
+                    "request": {
+                        "messages": [{"role": "user", "content": "介绍HDFS架构  Context: ..."}]
+                    },
+                },
+            ],
+            ensure_ascii=False,
+        ),
+        encoding="utf-8",
+    )
+    return books, course, questions, log
+
+
+def test_parse_questions_and_log(tmp_path):
+    _, _, questions, log = _fixture(tmp_path)
+    assert parse_question_file(str(questions / "Q1.txt")) == [
+        "HDFS 的数据块默认有几个副本?",
+        "（） 负责管理 HDFS 的命名空间",
+        "MapReduce 的 Map 阶段输出键值对。",
+    ]
+    assert [q[0] for q in log_queries(str(log))] == ["MapReduce计算模型", "介绍HDFS架构"]
+
+
+def test_queries_map_to_expected_pdfs(tmp_path):
+    books, course, questions, log = _fixture(tmp_path)
+    course_map = CourseMap(str(course), str(books))
+    assert course_map.match("请介绍 MapReduce 计算模型").name == "MapReduce计算模型"
+
+    queries = build_query_set(str(questions), str(log), str(course), str(books))
+    by_text = {q.text: q for q in queries}
+    # 题目文件整体归入 HDFS 所在章节
+    assert by_text["MapReduce 的 Map 阶段输出键值对。"].chapter == "数据存储系统"
+    assert by_text["介绍HDFS架构"].expected == [str(books / "1.pdf")]
+    assert by_text["MapReduce计算模型"].expected == [str(books / "2.pdf")]
+
+    docs = [Document(page_content="x", metadata={"source": str(books / "2.pdf")})]
+    assert first_hit_rank(docs, [str(books / "2.pdf")]) == 1
+    assert first_hit_rank(docs, [str(books / "1.pdf")]) is None
+
+
+def test_benchmark_runs_all_modes_offline(tmp_path):
+    books, course, questions, log = _fixture(tmp_path)
+    output = tmp_path / "results.json"
+    results = main(
+        [
+            "--questions", str(questions), "--log", str(log), "--course", str(course),
+            "--books", str(books), "--k", "2", "--output", str(output),
+        ]
+    )
+    assert [r.mode for r in results] == list(MODES)
+    for result in results:
+        assert result.queries == 5
+        assert 0 <= result.mrr <= result.hit_rate <= 1
+        assert result.p95_ms >= result.p50_ms > 0
+    assert "expand" in results[MODES.index("multi_query")].stages_ms
+    assert "lexical" in results[MODES.index("hybrid")].stages_ms
+    data = json.loads(output.read_text(encoding="utf-8"))
+    assert len(data["queries"]) == 5
+    assert data["results"][0]["mode"] == "similarity"
+
+
+def test_scoped_mode_skips_queries_without_chapter_pdfs():
+    class Retriever:
+        def __init__(self, sources):
+            self.sources = sources
+
+        def invoke(self, text):
+            return [Document(page_content=text, metadata={"source": s}) for s in self.sources]
+
+    class Service:
+        def scoped_retriever(self, sources, k):
+            return Retriever(sources)
+
+    queries = [
+        BenchmarkQuery("HDFS 副本", "Q1", ["1.pdf"], chapter="数据存储系统"),
+        BenchmarkQuery("Hive 分区", "Q2", ["3.pdf"], chapter="数据仓库"),
+    ]
+    result = evaluate_mode(Service(), "scoped", queries, 2, {"数据存储系统": ["1.pdf"]})
+    # 没有章节映射的查询不能拿标准答案当检索范围
+    assert result.queries == 1 and result.skipped == 1
+    assert result.ranks == [1, None]
+    assert result.hit_rate == 1.0
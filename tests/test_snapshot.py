@@ -0,0 +1,74 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.snapshot import (
+    SnapshotError,
+    latest_snapshot,
+    read_snapshot,
+    snapshot_path,
+    write_snapshot,
+)
+
+
+def _write(path, model="hash-8"):
+    return write_snapshot(
+        str(path),
+        ids=["a", "b"],
+        vectors=np.arange(16, dtype=np.float32).reshape(2, 8) / 16,
+        texts=["第一段", "second"],
+        metadatas=[{"source": "a.pdf", "page": 1}, None],
+        model=model,
+    )
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = _write(tmp_path / "s.rag.npz")
+    snapshot = read_snapshot(path, expected_model="hash-8")
+    assert snapshot.ids == ["a", "b"]
+    assert snapshot.vectors.dtype == np.float16
+    assert snapshot.vectors.shape == (2, 8)
+    assert snapshot.texts == ["第一段", "second"]
+    assert snapshot.metadatas == [{"source": "a.pdf", "page": 1}, {}]
+    assert snapshot.model == "hash-8"
+    assert snapshot.manifest is None
+
+
+def test_snapshot_carries_ingest_manifest(tmp_path):
+    manifest = {"a.pdf": {"size": 3, "mtime_ns": 1, "sha256": "x", "chunk_ids": ["a"]}}
+    path = write_snapshot(
+        str(tmp_path / "s.rag.npz"),
+        ids=["a"],
+        vectors=np.ones((1, 8), dtype=np.float32),
+        texts=["text"],
+        metadatas=[{"source": "a.pdf"}],
+        model="hash-8",
+        manifest=manifest,
+    )
+    assert read_snapshot(path).manifest == manifest
+
+
+def test_snapshot_rejects_other_model_and_corruption(tmp_path):
+    path = _write(tmp_path / "s.rag.npz")
+    with pytest.raises(SnapshotError, match="built with"):
+        read_snapshot(path, expected_model="other")
+
+    with np.load(path) as data:
+        arrays = dict(data)
+    arrays["vectors"] = arrays["vectors"] + np.float16(1)
+    np.savez_compressed(path, **arrays)
+    with pytest.raises(SnapshotError, match="Checksum"):
+        read_snapshot(path)
+
+
+def test_latest_snapshot_picks_newest(tmp_path):
+    assert latest_snapshot(str(tmp_path), "course") is None
+    old = _write(tmp_path / "course-1.rag.npz")
+    new = _write(tmp_path / "course-2.rag.npz")
+    _write(tmp_path / "user_x-3.rag.npz")
+    os.utime(old, (1, 1))
+    assert latest_snapshot(str(tmp_path), "course") == new
+    assert snapshot_path(str(tmp_path), "course").startswith(str(tmp_path / "course-"))
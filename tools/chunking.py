@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import os
+import re
+from dataclasses import dataclass
+from itertools import chain, groupby
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from langchain_core.documents import Document
+
+from tools.context_builder import count_tokens
+from tools.context_compressor import split_sentences
+
+# 没有字体信息时（OCR、纯文本）按常见章节编号识别标题
+_HEADING_RE = re.compile(
+    r"^(第[一二三四五六七八九十百\d]+[章节部分篇]|[一二三四五六七八九十]+[、.]|"
+    r"\d+(\.\d+){0,3}\.?\s+\S|#{1,6}\s)"
+)
+_BLANK_RE = re.compile(r"\n\s*\n")
+
+
+@dataclass
+class _Block:
+    text: str
+    page: Optional[int]
+    level: int  # 0 表示正文，1-3 为标题级别
+    tokens: int
+
+
+def _parse_headings(value: Optional[str]) -> Dict[str, int]:
+    headings: Dict[str, int] = {}
+    for line in (value or "").splitlines():
+        level, _, title = line.partition("\t")
+        if title:
+            headings[title.strip()] = int(level) if level.isdigit() else 3
+    return headings
+
+
+def _guess_level(text: str) -> int:
+    if "\n" in text or len(text) > 40 or not _HEADING_RE.match(text):
+        return 0
+    if text.startswith("第") or text.startswith("#"):
+        return 1
+    number = re.match(r"\d+(\.\d+)*", text)
+    return min(number.group(0).count(".") + 1, 3) if number else 2
+
+
+class StructuredChunker:
+    """Split loaded pages into token-sized, heading-aligned chunks.
+
+    Pages of one ``source`` are processed in order as a stream of blocks
+    (paragraphs separated by blank lines). Headings come from the
+    ``headings`` metadata written by :class:`~tools.pdf_ocr_loader.PDFOCRLoader`
+    from PyMuPDF font information, or from numbering patterns otherwise. A new
+    chunk starts at every heading once the current one holds at least
+    ``min_tokens``, and whenever adding a block would exceed ``max_tokens``;
+    oversized blocks are split on sentence boundaries. Sizes are measured
+    with :func:`tools.context_builder.count_tokens`, so Chinese text is
+    limited by tokens rather than characters.
+
+    Chunks may span pages and carry ``page_start``/``page_end`` (``page`` is
+    kept as the first page) plus the enclosing ``section`` heading.
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        min_tokens: Optional[int] = None,
+        overlap_tokens: Optional[int] = None,
+        counter: Optional[Callable[[str], int]] = None,
+    ) -> None:
+        self.max_tokens = max_tokens or int(os.getenv("RAG_CHUNK_TOKENS", 512))
+        self.min_tokens = (
+            min_tokens
+            if min_tokens is not None
+            else int(os.getenv("RAG_CHUNK_MIN_TOKENS", self.max_tokens // 2))
+        )
+        self.overlap_tokens = (
+            overlap_tokens
+            if overlap_tokens is not None
+            else int(os.getenv("RAG_CHUNK_OVERLAP_TOKENS", 0))
+        )
+        self.counter = counter or count_tokens
+
+    # ------------------------------------------------------------------ 分块
+    def _blocks(self, doc: Document) -> Iterator[_Block]:
+        headings = _parse_headings(doc.metadata.get("headings"))
+        page = doc.metadata.get("page")
+        for text in _BLANK_RE.split(doc.page_content):
+            text = text.strip()
+            if not text:
+                continue
+            level = headings.get(text, 0) if headings else _guess_level(text)
+            tokens = self.counter(text)
+            if level == 0 and tokens > self.max_tokens:
+                yield from self._split_block(text, page)
+            else:
+                yield _Block(text, page, level, tokens)
+
+    def _split_block(self, text: str, page: Optional[int]) -> Iterator[_Block]:
+        for sentence in split_sentences(text):
+            tokens = self.counter(sentence)
+            if tokens <= self.max_tokens:
+                yield _Block(sentence, page, 0, tokens)
+                continue
+            # 超长句子按字符比例硬切
+            step = max(1, len(sentence) * self.max_tokens // tokens)
+            for start in range(0, len(sentence), step):
+                piece = sentence[start : start + step]
+                yield _Block(piece, page, 0, self.counter(piece))
+
+    def _emit(
+        self, blocks: List[_Block], base: dict, section: Optional[str]
+    ) -> Optional[Document]:
+        if not blocks or all(b.level for b in blocks):
+            return None
+        text = "\n".join(b.text for b in blocks)
+        metadata = {
+            k: v for k, v in base.items() if k not in {"headings", "doc_hash"}
+        }
+        pages = [b.page for b in blocks if b.page is not None]
+        if pages:
+            metadata["page"] = metadata["page_start"] = min(pages)
+            metadata["page_end"] = max(pages)
+        if section:
+            metadata["section"] = section
+        return Document(page_content=text, metadata=metadata)
+
+    def _overlap(self, blocks: List[_Block]) -> List[_Block]:
+        if not self.overlap_tokens:
+            return []
+        carried: List[_Block] = []
+        total = 0
+        for block in reversed(blocks):
+            if block.level or total + block.tokens > self.overlap_tokens:
+                break
+            carried.insert(0, block)
+            total += block.tokens
+        return carried
+
+    def _split_source(self, docs: Iterable[Document]) -> Iterator[Document]:
+        docs = iter(docs)
+        first = next(docs, None)
+        if first is None:
+            return
+        base = dict(first.metadata)
+        current: List[_Block] = []
+        tokens = 0
+        section: Optional[str] = None
+        chunk_section: Optional[str] = None
+
+        def flush() -> Iterator[Document]:
+            chunk = self._emit(current, base, chunk_section)
+            if chunk is not None:
+                yield chunk
+
+        for doc in chain([first], docs):
+            for block in self._blocks(doc):
+                starts_section = block.level and tokens >= self.min_tokens
+                overflow = current and tokens + block.tokens > self.max_tokens
+                if starts_section or overflow:
+                    yield from flush()
+                    carried = [] if starts_section else self._overlap(current)
+                    current[:] = carried
+                    tokens = sum(b.tokens for b in carried)
+                    chunk_section = section
+                if block.level:
+                    section = block.text
+                    if not any(b.level == 0 for b in current):
+                        chunk_section = section
+                current.append(block)
+                tokens += block.tokens
+        yield from flush()
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        """Chunk ``documents``; consecutive pages of one source are merged."""
+        return list(self.iter_chunks(documents))
+
+    def iter_chunks(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """Lazily chunk ``documents``, which must be grouped by ``source``.
+
+        Pages are consumed as they arrive (e.g. from
+        :meth:`~tools.pdf_ocr_loader.PDFOCRLoader.lazy_load`), so only the
+        blocks of the chunk being built are held in memory.
+        """
+        for _, pages in groupby(documents, key=lambda d: d.metadata.get("source")):
+            yield from self._split_source(pages)
+
+
+def chunk_documents(documents: Iterable[Document], **kwargs) -> List[Document]:
+    """Chunk ``documents`` with a :class:`StructuredChunker`."""
+    return StructuredChunker(**kwargs).split_documents(documents)
@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import logging
+import math
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+_CJK_RE = re.compile(r"[㐀-䶿一-鿿　-〿＀-￯]")
+_WORD_RE = re.compile(r"[A-Za-z0-9_]+")
+_SPACE_RE = re.compile(r"\s+")
+
+# 重叠拼接时最少需要的重叠字符数，太短容易误判
+_MIN_OVERLAP = 20
+_MAX_OVERLAP = 400
+
+_encoder: Any = None
+_encoder_loaded = False
+_encoder_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count that does not need a tokenizer model.
+
+    Chinese characters and full-width punctuation count as one token each,
+    Latin words as 1.3 tokens and remaining symbols as half a token, which
+    tracks ``cl100k_base`` closely enough for budgeting mixed text.
+    """
+    cjk = len(_CJK_RE.findall(text))
+    rest = _CJK_RE.sub(" ", text)
+    words = _WORD_RE.findall(rest)
+    symbols = len(_WORD_RE.sub("", _SPACE_RE.sub("", rest)))
+    return cjk + math.ceil(len(words) * 1.3) + math.ceil(symbols / 2)
+
+
+def _load_encoder(name: str, timeout: float) -> Any:
+    """Load the tiktoken encoding ``name``, or return ``None`` if unavailable.
+
+    The vocabulary is downloaded on first use; the load runs on a daemon
+    thread so an unreachable network costs at most ``timeout`` seconds.
+    """
+    result: Dict[str, Any] = {}
+
+    def _load() -> None:
+        try:
+            import tiktoken
+
+            result["encoder"] = tiktoken.get_encoding(name)
+        except Exception as exc:  # 未安装或离线无法下载词表
+            result["error"] = exc
+
+    thread = threading.Thread(target=_load, name="tiktoken-load", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if "encoder" in result:
+        return result["encoder"]
+    reason = result.get("error") or f"no vocabulary after {timeout:g}s"
+    logger.info("tiktoken unavailable (%s); estimating tokens", reason)
+    return None
+
+
+def _get_encoder():
+    global _encoder, _encoder_loaded
+    if _encoder_loaded:
+        return _encoder
+    with _encoder_lock:
+        if not _encoder_loaded:
+            name = os.getenv("RAG_TOKENIZER", "cl100k_base")
+            if name != "estimate":
+                timeout = float(os.getenv("RAG_TOKENIZER_TIMEOUT", 10))
+                _encoder = _load_encoder(name, timeout)
+            # 只尝试一次：同一进程内始终用同一种计数方式，分块与预算保持一致
+            _encoder_loaded = True
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when available, else :func:`estimate_tokens`.
+
+    ``RAG_TOKENIZER`` names the encoding (``estimate`` skips tiktoken) and
+    ``RAG_TOKENIZER_TIMEOUT`` bounds the first load, which may download the
+    vocabulary.
+    """
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def _truncate_to_tokens(
+    text: str, max_tokens: int, counter: Callable[[str], int]
+) -> str:
+    # 二分查找能放进预算的最长前缀
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if counter(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo].rstrip()
+
+
+def _normalize(text: str) -> str:
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def _join_overlapping(first: str, second: str) -> str:
+    """Concatenate two chunks, collapsing a splitter overlap between them."""
+    if second in first:
+        return first
+    if first in second:
+        return second
+    limit = min(len(first), len(second), _MAX_OVERLAP)
+    for size in range(limit, _MIN_OVERLAP - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+        if second.endswith(first[:size]):
+            return second + first[size:]
+    return first + "\n" + second
+
+
+def _as_int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class ContextChunk:
+    """One block of the assembled context and where it came from."""
+
+    text: str
+    source: Optional[str]
+    pages: List[int]
+    score: float
+    tokens: int
+    ids: List[str] = field(default_factory=list)
+
+    def provenance(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "pages": list(self.pages),
+            "score": self.score,
+            "tokens": self.tokens,
+            "ids": list(self.ids),
+        }
+
+
+@dataclass
+class BuiltContext:
+    """Result of :func:`build_context`."""
+
+    text: str
+    chunks: List[ContextChunk]
+    tokens: int
+    input_chunks: int
+    dropped_chunks: int
+    compression: Optional[Dict[str, float]] = None
+
+    @property
+    def sources(self) -> List[Dict[str, Any]]:
+        return [chunk.provenance() for chunk in self.chunks]
+
+
+def _doc_score(doc: Any) -> Optional[float]:
+    metadata = getattr(doc, "metadata", None) or {}
+    for key in ("score", "rrf_score", "relevance_score"):
+        value = metadata.get(key)
+        if isinstance(value, (int, float)):
+            return float(value)
+    return None
+
+
+def build_context(
+    docs: Sequence[Any],
+    max_tokens: Optional[int] = None,
+    separator: str = "\n\n",
+    counter: Optional[Callable[[str], int]] = None,
+) -> BuiltContext:
+    """Assemble retrieved documents into a prompt context within a budget.
+
+    * Exact duplicates and chunks contained in a higher-scored chunk are
+      dropped.
+    * Chunks from the same ``source`` on the same or adjacent ``page`` are
+      merged in page order, collapsing the text-splitter overlap.
+    * Blocks are emitted by descending score (``score``/``rrf_score``
+      metadata) until ``max_tokens`` is reached; the first block that does
+      not fit is truncated if that leaves a useful amount of text. If any
+      document has no score, every document is scored by retrieval order
+      instead, since rank-derived values are not comparable with similarity
+      scores.
+    """
+    counter = counter or count_tokens
+    total = len(docs)
+    scores = [_doc_score(doc) for doc in docs]
+    if any(score is None for score in scores):
+        # 只要有一个缺分数，就全部按检索顺序给出递减分数，避免两种尺度混排
+        scores = [(total - rank) / total for rank in range(total)]
+
+    candidates = []
+    for rank, doc in enumerate(docs):
+        text = getattr(doc, "page_content", str(doc)).strip()
+        if not text:
+            continue
+        metadata = getattr(doc, "metadata", None) or {}
+        candidates.append(
+            {
+                "text": text,
+                "norm": _normalize(text),
+                "source": metadata.get("source"),
+                "page": _as_int(metadata.get("page")),
+                "score": scores[rank],
+                "rank": rank,
+                "id": metadata.get("doc_hash"),
+            }
+        )
+    candidates.sort(key=lambda c: (-c["score"], c["rank"]))
+
+    kept: List[dict] = []
+    for cand in candidates:
+        if any(cand["norm"] in other["norm"] for other in kept):
+            continue
+        kept.append(cand)
+
+    # 同一来源、相同或相邻页码的片段合并为一块
+    blocks: List[dict] = []
+    for cand in kept:
+        target = None
+        if cand["source"] is not None:
+            for block in blocks:
+                if block["source"] != cand["source"]:
+                    continue
+                if cand["page"] is None or not block["pages"]:
+                    same = cand["page"] is None and not block["pages"]
+                else:
+                    same = (
+                        min(block["pages"]) - 1
+                        <= cand["page"]
+                        <= max(block["pages"]) + 1
+                    )
+                if same:
+                    target = block
+                    break
+        if target is None:
+            blocks.append(
+                {
+                    "source": cand["source"],
+                    "pages": [] if cand["page"] is None else [cand["page"]],
+                    "score": cand["score"],
+                    "rank": cand["rank"],
+                    "parts": [cand],
+                }
+            )
+        else:
+            target["parts"].append(cand)
+            if cand["page"] is not None and cand["page"] not in target["pages"]:
+                target["pages"].append(cand["page"])
+
+    chunks: List[ContextChunk] = []
+    used = 0
+    sep_tokens = counter(separator) if separator.strip() else 0
+    for block in blocks:
+        parts = sorted(
+            block["parts"],
+            key=lambda c: (c["page"] if c["page"] is not None else -1, c["rank"]),
+        )
+        text = parts[0]["text"]
+        for part in parts[1:]:
+            text = _join_overlapping(text, part["text"])
+        tokens = counter(text)
+        sep = sep_tokens if chunks else 0
+        truncated = False
+        if max_tokens is not None and used + sep + tokens > max_tokens:
+            remaining = max_tokens - used - sep
+            # 剩余预算太少就不再截断塞入
+            if remaining <= 0 or remaining < min(64, max_tokens // 4):
+                break
+            text = _truncate_to_tokens(text, remaining, counter)
+            tokens = counter(text)
+            truncated = True
+            if not text:
+                break
+        chunks.append(
+            ContextChunk(
+                text=text,
+                source=block["source"],
+                pages=sorted(block["pages"]),
+                score=block["score"],
+                tokens=tokens,
+                ids=[p["id"] for p in parts if p["id"]],
+            )
+        )
+        used += sep + tokens
+        if truncated:
+            break
+
+    merged = sum(len(b["parts"]) for b in blocks[: len(chunks)])
+    return BuiltContext(
+        text=separator.join(chunk.text for chunk in chunks),
+        chunks=chunks,
+        tokens=used,
+        input_chunks=total,
+        dropped_chunks=total - merged,
+    )
+
+
+def default_context_budget() -> Optional[int]:
+    """Token budget from ``RAG_CONTEXT_MAX_TOKENS`` (``0`` disables it)."""
+    value = int(os.getenv("RAG_CONTEXT_MAX_TOKENS", 3000))
+    return value if value > 0 else None
@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import logging
+import math
+import os
+import re
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from pydantic import ConfigDict
+
+from tools.context_builder import count_tokens
+from tools.lexical_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+# 句子切分：中文句末标点、英文句点/问号/感叹号后跟空白，以及换行
+_SENTENCE_RE = re.compile(r"[^。！？!?；;\n]+(?:[。！？!?；;]+|\n+|$)|[。！？!?；;\n]+")
+_LATIN_SPLIT_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split ``text`` into sentences on Chinese and Latin sentence boundaries."""
+    sentences = []
+    for piece in _SENTENCE_RE.findall(text):
+        for sentence in _LATIN_SPLIT_RE.split(piece):
+            sentence = sentence.strip()
+            if sentence:
+                sentences.append(sentence)
+    return sentences
+
+
+@dataclass
+class CompressionStats:
+    """Size and cost of one compression call."""
+
+    documents: int
+    sentences: int
+    kept_sentences: int
+    original_tokens: int
+    compressed_tokens: int
+    seconds: float
+
+    @property
+    def ratio(self) -> float:
+        if not self.original_tokens:
+            return 1.0
+        return self.compressed_tokens / self.original_tokens
+
+    def as_dict(self) -> Dict[str, float]:
+        return {**asdict(self), "ratio": self.ratio}
+
+
+def _lexical_scores(query: str, sentences: Sequence[str]) -> np.ndarray:
+    terms = sorted(set(tokenize(query)))
+    if not terms or not sentences:
+        return np.zeros(len(sentences), dtype=np.float32)
+    index = {term: i for i, term in enumerate(terms)}
+    counts = np.zeros((len(sentences), len(terms)), dtype=np.float32)
+    lengths = np.ones(len(sentences), dtype=np.float32)
+    for row, sentence in enumerate(sentences):
+        tokens = tokenize(sentence)
+        lengths[row] = max(len(tokens), 1)
+        for token in tokens:
+            col = index.get(token)
+            if col is not None:
+                counts[row, col] += 1.0
+    # BM25 式打分：词频饱和 + 长度归一，idf 按候选句子集合计算
+    df = (counts > 0).sum(axis=0)
+    idf = np.log1p((len(sentences) - df + 0.5) / (df + 0.5))
+    norm = 1.2 * (0.25 + 0.75 * lengths / lengths.mean())
+    tf = counts * 2.2 / (counts + norm[:, None])
+    return tf @ idf.astype(np.float32)
+
+
+def _cosine_scores(embeddings: Any, query: str, sentences: Sequence[str]) -> np.ndarray:
+    query_vec = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+    matrix = np.asarray(embeddings.embed_documents(list(sentences)), dtype=np.float32)
+    denom = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query_vec) or 1.0)
+    denom[denom == 0] = 1.0
+    return matrix @ query_vec / denom
+
+
+def _rescale(scores: np.ndarray) -> np.ndarray:
+    top = scores.max() if scores.size else 0.0
+    return scores / top if top > 0 else scores
+
+
+class ContextCompressor(BaseDocumentCompressor):
+    """Query-focused extractive compression of retrieved documents.
+
+    Each document is split into sentences, which are scored against the
+    query with a BM25-style lexical overlap and, when ``embeddings`` is set
+    (normally the service's cached embeddings), cosine similarity weighted by
+    ``embedding_weight``. Every document keeps its top ``ratio`` of sentences
+    (at least ``min_sentences``) in original order; ``max_tokens`` then drops
+    the lowest-scored kept sentences across all documents until the total
+    fits. Documents of ``min_sentences`` sentences or fewer pass through.
+
+    Stats of the last call are in ``last_stats``;
+    :meth:`compress_with_stats` returns them alongside the documents.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    ratio: float = 0.4
+    max_tokens: Optional[int] = None
+    min_sentences: int = 2
+    embeddings: Optional[Any] = None
+    embedding_weight: float = 0.5
+    last_stats: Optional[CompressionStats] = None
+
+    @classmethod
+    def from_env(cls, embeddings: Optional[Any] = None) -> "ContextCompressor":
+        """Build a compressor from ``RAG_COMPRESS_*`` environment variables."""
+        max_tokens = int(os.getenv("RAG_COMPRESS_MAX_TOKENS", 0))
+        use_embeddings = os.getenv("RAG_COMPRESS_EMBEDDINGS", "false").lower() in {
+            "1",
+            "true",
+            "yes",
+        }
+        return cls(
+            ratio=float(os.getenv("RAG_COMPRESS_RATIO", 0.4)),
+            max_tokens=max_tokens or None,
+            min_sentences=int(os.getenv("RAG_COMPRESS_MIN_SENTENCES", 2)),
+            embeddings=embeddings if use_embeddings else None,
+        )
+
+    def _score(self, query: str, sentences: List[str]) -> np.ndarray:
+        scores = _rescale(_lexical_scores(query, sentences))
+        if self.embeddings is not None and self.embedding_weight > 0:
+            try:
+                dense = _rescale(_cosine_scores(self.embeddings, query, sentences))
+                scores = (1 - self.embedding_weight) * scores + (
+                    self.embedding_weight * dense
+                )
+            except Exception as exc:  # pragma: no cover - embedding errors
+                logger.warning("Sentence embedding failed, lexical only: %s", exc)
+        return scores
+
+    def compress_with_stats(
+        self, documents: Sequence[Document], query: str
+    ) -> Tuple[List[Document], CompressionStats]:
+        start = time.perf_counter()
+        split = [split_sentences(doc.page_content) for doc in documents]
+        flat = [s for sentences in split for s in sentences]
+        owner = np.repeat(np.arange(len(split)), [len(s) for s in split])
+        scores = self._score(query, flat) if flat else np.zeros(0, dtype=np.float32)
+        tokens = np.array([count_tokens(s) for s in flat], dtype=np.int64)
+
+        keep = np.zeros(len(flat), dtype=bool)
+        offset = 0
+        for sentences in split:
+            n = len(sentences)
+            if n <= self.min_sentences:
+                keep[offset : offset + n] = True
+            else:
+                quota = max(self.min_sentences, math.ceil(n * self.ratio))
+                local = scores[offset : offset + n]
+                top = np.argsort(-local, kind="stable")[:quota]
+                keep[offset + top] = True
+            offset += n
+
+        if self.max_tokens is not None and tokens[keep].sum() > self.max_tokens:
+            # 全局预算：从分数最低的已选句子开始丢弃，每篇文档至少保留一句
+            order = np.flatnonzero(keep)[np.argsort(scores[keep], kind="stable")]
+            remaining = np.bincount(owner[keep], minlength=len(split))
+            total = int(tokens[keep].sum())
+            for idx in order:
+                if total <= self.max_tokens:
+                    break
+                if remaining[owner[idx]] <= 1:
+                    continue
+                keep[idx] = False
+                remaining[owner[idx]] -= 1
+                total -= int(tokens[idx])
+
+        compressed = []
+        offset = 0
+        for doc, sentences in zip(documents, split):
+            n = len(sentences)
+            kept = [s for s, k in zip(sentences, keep[offset : offset + n]) if k]
+            offset += n
+            if not sentences or len(kept) == n:
+                compressed.append(doc)
+                continue
+            compressed.append(
+                Document(
+                    page_content="\n".join(kept),
+                    metadata={**doc.metadata, "compressed": True},
+                )
+            )
+
+        original_tokens = sum(count_tokens(d.page_content) for d in documents)
+        compressed_tokens = sum(count_tokens(d.page_content) for d in compressed)
+        stats = CompressionStats(
+            documents=len(documents),
+            sentences=len(flat),
+            kept_sentences=int(keep.sum()),
+            original_tokens=original_tokens,
+            compressed_tokens=compressed_tokens,
+            seconds=time.perf_counter() - start,
+        )
+        logger.info(
+            "Compressed %d docs: %d -> %d tokens (%.0f%%) in %.1f ms",
+            stats.documents,
+            stats.original_tokens,
+            stats.compressed_tokens,
+            stats.ratio * 100,
+            stats.seconds * 1000,
+        )
+        return compressed, stats
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Callbacks | None = None,
+    ) -> Sequence[Document]:
+        docs, stats = self.compress_with_stats(documents, query)
+        self.last_stats = stats
+        return docs
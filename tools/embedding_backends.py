@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import os
+import re
+from hashlib import blake2b
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+from tools.lexical_index import tokenize
+
+load_dotenv()
+base_url = os.environ.get("base_url")
+api_key = os.environ.get("api_key")
+embedding_model = os.environ.get("embedding_model")
+
+EMBEDDING_BACKENDS: Dict[str, Callable[..., Embeddings]] = {}
+
+
+def register_embedding_backend(name: str):
+    """Register a factory returning an :class:`Embeddings` under ``name``."""
+
+    def decorator(factory: Callable[..., Embeddings]):
+        EMBEDDING_BACKENDS[name] = factory
+        return factory
+
+    return decorator
+
+
+def create_embeddings(name: Optional[str] = None, **kwargs) -> Embeddings:
+    """Build the embedding backend ``name`` (default ``RAG_EMBEDDING_BACKEND``)."""
+    name = name or os.getenv("RAG_EMBEDDING_BACKEND", "openai")
+    try:
+        factory = EMBEDDING_BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown embedding backend {name!r}; "
+            f"available: {', '.join(sorted(EMBEDDING_BACKENDS))}"
+        ) from None
+    return factory(**kwargs)
+
+
+def embeddings_namespace(embeddings: Embeddings) -> str:
+    """Return a stable identifier of the model behind ``embeddings``.
+
+    Used to key caches and snapshots so vectors from different models are
+    never mixed.
+    """
+    for attr in ("namespace", "model", "model_name"):
+        value = getattr(embeddings, attr, None)
+        if isinstance(value, str) and value:
+            return f"{type(embeddings).__name__}:{value}"
+    size = getattr(embeddings, "size", None)
+    suffix = f":{size}" if size else ""
+    return f"{type(embeddings).__name__}{suffix}"
+
+
+def embed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Embed several search queries in as few backend calls as possible.
+
+    Backends exposing ``embed_queries`` batch natively (keeping query
+    prefixes and query-kind caching); OpenAI embeddings embed a query exactly
+    like a document, so they get one ``embed_documents`` request. Any other
+    backend falls back to one ``embed_query`` call per text.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    batched = getattr(embeddings, "embed_queries", None)
+    if callable(batched):
+        return batched(texts)
+    try:
+        from langchain_openai import OpenAIEmbeddings
+    except ImportError:  # pragma: no cover - optional dependency
+        OpenAIEmbeddings = None
+    if OpenAIEmbeddings is not None and isinstance(embeddings, OpenAIEmbeddings):
+        return embeddings.embed_documents(texts)
+    return [embeddings.embed_query(t) for t in texts]
+
+
+@register_embedding_backend("openai")
+def _openai_backend(**kwargs) -> Embeddings:
+    from langchain_openai import OpenAIEmbeddings
+
+    params = {
+        "openai_api_base": f"{base_url}/v1" if base_url else None,
+        "model": embedding_model,
+        "openai_api_key": api_key,
+    }
+    params.update(kwargs)
+    return OpenAIEmbeddings(**params)
+
+
+class LocalEmbeddings(Embeddings):
+    """CPU sentence-embedding model loaded from disk.
+
+    ``model_path`` is a local sentence-transformers model directory (or hub
+    name when a network is available). ``backend="onnx"`` runs the exported
+    ONNX graph through onnxruntime instead of torch. Texts are encoded in
+    batches of ``batch_size`` with ``num_threads`` intra-op threads, and
+    vectors are L2-normalized.
+    """
+
+    def __init__(
+        self,
+        model_path: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        num_threads: Optional[int] = None,
+        backend: Optional[str] = None,
+        query_prefix: str = "",
+    ) -> None:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as exc:
+            raise ImportError(
+                "Local embeddings need sentence-transformers. Install with "
+                "pip install sentence-transformers (and onnxruntime for ONNX)"
+            ) from exc
+
+        self.model = model_path or os.getenv(
+            "RAG_LOCAL_EMBED_MODEL", "BAAI/bge-small-zh-v1.5"
+        )
+        self.batch_size = batch_size or int(os.getenv("RAG_LOCAL_EMBED_BATCH", 32))
+        num_threads = num_threads or int(
+            os.getenv("RAG_LOCAL_EMBED_THREADS", os.cpu_count() or 1)
+        )
+        backend = backend or os.getenv("RAG_LOCAL_EMBED_RUNTIME", "torch")
+        self.query_prefix = query_prefix
+
+        if backend == "torch":
+            import torch
+
+            torch.set_num_threads(num_threads)
+        else:
+            os.environ.setdefault("OMP_NUM_THREADS", str(num_threads))
+        self._model = SentenceTransformer(self.model, device="cpu", backend=backend)
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        vectors = self._model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return vectors.astype(np.float32).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(list(texts)) if texts else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([self.query_prefix + text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self._encode([self.query_prefix + t for t in texts]) if texts else []
+
+
+@register_embedding_backend("local")
+def _local_backend(**kwargs) -> Embeddings:
+    return LocalEmbeddings(**kwargs)
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic, dependency-free embeddings for tests and benchmarks.
+
+    Each token from :func:`tools.lexical_index.tokenize` (plus character
+    trigrams of Latin words) is hashed into one of ``size`` signed buckets and
+    the vector is L2-normalized, so texts sharing terms get similar vectors
+    without any model or network access.
+    """
+
+    def __init__(self, size: int = 256) -> None:
+        self.size = size
+        self.namespace = f"hash-{size}"
+
+    def _features(self, text: str) -> List[str]:
+        tokens = tokenize(text)
+        grams = [
+            t[i : i + 3]
+            for t in tokens
+            if re.fullmatch(r"[a-z0-9]{4,}", t)
+            for i in range(len(t) - 2)
+        ]
+        return tokens + grams
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for feature in self._features(text):
+            digest = blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.size] += 1.0 if value >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        else:
+            vector[0] = 1.0
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+
+@register_embedding_backend("hash")
+def _hash_backend(**kwargs) -> Embeddings:
+    if "size" not in kwargs and os.getenv("RAG_HASH_EMBED_SIZE"):
+        kwargs["size"] = int(os.environ["RAG_HASH_EMBED_SIZE"])
+    return HashingEmbeddings(**kwargs)
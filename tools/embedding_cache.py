@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from array import array
+from hashlib import sha256
+from typing import Callable, Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+from tools.disk_cache import DiskLRUCache
+from tools.embedding_backends import embed_queries
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _decode(blob: bytes) -> List[float]:
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """Wrap an :class:`Embeddings` object with a persistent LRU cache.
+
+    Entries are keyed by ``namespace`` (normally the embedding model name), the
+    kind of call (document or query) and the SHA-256 of the text, so switching
+    models never returns stale vectors. Only cache misses reach the wrapped
+    embeddings, and identical texts inside one batch are embedded once.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        cache: DiskLRUCache,
+        namespace: str = "default",
+    ) -> None:
+        self.underlying = underlying
+        self.cache = cache
+        self.namespace = namespace
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._miss_seconds = 0.0
+
+    def _key(self, kind: str, text: str) -> str:
+        digest = sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.namespace}:{kind}:{digest}"
+
+    def _record(self, hits: int, misses: int, seconds: float) -> None:
+        with self._stats_lock:
+            self._hits += hits
+            self._misses += misses
+            self._miss_seconds += seconds
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_many("doc", texts, self.underlying.embed_documents)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Batched :meth:`embed_query`: cache misses are embedded in one call."""
+        return self._embed_many(
+            "query", texts, lambda batch: embed_queries(self.underlying, batch)
+        )
+
+    def _embed_many(
+        self,
+        kind: str,
+        texts: List[str],
+        embed: Callable[[List[str]], List[List[float]]],
+    ) -> List[List[float]]:
+        keys = [self._key(kind, t) for t in texts]
+        try:
+            cached = self.cache.get_many(keys)
+        except Exception as exc:  # pragma: no cover - disk errors
+            logger.warning("Embedding cache read failed: %s", exc)
+            cached = {}
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        fresh: Dict[str, List[float]] = {}
+        elapsed = 0.0
+        if missing:
+            start = time.perf_counter()
+            vectors = embed(list(missing.values()))
+            elapsed = time.perf_counter() - start
+            fresh = dict(zip(missing.keys(), vectors))
+            try:
+                self.cache.set_many({k: _encode(v) for k, v in fresh.items()})
+            except Exception as exc:  # pragma: no cover - disk errors
+                logger.warning("Embedding cache write failed: %s", exc)
+
+        self._record(len(texts) - len(missing), len(missing), elapsed)
+        return [
+            fresh[key] if key in fresh else _decode(cached[key]) for key in keys
+        ]
+
+    def _lookup(self, key: str):
+        try:
+            return self.cache.get(key)
+        except Exception as exc:  # pragma: no cover - disk errors
+            logger.warning("Embedding cache read failed: %s", exc)
+            return None
+
+    def _store(self, key: str, vector: List[float]) -> None:
+        try:
+            self.cache.set(key, _encode(vector))
+        except Exception as exc:  # pragma: no cover - disk errors
+            logger.warning("Embedding cache write failed: %s", exc)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key("query", text)
+        blob = self._lookup(key)
+        if blob is not None:
+            self._record(1, 0, 0.0)
+            return _decode(blob)
+
+        start = time.perf_counter()
+        vector = self.underlying.embed_query(text)
+        self._record(0, 1, time.perf_counter() - start)
+        self._store(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key("query", text)
+        # SQLite 读写是阻塞调用，放到线程中执行，避免卡住事件循环
+        blob = await asyncio.to_thread(self._lookup, key)
+        if blob is not None:
+            self._record(1, 0, 0.0)
+            return _decode(blob)
+
+        start = time.perf_counter()
+        vector = await self.underlying.aembed_query(text)
+        self._record(0, 1, time.perf_counter() - start)
+        await asyncio.to_thread(self._store, key, vector)
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the estimated embedding time saved."""
+        with self._stats_lock:
+            hits, misses, seconds = self._hits, self._misses, self._miss_seconds
+        total = hits + misses
+        avg_miss = seconds / misses if misses else 0.0
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "miss_seconds": seconds,
+            "avg_miss_seconds": avg_miss,
+            "estimated_seconds_saved": hits * avg_miss,
+            "entries": len(self.cache),
+            "size_bytes": self.cache.size_bytes(),
+        }
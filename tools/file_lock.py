@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import os
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+try:  # pragma: no cover - platform specific
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Hold an exclusive advisory lock on ``path + ".lock"`` across processes.
+
+    Used around read-merge-write cycles of the on-disk indexes so that the
+    server and a concurrent ``python -m tools.ingest`` run do not overwrite
+    each other's changes. Without ``fcntl`` (Windows) no lock is taken and
+    only the caller's merge guards against lost updates.
+    """
+    lock_path = path + ".lock"
+    os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+    with open(lock_path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def file_stamp(path: str) -> Optional[Tuple[int, int, int]]:
+    """Return ``(inode, mtime_ns, size)`` of ``path``, or ``None`` if missing.
+
+    Files written with ``os.replace`` get a new inode, so the stamp changes on
+    every save even within the filesystem's timestamp resolution.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
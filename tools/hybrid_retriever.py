@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from hashlib import sha256
+from typing import Dict, List, Sequence
+
+from langchain_core.documents import Document
+
+from tools.scoped_retriever import ScopedRetriever
+
+
+def _doc_key(doc: Document) -> str:
+    return doc.metadata.get("doc_hash") or sha256(
+        doc.page_content.encode("utf-8")
+    ).hexdigest()
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Document]], k: int = 4, rrf_k: int = 60
+) -> List[Document]:
+    """Fuse several ranked lists with reciprocal-rank fusion.
+
+    Each document scores ``sum(1 / (rrf_k + rank))`` over the lists it appears
+    in; the fused score is stored in ``metadata["rrf_score"]``.
+    """
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = _doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    fused = []
+    for key in ranked:
+        doc = docs[key]
+        fused.append(
+            Document(
+                page_content=doc.page_content,
+                metadata={**doc.metadata, "rrf_score": scores[key]},
+            )
+        )
+    return fused
+
+
+class HybridRetriever(ScopedRetriever):
+    """Dense + BM25 retriever fused with reciprocal-rank fusion.
+
+    Each source is asked for ``fetch_k`` candidates; the timings of the last
+    call (seconds per stage) are reported by ``last_timings``.
+    """
+
+    search_type: str = "hybrid"
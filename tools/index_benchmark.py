@@ -0,0 +1,480 @@
+"""Sweep vector index and search parameters and report latency and recall.
+
+Usage::
+
+    python -m tools.index_benchmark --ef-search 10,40,100 --m 16,32 --k 4,8
+    python -m tools.index_benchmark --synthetic 20000 --sizes 5000,20000 \
+        --backends chroma,numpy --output data/Log/index_benchmark.json
+
+Vectors come from the persisted RAG store (``--namespace``) or are generated
+(``--synthetic``). Every combination of collection size, HNSW ``M`` and
+``ef_construction`` is built into a throw-away Chroma collection, then every
+``ef_search``/``k`` (and MMR ``fetch_k``) is queried. Recall@k of similarity
+search is measured against an exact NumPy brute-force search in the same
+distance space. MMR deliberately trades some of those neighbours for
+diversity, so for MMR only the overlap with the exact top-k is reported,
+next to the hit rate: the fraction of queries whose labelled relevant row
+is returned (generated queries are labelled with the row they perturb).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BenchmarkResult:
+    """Latency and quality of one parameter combination.
+
+    ``recall`` is similarity recall@k against the exact top-k (``None`` for
+    MMR), ``overlap`` the share of the exact top-k that MMR returned (``None``
+    for similarity search) and ``hit_rate`` the fraction of labelled queries
+    whose relevant row was returned (``None`` without labels).
+    """
+
+    backend: str
+    size: int
+    k: int
+    mode: str = "similarity"
+    m: Optional[int] = None
+    ef_construction: Optional[int] = None
+    ef_search: Optional[int] = None
+    fetch_k: Optional[int] = None
+    p50_ms: float = 0.0
+    p95_ms: float = 0.0
+    recall: Optional[float] = None
+    overlap: Optional[float] = None
+    hit_rate: Optional[float] = None
+    build_s: float = 0.0
+    index_bytes: int = 0
+    rss_delta_bytes: Optional[int] = None
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _rss_bytes() -> Optional[int]:
+    # 只在 Linux 上读取常驻内存，其它平台不报告
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _dir_bytes(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path)
+        for name in files
+    )
+
+
+def percentiles(latencies: Sequence[float]) -> Tuple[float, float]:
+    """Return (p50, p95) of ``latencies`` (seconds) in milliseconds."""
+    if not len(latencies):
+        return 0.0, 0.0
+    p50, p95 = np.percentile(np.asarray(latencies) * 1000.0, [50, 95])
+    return float(p50), float(p95)
+
+
+def exact_top_k(
+    corpus: np.ndarray, queries: np.ndarray, k: int, space: str = "l2"
+) -> np.ndarray:
+    """Brute-force top-``k`` row indices of ``corpus`` for each query."""
+    if space == "cosine":
+        norms = np.linalg.norm(corpus, axis=1)
+        norms[norms == 0] = 1.0
+        scores = queries @ (corpus / norms[:, None]).T
+    else:
+        # ||x - q||^2 的排序只依赖 ||x||^2 - 2 x·q
+        scores = 2.0 * queries @ corpus.T - np.sum(corpus**2, axis=1)
+    k = min(k, corpus.shape[0])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+def recall_at_k(found: Iterable[Sequence[str]], exact: np.ndarray) -> float:
+    """Mean fraction of the exact top-k IDs present in ``found``."""
+    ratios = [
+        len(set(ids) & {str(i) for i in truth}) / len(truth)
+        for ids, truth in zip(found, exact)
+        if len(truth)
+    ]
+    return float(np.mean(ratios)) if ratios else 0.0
+
+
+def hit_rate(
+    found: Iterable[Sequence[str]], labels: Optional[np.ndarray]
+) -> Optional[float]:
+    """Fraction of queries whose labelled row ID is in ``found``.
+
+    Negative labels mark queries without a relevant row in the corpus and are
+    skipped; returns ``None`` when no query is labelled.
+    """
+    if labels is None:
+        return None
+    hits = [str(label) in set(ids) for ids, label in zip(found, labels) if label >= 0]
+    return float(np.mean(hits)) if hits else None
+
+
+def load_store_vectors(namespace: str, limit: Optional[int] = None) -> np.ndarray:
+    """Read the stored embeddings of ``namespace`` from the RAG service."""
+    from tools.rag_service import get_rag_service
+
+    return get_rag_service().namespace_embeddings(namespace, limit=limit)
+
+
+def synthetic_vectors(count: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors that roughly mimic text embeddings."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, count // 50), dim))
+    vectors = centers[rng.integers(0, len(centers), size=count)]
+    vectors = vectors + 0.5 * rng.normal(size=(count, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def make_labeled_queries(
+    corpus: np.ndarray, count: int, noise: float = 0.3, seed: int = 1
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Perturbed copies of random corpus rows and the index of each source row."""
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(0, len(corpus), size=count)
+    rows = corpus[labels]
+    queries = rows + noise * rng.normal(size=rows.shape) * rows.std()
+    return queries.astype(np.float32), labels
+
+
+def make_queries(
+    corpus: np.ndarray, count: int, noise: float = 0.3, seed: int = 1
+) -> np.ndarray:
+    """Perturbed copies of random corpus rows, used when no query set is given."""
+    return make_labeled_queries(corpus, count, noise, seed)[0]
+
+
+def embed_queries(path: str) -> np.ndarray:
+    """Embed one query per line of ``path`` with the service's embeddings."""
+    from tools.rag_service import get_rag_service
+
+    with open(path, encoding="utf-8") as f:
+        texts = [line.strip() for line in f if line.strip()]
+    embeddings = get_rag_service()._embeddings
+    return np.asarray([embeddings.embed_query(t) for t in texts], dtype=np.float32)
+
+
+def _bench_chroma(
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    m: int,
+    ef_construction: int,
+    ef_searches: Sequence[int],
+    ks: Sequence[int],
+    fetch_ks: Sequence[int],
+    workdir: str,
+    labels: Optional[np.ndarray] = None,
+) -> List[BenchmarkResult]:
+    import chromadb
+    from langchain_chroma import Chroma
+
+    path = tempfile.mkdtemp(prefix="chroma_", dir=workdir)
+    rss_before = _rss_bytes()
+    client = chromadb.PersistentClient(path=path)
+    collection = client.create_collection(
+        "benchmark",
+        configuration={
+            "hnsw": {"max_neighbors": m, "ef_construction": ef_construction}
+        },
+    )
+    start = time.perf_counter()
+    ids = [str(i) for i in range(len(corpus))]
+    batch = client.get_max_batch_size()
+    for i in range(0, len(corpus), batch):
+        # MMR 经由 langchain 包装返回 Document，需要非空的文档文本
+        collection.add(
+            ids=ids[i : i + batch],
+            embeddings=corpus[i : i + batch],
+            documents=ids[i : i + batch],
+        )
+    build_s = time.perf_counter() - start
+    rss_after = _rss_bytes()
+    common = dict(
+        backend="chroma",
+        size=len(corpus),
+        m=m,
+        ef_construction=ef_construction,
+        build_s=build_s,
+        index_bytes=_dir_bytes(path),
+        rss_delta_bytes=(
+            rss_after - rss_before if rss_before is not None and rss_after else None
+        ),
+    )
+    store = Chroma(client=client, collection_name="benchmark")
+    results = []
+    for ef_search in ef_searches:
+        collection.modify(configuration={"hnsw": {"ef_search": ef_search}})
+        for k in ks:
+            exact = exact_top_k(corpus, queries, k, space="l2")
+            latencies, found = [], []
+            for query in queries:
+                t = time.perf_counter()
+                hit = collection.query(query_embeddings=[query], n_results=k, include=[])
+                latencies.append(time.perf_counter() - t)
+                found.append(hit["ids"][0])
+            p50, p95 = percentiles(latencies)
+            results.append(
+                BenchmarkResult(
+                    k=k,
+                    ef_search=ef_search,
+                    p50_ms=p50,
+                    p95_ms=p95,
+                    recall=recall_at_k(found, exact),
+                    hit_rate=hit_rate(found, labels),
+                    **common,
+                )
+            )
+            for fetch_k in fetch_ks:
+                latencies, found = [], []
+                for query in queries:
+                    t = time.perf_counter()
+                    docs = store.max_marginal_relevance_search_by_vector(
+                        query.tolist(), k=k, fetch_k=max(fetch_k, k)
+                    )
+                    latencies.append(time.perf_counter() - t)
+                    found.append([d.id for d in docs])
+                p50, p95 = percentiles(latencies)
+                results.append(
+                    BenchmarkResult(
+                        k=k,
+                        mode="mmr",
+                        ef_search=ef_search,
+                        fetch_k=fetch_k,
+                        p50_ms=p50,
+                        p95_ms=p95,
+                        overlap=recall_at_k(found, exact),
+                        hit_rate=hit_rate(found, labels),
+                        **common,
+                    )
+                )
+    client.delete_collection("benchmark")
+    return results
+
+
+def _bench_numpy(
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    ks: Sequence[int],
+    workdir: str,
+    labels: Optional[np.ndarray] = None,
+) -> List[BenchmarkResult]:
+    from tools.numpy_index import NumpyVectorIndex
+
+    path = tempfile.mkdtemp(prefix="numpy_", dir=workdir)
+    index = NumpyVectorIndex(path)
+    start = time.perf_counter()
+    index.upsert(
+        ids=[str(i) for i in range(len(corpus))],
+        embeddings=corpus,
+        metadatas=[{} for _ in range(len(corpus))],
+        documents=[""] * len(corpus),
+    )
+    index.persist()
+    build_s = time.perf_counter() - start
+    results = []
+    for k in ks:
+        exact = exact_top_k(corpus, queries, k, space="cosine")
+        latencies, found = [], []
+        for query in queries:
+            t = time.perf_counter()
+            docs = index.similarity_search_by_vector(query.tolist(), k=k)
+            latencies.append(time.perf_counter() - t)
+            found.append([d.id for d in docs])
+        p50, p95 = percentiles(latencies)
+        results.append(
+            BenchmarkResult(
+                backend="numpy",
+                size=len(corpus),
+                k=k,
+                p50_ms=p50,
+                p95_ms=p95,
+                recall=recall_at_k(found, exact),
+                hit_rate=hit_rate(found, labels),
+                build_s=build_s,
+                index_bytes=index.memory_bytes(),
+            )
+        )
+    return results
+
+
+def run_benchmark(
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    sizes: Optional[Sequence[int]] = None,
+    ms: Sequence[int] = (16,),
+    ef_constructions: Sequence[int] = (100,),
+    ef_searches: Sequence[int] = (10, 40, 100),
+    ks: Sequence[int] = (4,),
+    fetch_ks: Sequence[int] = (),
+    backends: Sequence[str] = ("chroma",),
+    workdir: Optional[str] = None,
+    labels: Optional[np.ndarray] = None,
+) -> List[BenchmarkResult]:
+    """Run the parameter sweep and return one result per combination.
+
+    ``sizes`` takes the first N rows of ``corpus`` (default: all of it).
+    ``labels`` gives the relevant corpus row of each query for the hit rate.
+    Temporary collections are created under ``workdir`` and removed.
+    """
+    own_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix="index_benchmark_")
+    results: List[BenchmarkResult] = []
+    try:
+        for size in sizes or [len(corpus)]:
+            subset = corpus[: min(size, len(corpus))]
+            # 相关行不在当前子集内的查询不计入命中率
+            subset_labels = (
+                None
+                if labels is None
+                else np.where(np.asarray(labels) < len(subset), labels, -1)
+            )
+            if "chroma" in backends:
+                for m in ms:
+                    for ef_construction in ef_constructions:
+                        logger.info(
+                            "Benchmarking chroma size=%d M=%d ef_construction=%d",
+                            len(subset),
+                            m,
+                            ef_construction,
+                        )
+                        results.extend(
+                            _bench_chroma(
+                                subset,
+                                queries,
+                                m,
+                                ef_construction,
+                                ef_searches,
+                                ks,
+                                fetch_ks,
+                                workdir,
+                                subset_labels,
+                            )
+                        )
+            if "numpy" in backends:
+                results.extend(
+                    _bench_numpy(subset, queries, ks, workdir, subset_labels)
+                )
+    finally:
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def _ratio(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.3f}"
+
+
+def format_results(results: Sequence[BenchmarkResult]) -> str:
+    header = (
+        f"{'backend':<7} {'size':>7} {'mode':<10} {'M':>4} {'efC':>5} {'efS':>5} "
+        f"{'fetch':>5} {'k':>3} {'p50ms':>7} {'p95ms':>7} {'recall':>6} "
+        f"{'overlap':>7} {'hit':>6} {'MB':>7}"
+    )
+    lines = [header]
+    for r in results:
+        lines.append(
+            f"{r.backend:<7} {r.size:>7} {r.mode:<10} {r.m or '-':>4} "
+            f"{r.ef_construction or '-':>5} {r.ef_search or '-':>5} "
+            f"{r.fetch_k or '-':>5} {r.k:>3} {r.p50_ms:>7.2f} {r.p95_ms:>7.2f} "
+            f"{_ratio(r.recall):>6} {_ratio(r.overlap):>7} {_ratio(r.hit_rate):>6} "
+            f"{r.index_bytes / 2**20:>7.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> List[BenchmarkResult]:
+    parser = argparse.ArgumentParser(
+        prog="python -m tools.index_benchmark",
+        description=(
+            "Measure latency, recall@k, hit rate and memory of vector index settings"
+        ),
+    )
+    parser.add_argument("--namespace", default="course", help="Store to read vectors from")
+    parser.add_argument(
+        "--synthetic", type=int, default=0, help="Use N generated vectors instead of the store"
+    )
+    parser.add_argument("--dim", type=int, default=384, help="Dimension of synthetic vectors")
+    parser.add_argument("--queries", help="Text file with one query per line")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--sizes", type=_int_list, default=None)
+    parser.add_argument("--m", type=_int_list, default=[16])
+    parser.add_argument("--ef-construction", type=_int_list, default=[100])
+    parser.add_argument("--ef-search", type=_int_list, default=[10, 40, 100])
+    parser.add_argument("--k", type=_int_list, default=[4])
+    parser.add_argument("--fetch-k", type=_int_list, default=[], help="MMR fetch_k values")
+    parser.add_argument("--backends", default="chroma", help="chroma,numpy")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        corpus = synthetic_vectors(args.synthetic, args.dim)
+    else:
+        corpus = load_store_vectors(args.namespace)
+    if not len(corpus):
+        raise SystemExit("No vectors to benchmark; ingest documents or use --synthetic")
+    if args.queries:
+        # 文本查询没有相关性标注，不报告命中率
+        queries, labels = embed_queries(args.queries), None
+    else:
+        queries, labels = make_labeled_queries(corpus, args.num_queries)
+
+    results = run_benchmark(
+        corpus,
+        queries,
+        sizes=args.sizes,
+        ms=args.m,
+        ef_constructions=args.ef_construction,
+        ef_searches=args.ef_search,
+        ks=args.k,
+        fetch_ks=args.fetch_k,
+        backends=[b.strip() for b in args.backends.split(",")],
+        labels=labels,
+    )
+    print(format_results(results))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "corpus": int(len(corpus)),
+                    "dim": int(corpus.shape[1]),
+                    "queries": int(len(queries)),
+                    "results": [r.as_dict() for r in results],
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -1,8 +1,17 @@
 from __future__ import annotations
 
 import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import time
+from hashlib import sha256
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Iterable, Iterator, List, NamedTuple, Optional
 
 from langchain_core.documents import Document
 from langchain_community.document_loaders import (
@@ -15,11 +24,14 @@ from langchain_community.document_loaders import (
     UnstructuredWordDocumentLoader,
     UnstructuredFileLoader,
 )
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from tools.rag_service import get_rag_service
+from tools.chunking import StructuredChunker
+from tools.ingest_manifest import IngestManifest
+from tools.rag_service import COURSE_NAMESPACE, get_rag_service
 from tools.pdf_ocr_loader import PDFOCRLoader
 
+logger = logging.getLogger(__name__)
+
 
 LOADERS = {
     ".txt": TextLoader,
@@ -35,39 +47,359 @@ LOADERS = {
 }
 
 
-def load_file(path: Path) -> List[Document]:
-    """Load ``path`` into a list of Documents using an appropriate loader."""
+# 学生上传存放在课程资料目录下的该子目录中，属于各自的私有集合，不进入课程语料
+USER_UPLOADS_DIR = "users"
+
+
+def user_upload_dir(username: str, root: str = "data/RAG_files") -> Path:
+    """Return the folder holding ``username``'s own uploads under ``root``.
+
+    :func:`ingest_folder` skips ``root/users`` so private uploads never reach
+    the shared course corpus.
+    """
+    return Path(root) / USER_UPLOADS_DIR / re.sub(r"[^\w-]+", "_", username)
+
+
+def iter_file(path: Path, ocr_workers: Optional[int] = None) -> Iterator[Document]:
+    """Yield the Documents of ``path`` one at a time using an appropriate loader.
+
+    PDFs are streamed page by page from
+    :meth:`~tools.pdf_ocr_loader.PDFOCRLoader.lazy_load`; ``ocr_workers``
+    sets their page-level OCR processes.
+    """
     loader_cls = LOADERS.get(path.suffix.lower())
     if loader_cls is None:
-        loader = UnstructuredFileLoader(str(path))
+        docs = UnstructuredFileLoader(str(path)).load()
+    elif loader_cls is PDFOCRLoader:
+        docs = PDFOCRLoader(str(path), workers=ocr_workers).lazy_load()
     else:
-        loader = loader_cls(str(path))
-    docs = loader.load()
+        docs = loader_cls(str(path)).load()
     for doc in docs:
         doc.metadata["source"] = str(path)
-    return docs
+        yield doc
+
+
+def load_file(path: Path, ocr_workers: Optional[int] = None) -> List[Document]:
+    """Load ``path`` into a list of Documents using an appropriate loader."""
+    return list(iter_file(path, ocr_workers))
+
+
+class ThroughputReport:
+    """Running files/pages/chunks counters printed at a fixed interval."""
+
+    def __init__(self, interval: float = 5.0) -> None:
+        self.interval = interval
+        self.files = 0
+        self.pages = 0
+        self.chunks = 0
+        self._start = time.perf_counter()
+        self._last = self._start
+
+    def add(self, files: int = 0, pages: int = 0, chunks: int = 0) -> None:
+        self.files += files
+        self.pages += pages
+        self.chunks += chunks
+        now = time.perf_counter()
+        if self.interval and now - self._last >= self.interval:
+            self._last = now
+            print(self.format())
+
+    def format(self) -> str:
+        elapsed = max(time.perf_counter() - self._start, 1e-9)
+        return (
+            f"[ingest] {self.files} files ({self.files / elapsed:.2f}/s), "
+            f"{self.pages} pages ({self.pages / elapsed:.2f}/s), "
+            f"{self.chunks} chunks ({self.chunks / elapsed:.2f}/s) "
+            f"in {elapsed:.1f}s"
+        )
+
+
+class ChunkBatch(NamedTuple):
+    """Chunks of one file, produced as its pages are loaded and split.
+
+    ``pages`` counts the pages consumed since the previous batch of the same
+    file. The last batch of a file has ``done`` set; ``error`` then holds the
+    load error message if the file failed part-way.
+    """
+
+    path: Path
+    chunks: List[Document]
+    pages: int
+    done: bool = False
+    error: Optional[str] = None
+
+
+def iter_file_chunks(
+    path: Path, ocr_workers: Optional[int] = None, chunk_batch: int = 16
+) -> Iterator[ChunkBatch]:
+    """Load, split and hash ``path`` lazily, ``chunk_batch`` chunks at a time."""
+    splitter = StructuredChunker()
+    batch: List[Document] = []
+    pages = 0
+
+    def _pages(docs: Iterable[Document]) -> Iterator[Document]:
+        nonlocal pages
+        for doc in docs:
+            pages += 1
+            yield doc
+
+    try:
+        for chunk in splitter.iter_chunks(_pages(iter_file(path, ocr_workers))):
+            chunk.metadata["doc_hash"] = sha256(
+                chunk.page_content.encode("utf-8")
+            ).hexdigest()
+            batch.append(chunk)
+            if len(batch) >= chunk_batch:
+                yield ChunkBatch(path, batch, pages)
+                batch, pages = [], 0
+    except Exception as exc:
+        # 出错前已产出的 chunk 照常交给调用方
+        yield ChunkBatch(path, batch, pages, True, f"{type(exc).__name__}: {exc}")
+        return
+    yield ChunkBatch(path, batch, pages, True)
+
+
+def _stream_chunks(
+    path: Path,
+    ocr_workers: Optional[int],
+    chunk_batch: int,
+    batches: "queue.Queue",
+    stop,
+) -> None:
+    """Worker: put the chunk batches of ``path`` on the shared ``batches`` queue.
+
+    ``batches`` is bounded, so the worker waits while the consumer is behind;
+    it gives up once ``stop`` is set.
+    """
+    for batch in iter_file_chunks(path, ocr_workers, chunk_batch):
+        while not stop.is_set():
+            try:
+                batches.put(batch, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        else:
+            return
+
+
+def iter_chunk_batches(
+    paths: Iterable[Path],
+    workers: int = 1,
+    ocr_workers: Optional[int] = None,
+    chunk_batch: int = 16,
+) -> Iterator[ChunkBatch]:
+    """Yield a :class:`ChunkBatch` stream for every path as it is produced.
+
+    With ``workers <= 1`` files are loaded and split in this process, one
+    after another. With ``workers > 1`` up to ``workers`` files are loaded,
+    OCR'd and split in a process pool at once. All workers send their batches
+    through one shared queue of ``2 * workers`` batches, so batches of
+    different files arrive interleaved in completion order: every worker
+    keeps going while the consumer is busy with another file's chunks, and
+    only a few batches wait in memory. Each file ends with exactly one batch
+    whose ``done`` is set. ``ocr_workers`` additionally spreads the scanned
+    pages of each PDF over a process pool.
+    """
+    if workers <= 1:
+        for path in paths:
+            yield from iter_file_chunks(path, ocr_workers, chunk_batch)
+        return
+
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(
+        max_workers=workers
+    ) as pool:
+        stop = manager.Event()
+        batches = manager.Queue(maxsize=2 * workers)
+        futures = {
+            path: pool.submit(
+                _stream_chunks, path, ocr_workers, chunk_batch, batches, stop
+            )
+            for path in paths
+        }
+        unfinished = set(futures)
+        suspects: set = set()
+        try:
+            while unfinished:
+                try:
+                    batch = batches.get(timeout=1.0)
+                except queue.Empty:
+                    # 工作进程退出却没发出结束批次（例如进程池崩溃）：
+                    # 连续两次超时都如此才判定失败，避免与队列中的最后一批竞争
+                    exited = {p for p in unfinished if futures[p].done()}
+                    for path in exited & suspects:
+                        unfinished.discard(path)
+                        exc = futures[path].exception()
+                        error = f"{type(exc).__name__}: {exc}" if exc else None
+                        yield ChunkBatch(
+                            path, [], 0, True, error or "loader process exited early"
+                        )
+                    suspects = exited
+                    continue
+                if batch.done:
+                    unfinished.discard(batch.path)
+                yield batch
+        finally:
+            stop.set()
+            for future in futures.values():
+                future.cancel()
 
 
-def ingest_folder(folder: str = "data/RAG_files") -> tuple[int, int]:
+def ingest_folder(
+    folder: str = "data/RAG_files",
+    workers: Optional[int] = None,
+    report_interval: float = 5.0,
+    force: bool = False,
+    ocr_workers: Optional[int] = None,
+) -> tuple[int, int]:
     """Ingest all files from ``folder`` into the RAG vector store.
 
+    Files are loaded and split by a pool of ``workers`` processes (default
+    ``RAG_INGEST_WORKERS``, else 2, since each may load its own OCR model)
+    that stream their chunks back in small batches as they are produced (see
+    :func:`iter_chunk_batches`); the chunks go straight into
+    :meth:`RAGService.ingest_documents`, which embeds and writes them in
+    batches. Loading, splitting and embedding therefore overlap and only a
+    few batches per worker are held in memory, so even a 500-page book is
+    never held whole. With ``workers=1`` files are loaded in this process.
+
+    An :class:`~tools.ingest_manifest.IngestManifest` next to the vector store
+    makes re-runs incremental: unchanged files are skipped before loading,
+    changed files have their stale chunks replaced, and chunks of files that
+    disappeared from ``folder`` are deleted. ``force`` re-ingests everything.
+    Student uploads under ``folder/users`` (see :func:`user_upload_dir`) are
+    skipped; they live in each student's own namespace.
+    ``ocr_workers`` sets the page-level OCR processes per PDF (default
+    ``RAG_OCR_WORKERS``).
+
     Returns a tuple of ``(documents, chunks)`` ingested.
     """
     rag = get_rag_service()
-    all_docs: List[Document] = []
-    folder_path = Path(folder)
-    for file_path in folder_path.glob("**/*"):
-        if file_path.is_file():
-            all_docs.extend(load_file(file_path))
-    if not all_docs:
-        return (0, 0)
-    splitter = RecursiveCharacterTextSplitter()
-    chunks = splitter.split_documents(all_docs)
-    rag.ingest_paths(chunks)
-    return len(all_docs), len(chunks)
-
-
-def main() -> None:
+    # 每个加载进程遇到扫描页都会载入一份 OCR 模型（数 GB），默认只开少量进程
+    workers = workers or int(os.getenv("RAG_INGEST_WORKERS", 2))
+    manifest = IngestManifest(rag.manifest_path)
+    uploads = Path(folder) / USER_UPLOADS_DIR
+    paths = sorted(
+        p
+        for p in Path(folder).glob("**/*")
+        if p.is_file() and not p.is_relative_to(uploads)
+    )
+
+    present = {str(p) for p in paths}
+    removed = [s for s in manifest.sources_under(Path(folder)) if s not in present]
+    pending = [p for p in paths if force or not manifest.is_unchanged(p)]
+    skipped = len(paths) - len(pending)
+
+    report = ThroughputReport(report_interval)
+    # 只保留各 chunk 的元数据：写入时近似重复的 chunk 会被标记 duplicate_of
+    produced: dict[Path, list[dict]] = {}
+    partial: dict[Path, list[dict]] = {}
+
+    def _chunks() -> Iterator[Document]:
+        # 各文件的 chunk 按完成顺序交错到达，边产出边写入
+        for batch in iter_chunk_batches(pending, workers, ocr_workers):
+            metas = partial.setdefault(batch.path, [])
+            report.add(pages=batch.pages)
+            for chunk in batch.chunks:
+                metas.append(chunk.metadata)
+                report.add(chunks=1)
+                yield chunk
+            if not batch.done:
+                continue
+            metas = partial.pop(batch.path)
+            if batch.error:
+                # 不记入清单，下次运行会重新处理该文件
+                logger.warning("Failed to load %s: %s", batch.path, batch.error)
+                continue
+            produced[batch.path] = metas
+            report.add(files=1)
+
+    if pending:
+        rag.ingest_documents(_chunks())
+
+    # 新向量写入后再清理旧向量，避免检索出现空窗期
+    stale: set[str] = set()
+    for source in removed:
+        stale.update(manifest.remove(source).get("chunk_ids", []))
+    for path, metas in produced.items():
+        ids = list(dict.fromkeys(m.get("duplicate_of") or m["doc_hash"] for m in metas))
+        old = manifest.get(str(path))
+        if old:
+            stale.update(set(old.get("chunk_ids", [])) - set(ids))
+        manifest.record(path, ids)
+    stale -= manifest.ids_in_use()
+    if stale:
+        rag.delete_documents(stale)
+    if pending or removed or skipped:
+        manifest.save()
+
+    if report_interval:
+        print(
+            f"{report.format()}; skipped {skipped} unchanged, "
+            f"removed {len(removed)} deleted file(s)"
+        )
+    return report.pages, report.chunks
+
+
+def export_snapshot(path: Optional[str] = None, namespace: str = COURSE_NAMESPACE) -> str:
+    """Write a snapshot of ``namespace`` (see :meth:`RAGService.export_snapshot`)."""
+    path = get_rag_service().export_snapshot(path, namespace=namespace)
+    print(f"Snapshot written to {path}")
+    return path
+
+
+def import_snapshot(
+    path: Optional[str] = None,
+    namespace: str = COURSE_NAMESPACE,
+    check_model: bool = True,
+) -> int:
+    """Load a snapshot into ``namespace``; ``path`` defaults to the latest one."""
+    rag = get_rag_service()
+    if path is None:
+        path = rag.latest_snapshot_path(namespace)
+        if path is None:
+            raise SystemExit(f"No snapshot found in {rag.snapshot_directory}")
+    count = rag.import_snapshot(path, namespace=namespace, check_model=check_model)
+    print(f"Imported {count} chunk(s) from {path}")
+    return count
+
+
+def _snapshot_main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m tools.ingest",
+        description="Export or import a portable embedding snapshot",
+    )
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument(
+        "path",
+        nargs="?",
+        default=None,
+        help="Snapshot file (default: timestamped file / latest in the snapshot dir)",
+    )
+    parser.add_argument(
+        "--namespace",
+        default=COURSE_NAMESPACE,
+        help="Collection to export or import (default: course corpus)",
+    )
+    parser.add_argument(
+        "--ignore-model",
+        action="store_true",
+        help="Import even if the snapshot was built with another embedding model",
+    )
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        export_snapshot(args.path, namespace=args.namespace)
+    else:
+        import_snapshot(
+            args.path, namespace=args.namespace, check_model=not args.ignore_model
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in {"export", "import"}:
+        _snapshot_main(argv)
+        return
+
     parser = argparse.ArgumentParser(description="Ingest documents into RAG store")
     parser.add_argument(
         "folder",
@@ -75,8 +407,30 @@ def main() -> None:
         default="data/RAG_files",
         help="Folder containing documents to ingest",
     )
-    args = parser.parse_args()
-    ingest_folder(args.folder)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of loader/OCR processes (default: RAG_INGEST_WORKERS or 2)",
+    )
+    parser.add_argument(
+        "--ocr-workers",
+        type=int,
+        default=None,
+        help="OCR processes per scanned PDF (default: RAG_OCR_WORKERS or 1)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Re-ingest every file even if the manifest says it is unchanged",
+    )
+    args = parser.parse_args(argv)
+    ingest_folder(
+        args.folder,
+        workers=args.workers,
+        force=args.force,
+        ocr_workers=args.ocr_workers,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import json
+import os
+from hashlib import sha256
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+
+def file_sha256(path: Path, block_size: int = 1024 * 1024) -> str:
+    digest = sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """JSON record of every ingested source file and the chunk IDs it produced.
+
+    Each entry stores the file's ``size``, ``mtime_ns`` and content ``sha256``
+    so unchanged files can be skipped before they are opened, plus
+    ``chunk_ids`` so the vectors of changed or deleted files can be removed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        self.entries: Dict[str, dict] = {}
+        if self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, source: str) -> Optional[dict]:
+        return self.entries.get(source)
+
+    def is_unchanged(self, source: Path) -> bool:
+        """Return ``True`` if ``source`` matches its recorded state.
+
+        A matching size and mtime is trusted without reading the file. If only
+        the mtime moved (e.g. the file was copied) the content hash decides,
+        and the entry is refreshed so the next run takes the fast path.
+        """
+        entry = self.entries.get(str(source))
+        if entry is None:
+            return False
+        stat = source.stat()
+        if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return True
+        if entry["size"] == stat.st_size and entry["sha256"] == file_sha256(source):
+            entry["mtime_ns"] = stat.st_mtime_ns
+            return True
+        return False
+
+    def record(self, source: Path, chunk_ids: List[str]) -> None:
+        stat = source.stat()
+        self.entries[str(source)] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": file_sha256(source),
+            "chunk_ids": list(dict.fromkeys(chunk_ids)),
+        }
+
+    def remove(self, source: str) -> Optional[dict]:
+        return self.entries.pop(source, None)
+
+    def sources_under(self, folder: Path) -> List[str]:
+        folder = Path(folder)
+        return [s for s in self.entries if Path(s).is_relative_to(folder)]
+
+    def ids_in_use(self, exclude: Iterable[str] = ()) -> Set[str]:
+        """Return chunk IDs referenced by entries other than ``exclude``."""
+        skip = set(exclude)
+        used: Set[str] = set()
+        for source, entry in self.entries.items():
+            if source not in skip:
+                used.update(entry.get("chunk_ids", []))
+        return used
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(
+            json.dumps(self.entries, indent=2, ensure_ascii=False), encoding="utf-8"
+        )
+        os.replace(tmp, self.path)
@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from tools.file_lock import file_lock, file_stamp
+
+try:  # pragma: no cover - optional dependency
+    import jieba
+
+    jieba.setLogLevel(60)
+except ImportError:  # pragma: no cover - optional dependency
+    jieba = None
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._+#-][a-z0-9]+)*|[㐀-䶿一-鿿]+")
+_CJK_RE = re.compile(r"[㐀-䶿一-鿿]")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split ``text`` into lexical terms for mixed Chinese/English content.
+
+    Latin words and identifiers (``HDFS``, ``map-reduce``, ``python3``) are
+    kept whole and lower-cased. Chinese runs are segmented with ``jieba`` when
+    it is installed, otherwise they are indexed as character unigrams plus
+    bigrams, which is a robust dictionary-free approximation.
+    """
+    tokens: List[str] = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        run = match.group()
+        if not _CJK_RE.match(run):
+            tokens.append(run)
+        elif jieba is not None:
+            tokens.extend(t for t in jieba.lcut_for_search(run) if t.strip())
+        else:
+            tokens.extend(run)
+            tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """In-process inverted index scored with Okapi BM25.
+
+    Documents are stored with their text and metadata so lexical hits can be
+    returned without a round trip to the vector store. The index is persisted
+    as a JSON base file plus an append-only JSON-lines journal
+    (``path + ".log"``); both carry each document's term counts, so loading
+    never re-tokenizes. :meth:`save` only appends the changes made since the
+    last save and folds the journal into the base file once it outgrows it,
+    so incremental ingest costs O(batch) amortized rather than O(corpus).
+
+    The files may be shared by several processes: :meth:`save` takes a file
+    lock, first applies journal entries other processes appended since this
+    instance last read it (reloading everything if the base file was
+    rewritten), re-applies this instance's unsaved additions and removals on
+    top, and then appends them; :meth:`refresh` picks up other processes'
+    saves the same way.
+    """
+
+    def __init__(self, path: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.log_path = path + ".log" if path else None
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._docs: Dict[str, dict] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_len = 0
+        # 自上次保存以来本进程新增/删除的文档，保存时合并到磁盘上的最新版本
+        self._added: set = set()
+        self._removed: set = set()
+        self._stamp = None
+        # 已读取到的日志字节数
+        self._log_offset = 0
+        if path and (os.path.exists(path) or os.path.exists(self.log_path)):
+            with file_lock(path):
+                self._load()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._docs
+
+    def add(
+        self,
+        ids: Sequence[str],
+        texts: Sequence[str],
+        metadatas: Optional[Sequence[dict]] = None,
+    ) -> None:
+        metadatas = metadatas or [{} for _ in ids]
+        with self._lock:
+            for doc_id, text, metadata in zip(ids, texts, metadatas):
+                self._index(doc_id, text, metadata)
+                self._added.add(doc_id)
+                self._removed.discard(doc_id)
+
+    def _index(
+        self,
+        doc_id: str,
+        text: str,
+        metadata: Optional[dict],
+        terms: Optional[Dict[str, int]] = None,
+    ) -> None:
+        if doc_id in self._docs:
+            self._remove_one(doc_id)
+        counts = dict(terms) if terms is not None else dict(Counter(tokenize(text)))
+        length = sum(counts.values())
+        self._docs[doc_id] = {
+            "text": text,
+            "metadata": dict(metadata or {}),
+            "terms": counts,
+            "length": length,
+        }
+        self._total_len += length
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for doc_id in ids:
+                if doc_id in self._docs:
+                    self._remove_one(doc_id)
+                self._removed.add(doc_id)
+                self._added.discard(doc_id)
+
+    def _remove_one(self, doc_id: str) -> None:
+        doc = self._docs.pop(doc_id)
+        self._total_len -= doc["length"]
+        for term in doc["terms"]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(
+        self,
+        query: str,
+        k: int = 4,
+        sources: Optional[Iterable[str]] = None,
+    ) -> List[Tuple[Document, float]]:
+        """Return the top ``k`` documents for ``query`` with their BM25 score.
+
+        ``sources`` restricts the candidates to documents whose ``source``
+        metadata is in the given set.
+        """
+        allowed = set(sources) if sources is not None else None
+        with self._lock:
+            n = len(self._docs)
+            if not n:
+                return []
+            avg_len = self._total_len / n or 1.0
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    doc = self._docs[doc_id]
+                    if allowed is not None and doc["metadata"].get("source") not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * doc["length"] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (
+                        self.k1 + 1
+                    ) / (tf + norm)
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [
+                (
+                    Document(
+                        page_content=self._docs[doc_id]["text"],
+                        metadata=dict(self._docs[doc_id]["metadata"]),
+                    ),
+                    score,
+                )
+                for doc_id, score in ranked
+            ]
+
+    def refresh(self) -> bool:
+        """Pick up saves made by other processes; return whether it reloaded."""
+        if not self.path:
+            return False
+        with self._lock:
+            if self._in_sync():
+                return False
+            with file_lock(self.path):
+                self._merge_from_disk()
+            return True
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock, file_lock(self.path):
+            if not self._in_sync():
+                self._merge_from_disk()
+            entries = [
+                {"id": doc_id, **self._record(self._docs[doc_id])}
+                for doc_id in self._added
+                if doc_id in self._docs
+            ]
+            entries.extend({"id": doc_id, "removed": True} for doc_id in self._removed)
+            if entries:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self._log_offset = _file_size(self.log_path)
+            # 日志超过基础文件后合并一次，重写开销按追加量摊还
+            if self._stamp is None or self._log_offset > self._stamp[2]:
+                self._compact()
+            self._added.clear()
+            self._removed.clear()
+
+    @staticmethod
+    def _record(doc: dict) -> dict:
+        return {"text": doc["text"], "metadata": doc["metadata"], "terms": doc["terms"]}
+
+    def _compact(self) -> None:
+        """Rewrite the base file from memory and empty the journal."""
+        payload = {doc_id: self._record(doc) for doc_id, doc in self._docs.items()}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self._stamp = file_stamp(self.path)
+        self._log_offset = 0
+
+    def _in_sync(self) -> bool:
+        return (
+            file_stamp(self.path) == self._stamp
+            and _file_size(self.log_path) == self._log_offset
+        )
+
+    def _merge_from_disk(self) -> None:
+        """Catch up with the files and re-apply this instance's unsaved changes.
+
+        Only journal entries appended since the last read are applied, unless
+        another process compacted the index, in which case it is reloaded.
+        """
+        pending = [
+            (doc_id, self._docs[doc_id])
+            for doc_id in self._added
+            if doc_id in self._docs
+        ]
+        if file_stamp(self.path) != self._stamp:
+            self._docs, self._postings, self._total_len = {}, {}, 0
+            self._load()
+        else:
+            self._read_log()
+        for doc_id, doc in pending:
+            self._index(doc_id, doc["text"], doc["metadata"], doc["terms"])
+        for doc_id in self._removed:
+            if doc_id in self._docs:
+                self._remove_one(doc_id)
+
+    def _load(self) -> None:
+        self._stamp = file_stamp(self.path)
+        self._log_offset = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            payload = {}
+        for doc_id, doc in payload.items():
+            # 旧格式没有词频，加载时补算一次
+            self._index(doc_id, doc["text"], doc["metadata"], doc.get("terms"))
+        self._read_log()
+
+    def _read_log(self) -> None:
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(self._log_offset)
+                data = f.read()
+        except OSError:
+            return
+        # 只处理完整的行，写到一半的尾部留待下次读取
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            doc_id = entry["id"]
+            if entry.get("removed"):
+                if doc_id in self._docs:
+                    self._remove_one(doc_id)
+            else:
+                self._index(doc_id, entry["text"], entry["metadata"], entry.get("terms"))
+        self._log_offset += end
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
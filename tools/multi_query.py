@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from langchain_classic.retrievers import MultiQueryRetriever
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from pydantic import ConfigDict
+
+from tools.memory_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_CJK_RE = re.compile(r"[㐀-䶿一-鿿]")
+_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+_QUESTION_RE = re.compile(
+    r"[?？]|什么|如何|为什么|怎么|怎样|哪|吗|呢|区别|比较|解释|介绍|"
+    r"\b(what|how|why|which|when|where|who|explain|compare|difference)\b",
+    re.IGNORECASE,
+)
+
+
+def normalize_query(query: str) -> str:
+    """Lower-case ``query`` and collapse whitespace and trailing punctuation."""
+    return re.sub(r"\s+", " ", query).strip().rstrip("?？。.!！").lower()
+
+
+def is_keyword_query(query: str, min_units: int = 6) -> bool:
+    """Return ``True`` for short or keyword-like queries.
+
+    A query is measured in "units": Chinese characters plus Latin words.
+    Queries below ``min_units`` (``"HDFS"``, ``"数据仓库"``), and queries of
+    at most three space-separated terms without any question word
+    (``"HDFS 块大小 副本"``), gain little from LLM rewriting.
+    """
+    units = len(_CJK_RE.findall(query)) + len(_WORD_RE.findall(query))
+    if units < min_units:
+        return True
+    return len(query.split()) <= 3 and not _QUESTION_RE.search(query) and (
+        units < min_units * 2
+    )
+
+
+class CachedMultiQueryRetriever(MultiQueryRetriever):
+    """:class:`MultiQueryRetriever` with cached, bypassable, parallel expansion.
+
+    * Generated query variants are cached per normalized question in
+      ``query_cache`` (shared across retriever instances by ``RAGService``).
+    * Keyword-like queries (see :func:`is_keyword_query`) skip the LLM call
+      and go straight to the base retriever.
+    * The variant searches run concurrently on up to ``max_workers`` threads.
+    * :meth:`retrieve_many` expands several questions and, when the base
+      retriever supports it, sends every variant in one batched search.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    query_cache: Optional[TTLCache] = None
+    min_query_units: int = 6
+    max_workers: int = 4
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+    ) -> List[Document]:
+        if is_keyword_query(query, self.min_query_units):
+            logger.debug("Skipping query expansion for %r", query)
+            return self.retriever.invoke(
+                query, config={"callbacks": run_manager.get_child()}
+            )
+        return super()._get_relevant_documents(query, run_manager=run_manager)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+    ) -> List[Document]:
+        if is_keyword_query(query, self.min_query_units):
+            logger.debug("Skipping query expansion for %r", query)
+            return await self.retriever.ainvoke(
+                query, config={"callbacks": run_manager.get_child()}
+            )
+        return await super()._aget_relevant_documents(query, run_manager=run_manager)
+
+    def generate_queries(
+        self, question: str, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[str]:
+        key = normalize_query(question)
+        if self.query_cache is not None:
+            cached = self.query_cache.get(key)
+            if cached is not None:
+                return list(cached)
+        queries = super().generate_queries(question, run_manager)
+        if self.query_cache is not None and queries:
+            self.query_cache.set(key, list(queries))
+        return list(queries)
+
+    async def agenerate_queries(
+        self, question: str, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[str]:
+        key = normalize_query(question)
+        if self.query_cache is not None:
+            cached = self.query_cache.get(key)
+            if cached is not None:
+                return list(cached)
+        queries = await super().agenerate_queries(question, run_manager)
+        if self.query_cache is not None and queries:
+            self.query_cache.set(key, list(queries))
+        return list(queries)
+
+    def retrieve_many(self, questions: List[str]) -> List[List[Document]]:
+        """Retrieve for several questions, batching all variant searches.
+
+        Each question is expanded (keyword-like ones are not; cached variants
+        are reused) and the variants of every question go to the base
+        retriever's ``retrieve_many`` together. Each question gets the unique
+        union of its variants' hits.
+        """
+        if not hasattr(self.retriever, "retrieve_many"):
+            return [self.invoke(q) for q in questions]
+        run_manager = CallbackManagerForRetrieverRun.get_noop_manager()
+
+        def _variants(question: str) -> List[str]:
+            if is_keyword_query(question, self.min_query_units):
+                return [question]
+            variants = self.generate_queries(question, run_manager)
+            if self.include_original or not variants:
+                variants.append(question)
+            return variants
+
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(len(questions), self.max_workers))
+        ) as pool:
+            expanded = list(pool.map(_variants, questions))
+        flat = [variant for variants in expanded for variant in variants]
+        rankings = iter(self.retriever.retrieve_many(flat))
+        return [
+            self.unique_union(
+                [doc for _ in variants for doc in next(rankings)]
+            )
+            for variants in expanded
+        ]
+
+    def retrieve_documents(
+        self, queries: List[str], run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if len(queries) <= 1 or self.max_workers <= 1:
+            return super().retrieve_documents(queries, run_manager)
+        configs = [{"callbacks": run_manager.get_child()} for _ in queries]
+        with ThreadPoolExecutor(
+            max_workers=min(len(queries), self.max_workers)
+        ) as pool:
+            results = pool.map(
+                lambda args: self.retriever.invoke(args[0], config=args[1]),
+                zip(queries, configs),
+            )
+            return [doc for docs in results for doc in docs]
@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+import zlib
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from tools.file_lock import file_lock, file_stamp
+
+logger = logging.getLogger(__name__)
+
+_PRIME = np.uint64((1 << 61) - 1)
+_NOISE_RE = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def _shingles(text: str, size: int) -> List[str]:
+    # 去掉空白与标点后取字符 n-gram，对中英文都适用
+    text = _NOISE_RE.sub("", text.lower())
+    if len(text) <= size:
+        return [text] if text else []
+    return [text[i : i + size] for i in range(len(text) - size + 1)]
+
+
+class NearDuplicateIndex:
+    """MinHash LSH index used to drop near-duplicate chunks at ingest time.
+
+    Each text becomes a set of character ``shingle``-grams (whitespace and
+    punctuation removed) summarised by ``num_perm`` MinHash values. The
+    signature is cut into ``bands`` bands; texts sharing any band are
+    candidates, and a candidate whose estimated Jaccard similarity reaches
+    ``threshold`` is a duplicate. With ``per_source`` (the default) only
+    chunks of the same ``source`` are compared, so source-filtered retrieval
+    never loses text that exists only in another file.
+
+    IDs and signatures are persisted to ``path`` as ``.npz``; additions made
+    since the last :meth:`save` can be undone with :meth:`rollback`. Like
+    :class:`~tools.lexical_index.BM25Index`, :meth:`save` merges with saves
+    made by other processes under a file lock and :meth:`refresh` reloads
+    them.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        threshold: float = 0.85,
+        num_perm: int = 64,
+        bands: int = 8,
+        shingle: int = 5,
+        min_chars: int = 80,
+        per_source: bool = True,
+    ) -> None:
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.path = path
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle = shingle
+        self.min_chars = min_chars
+        self.per_source = per_source
+        rng = np.random.default_rng(1)
+        self._a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._lock = threading.RLock()
+        self._ids: List[Optional[str]] = []
+        self._sources: List[str] = []
+        self._signatures: List[np.ndarray] = []
+        self._positions: Dict[str, int] = {}
+        self._buckets: Dict[Tuple, List[int]] = defaultdict(list)
+        self._saved = 0
+        # 自上次保存以来删除的 ID；新增的签名是 _saved 之后的条目
+        self._removed: set = set()
+        self._stamp = None
+        if os.path.exists(self.path):
+            with file_lock(self.path):
+                self._load()
+
+    # ------------------------------------------------------------------ 签名
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """Return the MinHash signature of ``text`` (``None`` if too short)."""
+        if len(text) < self.min_chars:
+            return None
+        shingles = _shingles(text, self.shingle)
+        if not shingles:
+            return None
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in set(shingles)),
+            dtype=np.uint64,
+        )
+        permuted = (hashes[:, None] * self._a + self._b) % _PRIME
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, source: str, signature: np.ndarray) -> List[Tuple]:
+        rows = self.num_perm // self.bands
+        scope = source if self.per_source else ""
+        return [
+            (scope, band, signature[band * rows : (band + 1) * rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    # ------------------------------------------------------------------ 查询/写入
+    def find(
+        self, text: str, source: str = "", signature: Optional[np.ndarray] = None
+    ) -> Optional[str]:
+        """Return the ID of an indexed near-duplicate of ``text``, if any."""
+        signature = self.signature(text) if signature is None else signature
+        if signature is None:
+            return None
+        with self._lock:
+            candidates = {
+                pos
+                for key in self._band_keys(source, signature)
+                for pos in self._buckets.get(key, ())
+            }
+            best, best_score = None, self.threshold
+            for pos in candidates:
+                if self._ids[pos] is None:
+                    continue
+                score = float(np.mean(self._signatures[pos] == signature))
+                if score >= best_score:
+                    best, best_score = self._ids[pos], score
+            return best
+
+    def add(
+        self, doc_id: str, text: str, source: str = "", signature: Optional[np.ndarray] = None
+    ) -> None:
+        signature = self.signature(text) if signature is None else signature
+        if signature is None:
+            return
+        with self._lock:
+            if doc_id in self._positions:
+                return
+            self._append(doc_id, source, signature)
+
+    def _append(self, doc_id: str, source: str, signature: np.ndarray) -> None:
+        position = len(self._ids)
+        self._ids.append(doc_id)
+        self._sources.append(source)
+        self._signatures.append(signature)
+        self._positions[doc_id] = position
+        for key in self._band_keys(source, signature):
+            self._buckets[key].append(position)
+
+    def source_of(self, doc_id: str) -> Optional[str]:
+        with self._lock:
+            position = self._positions.get(doc_id)
+            return None if position is None else self._sources[position]
+
+    def remove(self, ids: Sequence[str]) -> None:
+        with self._lock:
+            for doc_id in ids:
+                position = self._positions.pop(doc_id, None)
+                if position is not None:
+                    self._ids[position] = None
+                self._removed.add(doc_id)
+
+    def rollback(self) -> None:
+        """Forget everything added since the last :meth:`save` or load."""
+        with self._lock:
+            self._rebuild(
+                [
+                    (doc_id, source, sig)
+                    for doc_id, source, sig in zip(
+                        self._ids[: self._saved],
+                        self._sources[: self._saved],
+                        self._signatures[: self._saved],
+                    )
+                ]
+            )
+            self._saved = len(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    # ------------------------------------------------------------------ 持久化
+    def _rebuild(self, entries) -> None:
+        self._ids, self._sources, self._signatures = [], [], []
+        self._positions = {}
+        self._buckets = defaultdict(list)
+        for doc_id, source, signature in entries:
+            if doc_id is not None:
+                self._append(doc_id, source, signature)
+
+    def _load(self) -> None:
+        self._stamp = file_stamp(self.path)
+        if self._stamp is None:
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                ids = data["ids"].tolist()
+                sources = data["sources"].tolist()
+                signatures = data["signatures"]
+        except (OSError, ValueError, KeyError) as exc:
+            logger.warning("Could not load near-duplicate index %s: %s", self.path, exc)
+            return
+        if signatures.shape[1:] != (self.num_perm,):
+            logger.warning("Near-duplicate index %s has other parameters; ignoring", self.path)
+            return
+        self._rebuild(zip(ids, sources, signatures))
+        self._saved = len(self._ids)
+
+    def _merge_from_disk(self) -> None:
+        """Reload the file and re-apply this instance's unsaved changes."""
+        pending = [
+            (doc_id, source, signature)
+            for doc_id, source, signature in zip(
+                self._ids[self._saved :],
+                self._sources[self._saved :],
+                self._signatures[self._saved :],
+            )
+            if doc_id is not None
+        ]
+        self._rebuild([])
+        self._saved = 0
+        self._load()
+        self.remove(list(self._removed))
+        for doc_id, source, signature in pending:
+            if doc_id not in self._positions:
+                self._append(doc_id, source, signature)
+
+    def refresh(self) -> bool:
+        """Pick up saves made by other processes; return whether it reloaded."""
+        with self._lock:
+            if file_stamp(self.path) == self._stamp:
+                return False
+            with file_lock(self.path):
+                self._merge_from_disk()
+            return True
+
+    def save(self) -> None:
+        with self._lock, file_lock(self.path):
+            if file_stamp(self.path) != self._stamp:
+                self._merge_from_disk()
+            live = [i for i, doc_id in enumerate(self._ids) if doc_id is not None]
+            self._rebuild(
+                [(self._ids[i], self._sources[i], self._signatures[i]) for i in live]
+            )
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    ids=np.array(self._ids, dtype=str),
+                    sources=np.array(self._sources, dtype=str),
+                    signatures=(
+                        np.stack(self._signatures)
+                        if self._signatures
+                        else np.zeros((0, self.num_perm), dtype=np.uint32)
+                    ),
+                )
+            os.replace(tmp, self.path)
+            self._saved = len(self._ids)
+            self._stamp = file_stamp(self.path)
+            self._removed.clear()
@@ -0,0 +1,552 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from tools.file_lock import file_lock, file_stamp
+
+logger = logging.getLogger(__name__)
+
+_DTYPES = {"float16": np.float16, "int8": np.int8}
+_BLOCK_ROWS = 4096
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class NumpyVectorIndex:
+    """Brute-force vector index over a compact NumPy matrix.
+
+    Embeddings are L2-normalized and stored as ``float16`` or per-row scaled
+    ``int8`` in ``vectors.npy``; ``source`` and ``page`` are kept as columnar
+    integer arrays so scope filters become boolean masks. Texts, metadata
+    and the source vocabulary live in the ``meta.json`` sidecar. By default
+    (``resident``) a ``float32`` copy is kept for search and updated in place
+    on upsert; with ``resident=False`` the arrays stay memory-mapped and rows
+    are upcast block by block per query, which needs a quarter of the memory
+    but is an order of magnitude slower. Rows are appended to preallocated
+    buffers that grow geometrically, so batched ingest stays linear.
+
+    Several processes may share ``path``: :meth:`persist` takes a file lock
+    and, if another process saved in the meantime, reloads the files and
+    re-applies this instance's unsaved upserts and deletes before writing.
+    :meth:`refresh` picks up other processes' writes without saving.
+
+    The methods mirror the subset of the Chroma vector store and collection
+    API used by :class:`~tools.rag_service.RAGService`: ``get``, ``upsert``,
+    ``delete``, the batched ``query`` and the ``*_by_vector`` searches. Filters support equality and
+    ``$in`` on metadata keys.
+    """
+
+    def __init__(
+        self, path: str, dtype: str = "float16", resident: bool = True
+    ) -> None:
+        if dtype not in _DTYPES:
+            raise ValueError(f"Unsupported index dtype: {dtype}")
+        self.path = path
+        self.dtype = dtype
+        self.resident = resident
+        self._lock = threading.RLock()
+        # 自上次保存以来本进程写入/删除的 ID，保存时合并到磁盘上的最新版本
+        self._upserted: set = set()
+        self._deleted: set = set()
+        self._reset()
+        if os.path.exists(self._file("meta.json")):
+            with file_lock(self._file("meta.json")):
+                self._load()
+
+    # ------------------------------------------------------------------ 存储
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _reset(self) -> None:
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._documents: List[str] = []
+        self._metadatas: List[dict] = []
+        self._source_names: List[str] = []
+        self._source_lookup: Dict[str, int] = {}
+        self._vectors = np.zeros((0, 0), dtype=_DTYPES[self.dtype])
+        self._scales = np.ones(0, dtype=np.float32)
+        self._sources = np.zeros(0, dtype=np.int32)
+        self._pages = np.zeros(0, dtype=np.int32)
+        self._dense: Optional[np.ndarray] = None
+        # 预分配的可写缓冲区；上面的数组是其前 len(self._ids) 行的视图
+        self._buffers: Optional[Dict[str, np.ndarray]] = None
+        self._dense_buffer: Optional[np.ndarray] = None
+        self._stamp = None
+
+    def _load(self) -> None:
+        meta_path = self._file("meta.json")
+        stamp = file_stamp(meta_path)
+        if stamp is None:
+            return
+        self._stamp = stamp
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("dtype") != self.dtype:
+                logger.warning(
+                    "NumPy index at %s uses %s, rebuilding as %s",
+                    self.path,
+                    meta.get("dtype"),
+                    self.dtype,
+                )
+                return
+            vectors = np.load(self._file("vectors.npy"), mmap_mode="r")
+            scales = np.load(self._file("scales.npy"), mmap_mode="r")
+            sources = np.load(self._file("sources.npy"), mmap_mode="r")
+            pages = np.load(self._file("pages.npy"), mmap_mode="r")
+        except (OSError, ValueError) as exc:
+            logger.warning("Could not load NumPy index at %s: %s", self.path, exc)
+            return
+        if len(meta["ids"]) != len(vectors):
+            logger.warning("NumPy index at %s is inconsistent; ignoring", self.path)
+            return
+        self._ids = list(meta["ids"])
+        self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        self._documents = list(meta["documents"])
+        self._metadatas = list(meta["metadatas"])
+        self._source_names = list(meta["sources"])
+        self._source_lookup = {s: i for i, s in enumerate(self._source_names)}
+        self._vectors, self._scales = vectors, scales
+        self._sources, self._pages = sources, pages
+        self._dense = None
+        self._buffers = self._dense_buffer = None
+
+    def _merge_from_disk(self) -> None:
+        """Reload the files and re-apply this instance's unsaved changes."""
+        rows = [self._positions[i] for i in self._upserted if i in self._positions]
+        pending = (
+            [self._ids[r] for r in rows],
+            np.array(self._vectors[rows]),
+            np.array(self._scales[rows]),
+            [self._metadatas[r] for r in rows],
+            [self._documents[r] for r in rows],
+        )
+        deleted = list(self._deleted)
+        self._reset()
+        self._load()
+        if rows:
+            self._put(*pending)
+        if deleted:
+            self._drop(deleted, None)
+
+    def refresh(self) -> bool:
+        """Pick up writes made by other processes; return whether it reloaded."""
+        with self._lock:
+            if file_stamp(self._file("meta.json")) == self._stamp:
+                return False
+            # 持锁读取，避免读到另一进程写了一半的文件
+            with file_lock(self._file("meta.json")):
+                self._merge_from_disk()
+            return True
+
+    def persist(self) -> None:
+        """Merge with the files on disk and write arrays and sidecar atomically."""
+        with self._lock, file_lock(self._file("meta.json")):
+            if file_stamp(self._file("meta.json")) != self._stamp:
+                self._merge_from_disk()
+            os.makedirs(self.path, exist_ok=True)
+            arrays = {
+                "vectors.npy": self._vectors,
+                "scales.npy": self._scales,
+                "sources.npy": self._sources,
+                "pages.npy": self._pages,
+            }
+            for name, array in arrays.items():
+                tmp = self._file(name + ".tmp")
+                with open(tmp, "wb") as f:
+                    np.save(f, np.ascontiguousarray(array))
+                os.replace(tmp, self._file(name))
+            meta = {
+                "dtype": self.dtype,
+                "dim": int(self._vectors.shape[1]) if self._vectors.size else 0,
+                "ids": self._ids,
+                "documents": self._documents,
+                "metadatas": self._metadatas,
+                "sources": self._source_names,
+            }
+            tmp = self._file("meta.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp, self._file("meta.json"))
+            self._stamp = file_stamp(self._file("meta.json"))
+            self._upserted.clear()
+            self._deleted.clear()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def memory_bytes(self) -> int:
+        """Bytes held by the vector arrays (excluding texts and metadata)."""
+        if self._buffers is not None:
+            total = sum(b.nbytes for b in self._buffers.values())
+        else:
+            total = self._vectors.nbytes + self._scales.nbytes
+            total += self._sources.nbytes + self._pages.nbytes
+        if self._dense_buffer is not None:
+            total += self._dense_buffer.nbytes
+        elif self._dense is not None:
+            total += self._dense.nbytes
+        return int(total)
+
+    # ------------------------------------------------------------------ 写入
+    def _quantize(self, matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self.dtype == "int8":
+            scales = np.abs(matrix).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            codes = np.round(matrix / scales[:, None]).astype(np.int8)
+            return codes, scales.astype(np.float32)
+        return matrix.astype(np.float16), np.ones(len(matrix), dtype=np.float32)
+
+    def _source_code(self, source: Any) -> int:
+        if source is None:
+            return -1
+        source = str(source)
+        code = self._source_lookup.get(source)
+        if code is None:
+            code = len(self._source_names)
+            self._source_names.append(source)
+            self._source_lookup[source] = code
+        return code
+
+    @staticmethod
+    def _page_of(metadata: dict) -> int:
+        try:
+            return int(metadata.get("page"))
+        except (TypeError, ValueError):
+            return -1
+
+    def upsert(
+        self,
+        ids: Sequence[str],
+        embeddings: Sequence[Sequence[float]],
+        metadatas: Optional[Sequence[dict]] = None,
+        documents: Optional[Sequence[str]] = None,
+    ) -> None:
+        if not ids:
+            return
+        # 同一批次内重复的 ID 只保留最后一次
+        last = {doc_id: row for row, doc_id in enumerate(ids)}
+        if len(last) != len(ids):
+            keep = sorted(last.values())
+            ids = [ids[i] for i in keep]
+            embeddings = [embeddings[i] for i in keep]
+            metadatas = [metadatas[i] for i in keep] if metadatas else None
+            documents = [documents[i] for i in keep] if documents else None
+        metadatas = list(metadatas or [{} for _ in ids])
+        documents = list(documents or ["" for _ in ids])
+        matrix = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        codes, scales = self._quantize(matrix)
+        with self._lock:
+            self._put(list(ids), codes, scales, metadatas, documents)
+            self._upserted.update(ids)
+            self._deleted.difference_update(ids)
+
+    def _reserve(self, extra: int, dim: int) -> None:
+        """Make room for ``extra`` more rows in writable, preallocated buffers."""
+        n = len(self._ids)
+        capacity = len(self._buffers["vectors"]) if self._buffers is not None else -1
+        if n + extra <= capacity:
+            return
+        # 容量按 1.5 倍增长：逐批追加时每行的摊销复制成本为常数
+        capacity = max(n + extra, int(capacity * 1.5), 256)
+        buffers = {
+            "vectors": np.empty((capacity, dim), dtype=_DTYPES[self.dtype]),
+            "scales": np.empty(capacity, dtype=np.float32),
+            "sources": np.empty(capacity, dtype=np.int32),
+            "pages": np.empty(capacity, dtype=np.int32),
+        }
+        if n:
+            buffers["vectors"][:n] = self._vectors
+            buffers["scales"][:n] = self._scales
+            buffers["sources"][:n] = self._sources
+            buffers["pages"][:n] = self._pages
+        self._buffers = buffers
+        self._view(n)
+        # 常驻的 float32 副本下次查询时按新容量重建
+        self._dense = self._dense_buffer = None
+
+    def _view(self, n: int) -> None:
+        self._vectors = self._buffers["vectors"][:n]
+        self._scales = self._buffers["scales"][:n]
+        self._sources = self._buffers["sources"][:n]
+        self._pages = self._buffers["pages"][:n]
+
+    def _put(
+        self,
+        ids: List[str],
+        codes: np.ndarray,
+        scales: np.ndarray,
+        metadatas: List[dict],
+        documents: List[str],
+    ) -> None:
+        """Insert or replace rows that are already quantized."""
+        with self._lock:
+            if self._vectors.size and self._vectors.shape[1] != codes.shape[1]:
+                raise ValueError(
+                    f"Embedding dimension {codes.shape[1]} does not match "
+                    f"index dimension {self._vectors.shape[1]}"
+                )
+            fresh = sum(1 for doc_id in ids if doc_id not in self._positions)
+            self._reserve(fresh, codes.shape[1])
+            buffers = self._buffers
+            touched = []
+            for row, doc_id in enumerate(ids):
+                metadata = dict(metadatas[row] or {})
+                position = self._positions.get(doc_id)
+                if position is None:
+                    position = self._positions[doc_id] = len(self._ids)
+                    self._ids.append(doc_id)
+                    self._documents.append(documents[row])
+                    self._metadatas.append(metadata)
+                else:
+                    self._documents[position] = documents[row]
+                    self._metadatas[position] = metadata
+                buffers["vectors"][position] = codes[row]
+                buffers["scales"][position] = scales[row]
+                buffers["sources"][position] = self._source_code(metadata.get("source"))
+                buffers["pages"][position] = self._page_of(metadata)
+                touched.append(position)
+            self._view(len(self._ids))
+            if self._dense is not None:
+                # 只更新变动的行，不重新换算整个矩阵
+                self._dense_buffer[touched] = self._upcast(touched)
+                self._dense = self._dense_buffer[: len(self._ids)]
+
+    def delete(
+        self, ids: Optional[Sequence[str]] = None, where: Optional[dict] = None
+    ) -> None:
+        with self._lock:
+            dropped = self._drop(ids, where)
+            self._deleted.update(dropped)
+            self._upserted.difference_update(dropped)
+
+    def _drop(
+        self, ids: Optional[Sequence[str]], where: Optional[dict]
+    ) -> List[str]:
+        with self._lock:
+            drop = np.zeros(len(self._ids), dtype=bool)
+            if ids:
+                for doc_id in ids:
+                    position = self._positions.get(doc_id)
+                    if position is not None:
+                        drop[position] = True
+            if where:
+                drop |= self._mask(where)
+            if not drop.any():
+                return []
+            dropped = [self._ids[i] for i in np.flatnonzero(drop)]
+            keep = np.flatnonzero(~drop)
+            self._vectors = np.array(self._vectors)[keep]
+            self._scales = np.array(self._scales)[keep]
+            self._sources = np.array(self._sources)[keep]
+            self._pages = np.array(self._pages)[keep]
+            self._ids = [self._ids[i] for i in keep]
+            self._documents = [self._documents[i] for i in keep]
+            self._metadatas = [self._metadatas[i] for i in keep]
+            self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+            self._dense = None
+            self._buffers = self._dense_buffer = None
+            return dropped
+
+    # ------------------------------------------------------------------ 查询
+    def _mask(self, where: Optional[dict]) -> np.ndarray:
+        mask = np.ones(len(self._ids), dtype=bool)
+        for key, condition in (where or {}).items():
+            values = condition["$in"] if isinstance(condition, dict) else [condition]
+            if key == "source":
+                codes = [self._source_lookup[v] for v in values if v in self._source_lookup]
+                mask &= np.isin(self._sources, codes)
+            elif key == "page":
+                mask &= np.isin(self._pages, [int(v) for v in values])
+            elif key in {"doc_hash", "id"}:
+                rows = [self._positions[v] for v in values if v in self._positions]
+                selected = np.zeros(len(self._ids), dtype=bool)
+                selected[rows] = True
+                mask &= selected
+            else:
+                wanted = set(values)
+                mask &= np.array(
+                    [m.get(key) in wanted for m in self._metadatas], dtype=bool
+                )
+        return mask
+
+    def _search_matrix(self) -> np.ndarray:
+        if self._dense is None:
+            n = len(self._ids)
+            capacity = len(self._buffers["vectors"]) if self._buffers is not None else n
+            dim = self._vectors.shape[1] if self._vectors.ndim == 2 else 0
+            self._dense_buffer = np.empty((capacity, dim), dtype=np.float32)
+            self._dense_buffer[:n] = self._upcast(slice(None))
+            self._dense = self._dense_buffer[:n]
+        return self._dense
+
+    def _upcast(self, rows) -> np.ndarray:
+        return np.asarray(self._vectors[rows], dtype=np.float32) * np.asarray(
+            self._scales[rows], dtype=np.float32
+        )[:, None]
+
+    def _scores(self, query: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        if rows is None:
+            # 无过滤时直接用整块矩阵，避免花式索引复制
+            if self.resident:
+                return self._search_matrix() @ query
+            rows = np.arange(len(self._ids))
+        if self.resident:
+            return self._search_matrix()[rows] @ query
+        return np.concatenate(
+            [
+                self._upcast(rows[i : i + _BLOCK_ROWS]) @ query
+                for i in range(0, len(rows), _BLOCK_ROWS)
+            ]
+            or [np.zeros(0, dtype=np.float32)]
+        )
+
+    def _document(self, position: int) -> Document:
+        return Document(
+            id=self._ids[position],
+            page_content=self._documents[position],
+            metadata=dict(self._metadatas[position]),
+        )
+
+    def _top(
+        self, embedding: Sequence[float], k: int, filter: Optional[dict]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        if not self._ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        rows = np.flatnonzero(self._mask(filter)) if filter else None
+        if rows is not None and not len(rows):
+            return rows, np.zeros(0, dtype=np.float32)
+        scores = self._scores(query, rows)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return (top if rows is None else rows[top]), scores[top]
+
+    def similarity_search_by_vector_with_relevance_scores(
+        self, embedding: Sequence[float], k: int = 4, filter: Optional[dict] = None
+    ) -> List[Tuple[Document, float]]:
+        """Return ``(document, distance)`` pairs; distance is ``1 - cosine``."""
+        with self._lock:
+            positions, scores = self._top(embedding, k, filter)
+            return [
+                (self._document(p), float(1.0 - s)) for p, s in zip(positions, scores)
+            ]
+
+    def similarity_search_by_vector(
+        self, embedding: Sequence[float], k: int = 4, filter: Optional[dict] = None
+    ) -> List[Document]:
+        return [
+            doc
+            for doc, _ in self.similarity_search_by_vector_with_relevance_scores(
+                embedding, k=k, filter=filter
+            )
+        ]
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: Sequence[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: Optional[dict] = None,
+    ) -> List[Document]:
+        with self._lock:
+            positions, scores = self._top(embedding, max(fetch_k, k), filter)
+            if not len(positions):
+                return []
+            candidates = self._upcast(positions)
+            pairwise = candidates @ candidates.T
+            selected = [0]
+            while len(selected) < min(k, len(positions)):
+                redundancy = pairwise[:, selected].max(axis=1)
+                mmr = lambda_mult * scores - (1 - lambda_mult) * redundancy
+                mmr[selected] = -np.inf
+                selected.append(int(np.argmax(mmr)))
+            return [self._document(positions[i]) for i in selected]
+
+    def query(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        n_results: int = 10,
+        where: Optional[dict] = None,
+        include: Sequence[str] = ("documents", "metadatas", "distances"),
+    ) -> Dict[str, Any]:
+        """Chroma-style batched search: one ranked list per query embedding.
+
+        All queries are scored with a single matrix product; distances are
+        ``1 - cosine`` as in :meth:`similarity_search_by_vector_with_relevance_scores`.
+        """
+        with self._lock:
+            result: Dict[str, Any] = {
+                key: [] for key in ("ids", "documents", "metadatas", "distances")
+            }
+            if "embeddings" in include:
+                result["embeddings"] = []
+            queries = np.asarray(query_embeddings, dtype=np.float32).reshape(
+                len(query_embeddings), -1
+            )
+            rows = np.flatnonzero(self._mask(where)) if where else None
+            if not self._ids or (rows is not None and not len(rows)):
+                positions = [np.zeros(0, dtype=np.int64)] * len(queries)
+                scores = [np.zeros(0, dtype=np.float32)] * len(queries)
+            else:
+                norms = np.linalg.norm(queries, axis=1, keepdims=True)
+                queries = queries / np.where(norms == 0, 1.0, norms)
+                # (候选行数, 查询数) 的分数矩阵，一次乘法覆盖全部查询
+                matrix = self._scores(queries.T, rows)
+                k = min(n_results, matrix.shape[0])
+                positions, scores = [], []
+                for column in matrix.T:
+                    top = np.argpartition(-column, k - 1)[:k]
+                    top = top[np.argsort(-column[top], kind="stable")]
+                    positions.append(top if rows is None else rows[top])
+                    scores.append(column[top])
+            for top, score in zip(positions, scores):
+                result["ids"].append([self._ids[p] for p in top])
+                result["documents"].append([self._documents[p] for p in top])
+                result["metadatas"].append([dict(self._metadatas[p]) for p in top])
+                result["distances"].append([float(1.0 - s) for s in score])
+                if "embeddings" in include:
+                    result["embeddings"].append(self._upcast(top))
+            return result
+
+    def get(
+        self,
+        ids: Optional[Sequence[str]] = None,
+        where: Optional[dict] = None,
+        include: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        with self._lock:
+            mask = self._mask(where) if where else np.ones(len(self._ids), dtype=bool)
+            if ids is not None:
+                mask &= self._mask({"id": {"$in": list(ids)}})
+            rows = np.flatnonzero(mask)
+            start = offset or 0
+            rows = rows[start : start + limit if limit is not None else None]
+            result = {
+                "ids": [self._ids[i] for i in rows],
+                "documents": [self._documents[i] for i in rows],
+                "metadatas": [dict(self._metadatas[i]) for i in rows],
+            }
+            if include and "embeddings" in include:
+                result["embeddings"] = self._upcast(rows)
+            return result
+
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from hashlib import sha256
+from typing import Dict, Optional, Sequence, Union
+
+import numpy as np
+
+from tools.disk_cache import DiskLRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class OCRCache:
+    """Persistent OCR results keyed by image content and language set.
+
+    Keys are the SHA-256 of the image (encoded upload bytes, or the shape and
+    samples of a rendered page array) plus the sorted language codes, so the
+    same page or handout is recognised once no matter which file, user or
+    process it comes from. Entries live in a :class:`DiskLRUCache`, which caps
+    the total size and evicts the least recently used results.
+    """
+
+    def __init__(self, cache: DiskLRUCache) -> None:
+        self.cache = cache
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def key(image: Union[bytes, np.ndarray], languages: Sequence[str]) -> str:
+        digest = sha256()
+        if isinstance(image, np.ndarray):
+            digest.update(f"{image.shape}:{image.dtype}".encode("ascii"))
+            digest.update(np.ascontiguousarray(image).data)
+        else:
+            digest.update(image)
+        return f"{'+'.join(sorted(languages))}:{digest.hexdigest()}"
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            blob = self.cache.get(key)
+        except Exception as exc:  # pragma: no cover - disk errors
+            logger.warning("OCR cache read failed: %s", exc)
+            blob = None
+        with self._stats_lock:
+            if blob is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return None if blob is None else blob.decode("utf-8")
+
+    def set(self, key: str, text: str) -> None:
+        try:
+            self.cache.set(key, text.encode("utf-8"))
+        except Exception as exc:  # pragma: no cover - disk errors
+            logger.warning("OCR cache write failed: %s", exc)
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            hits, misses = self._hits, self._misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "entries": len(self.cache),
+            "size_bytes": self.cache.size_bytes(),
+        }
+
+
+# 缓存默认放在项目根目录的 data/cache 下：与工作目录无关，且不在 Chroma
+# 持久化目录内（存储损坏重建时会整个删除该目录）
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cache_directory() -> str:
+    """Directory for derived caches (``RAG_CACHE_DIR``, else ``<project>/data/cache``)."""
+    return os.getenv("RAG_CACHE_DIR") or os.path.join(_PROJECT_ROOT, "data", "cache")
+
+
+_ocr_cache: Optional[OCRCache] = None
+_ocr_cache_key: Optional[tuple] = None
+_ocr_cache_lock = threading.Lock()
+
+
+def get_ocr_cache() -> Optional[OCRCache]:
+    """Return the process-wide OCR cache, or ``None`` when ``RAG_OCR_CACHE`` is off.
+
+    Configured by ``RAG_OCR_CACHE_PATH`` (default ``ocr_cache.sqlite`` in
+    :func:`cache_directory`) and ``RAG_OCR_CACHE_MAX_MB`` (default 64). A
+    forked OCR worker opens its own SQLite connection.
+    """
+    global _ocr_cache, _ocr_cache_key
+    if os.getenv("RAG_OCR_CACHE", "true").lower() not in {"1", "true", "yes"}:
+        return None
+    path = os.getenv("RAG_OCR_CACHE_PATH") or os.path.join(
+        cache_directory(), "ocr_cache.sqlite"
+    )
+    max_mb = int(os.getenv("RAG_OCR_CACHE_MAX_MB", 64))
+    key = (os.getpid(), path, max_mb)
+    with _ocr_cache_lock:
+        if _ocr_cache is None or _ocr_cache_key != key:
+            _ocr_cache = OCRCache(DiskLRUCache(path, max_bytes=max_mb * 1024 * 1024))
+            _ocr_cache_key = key
+        return _ocr_cache
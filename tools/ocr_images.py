@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import io
+from typing import Union
+
+import numpy as np
+
+
+def pixmap_array(pix) -> np.ndarray:
+    """View a PyMuPDF ``Pixmap`` as an ``(height, width, n)`` uint8 array.
+
+    The array is built over the pixmap's sample buffer without copying or
+    encoding, so ``pix`` must stay alive while the array is in use.
+    """
+    samples = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+    row = pix.width * pix.n
+    if pix.stride == row:
+        return samples.reshape(pix.height, pix.width, pix.n)
+    # 行尾有填充时按 stride 取视图，再去掉填充
+    return samples.reshape(pix.height, pix.stride)[:, :row].reshape(
+        pix.height, pix.width, pix.n
+    )
+
+
+def _on_white(image: np.ndarray) -> np.ndarray:
+    """Composite an ``(h, w, 4)`` RGBA array onto white; return RGB uint8."""
+    alpha = image[..., 3:4].astype(np.float32) / 255.0
+    rgb = image[..., :3].astype(np.float32) * alpha + 255.0 * (1.0 - alpha)
+    return np.rint(rgb).astype(np.uint8)
+
+
+def _decode_with_pil(image_data: bytes) -> np.ndarray:
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            # 调色板、灰度与透明度统一展开为 RGBA（GIF 取第一帧）
+            rgba = np.asarray(image.convert("RGBA"))
+    except (UnidentifiedImageError, OSError) as exc:
+        raise ValueError("Unsupported or corrupted image data") from exc
+    return _on_white(rgba)
+
+
+def decode_image(image_data: Union[bytes, str]) -> np.ndarray:
+    """Decode encoded image bytes (or a file path) straight into an RGB array.
+
+    OpenCV decodes the common formats; transparent pixels are composited onto
+    white so dark text on a transparent background stays readable. Formats
+    OpenCV cannot read (e.g. GIF) fall back to PIL.
+    """
+    import cv2
+
+    if isinstance(image_data, str):
+        with open(image_data, "rb") as f:
+            image_data = f.read()
+    image = cv2.imdecode(
+        np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_UNCHANGED
+    )
+    if image is None:
+        return _decode_with_pil(image_data)
+    if image.dtype == np.uint16:
+        image = (image >> 8).astype(np.uint8)
+    elif image.dtype != np.uint8:
+        return _decode_with_pil(image_data)
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    if image.shape[2] == 4:
+        return _on_white(cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA))
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import gc
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def create_reader(languages: Sequence[str], gpu: bool = False):
+    """Build an ``easyocr.Reader`` (the registry's default factory)."""
+    import easyocr
+
+    return easyocr.Reader(list(languages), gpu=gpu)
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        import psutil
+    except ImportError:  # pragma: no cover - optional dependency
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def _model_bytes(reader: Any) -> Optional[int]:
+    """Size of the torch weights held by an easyocr reader, if any."""
+    total = 0
+    for name in ("detector", "recognizer"):
+        model = getattr(reader, name, None)
+        if model is None or not hasattr(model, "parameters"):
+            continue
+        tensors = list(model.parameters()) + list(model.buffers())
+        total += sum(t.numel() * t.element_size() for t in tensors)
+    return total or None
+
+
+class _Entry:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.reader: Any = None
+        self.load_seconds: Optional[float] = None
+        self.resident_bytes: Optional[int] = None
+        self.last_used = 0.0
+        self.loads = 0
+        self.uses = 0
+        # 正在执行的识别任务数，大于 0 时不会因空闲被卸载
+        self.active = 0
+
+
+class OCRModelRegistry:
+    """Process-wide OCR readers keyed by language set and device.
+
+    :meth:`get` loads a reader with ``factory`` on first use (concurrent
+    callers wait for the same load) and returns the shared instance
+    afterwards; :meth:`use` borrows it for the duration of one OCR job.
+    :meth:`warm_up` loads readers on a background thread, e.g. at server
+    startup. Readers unused for ``idle_seconds`` (default
+    ``RAG_OCR_IDLE_UNLOAD_SECONDS``, 600; ``0`` keeps them forever) are
+    dropped by a daemon reaper thread and reloaded on the next request; a
+    reader borrowed with :meth:`use` is never dropped while the job runs and
+    its idle time counts from when the job finished.
+    :meth:`stats` reports each reader's load time and resident size (torch
+    weight bytes, or the process RSS growth during loading when the weights
+    cannot be inspected).
+    """
+
+    def __init__(
+        self,
+        factory: Callable = create_reader,
+        idle_seconds: Optional[float] = None,
+    ) -> None:
+        self.factory = factory
+        self.idle_seconds = (
+            idle_seconds
+            if idle_seconds is not None
+            else float(os.getenv("RAG_OCR_IDLE_UNLOAD_SECONDS", 600))
+        )
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[Tuple[str, ...], bool], _Entry] = {}
+        self._reaper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _key(languages: Sequence[str], gpu: bool) -> Tuple[Tuple[str, ...], bool]:
+        return tuple(sorted(languages)), bool(gpu)
+
+    def _entry(self, languages: Sequence[str], gpu: bool) -> _Entry:
+        key = self._key(languages, gpu)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            return entry
+
+    def get(self, languages: Sequence[str], gpu: bool = False):
+        """Return the shared reader for ``languages``, loading it if needed."""
+        return self._checkout(self._entry(languages, gpu), languages, gpu, False)
+
+    @contextmanager
+    def use(self, languages: Sequence[str], gpu: bool = False) -> Iterator[Any]:
+        """Borrow the shared reader for one OCR job (see the class docstring)."""
+        entry = self._entry(languages, gpu)
+        reader = self._checkout(entry, languages, gpu, True)
+        try:
+            yield reader
+        finally:
+            with entry.lock:
+                entry.active -= 1
+                entry.last_used = time.monotonic()
+
+    def _checkout(
+        self, entry: _Entry, languages: Sequence[str], gpu: bool, borrow: bool
+    ):
+        with entry.lock:
+            if entry.reader is None:
+                rss_before = _rss_bytes()
+                start = time.perf_counter()
+                entry.reader = self.factory(list(languages), gpu)
+                entry.load_seconds = time.perf_counter() - start
+                entry.resident_bytes = _model_bytes(entry.reader)
+                if entry.resident_bytes is None and rss_before is not None:
+                    entry.resident_bytes = max(_rss_bytes() - rss_before, 0)
+                entry.loads += 1
+                logger.info(
+                    "Loaded OCR reader %s in %.1fs",
+                    "+".join(languages),
+                    entry.load_seconds,
+                )
+                self._start_reaper()
+            entry.last_used = time.monotonic()
+            entry.uses += 1
+            if borrow:
+                entry.active += 1
+            return entry.reader
+
+    def warm_up(
+        self, languages: Sequence[str], gpu: bool = False, background: bool = True
+    ) -> Optional[threading.Thread]:
+        """Load the reader for ``languages`` now, on a daemon thread by default."""
+
+        def _load() -> None:
+            try:
+                self.get(languages, gpu)
+            except Exception as exc:  # pragma: no cover - model download errors
+                logger.warning("OCR warm-up failed: %s", exc)
+
+        if not background:
+            _load()
+            return None
+        thread = threading.Thread(target=_load, name="ocr-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def unload_idle(self, now: Optional[float] = None) -> List[Tuple[str, ...]]:
+        """Drop readers idle for longer than ``idle_seconds``; return their keys."""
+        if self.idle_seconds <= 0:
+            return []
+        now = time.monotonic() if now is None else now
+        unloaded = []
+        with self._lock:
+            entries = list(self._entries.items())
+        for (languages, gpu), entry in entries:
+            # 正在加载的 reader 持有锁，跳过
+            if not entry.lock.acquire(blocking=False):
+                continue
+            try:
+                idle = now - entry.last_used
+                if (
+                    entry.reader is not None
+                    and not entry.active
+                    and idle >= self.idle_seconds
+                ):
+                    entry.reader = None
+                    unloaded.append(languages)
+            finally:
+                entry.lock.release()
+        if unloaded:
+            gc.collect()
+            logger.info("Unloaded idle OCR reader(s): %s", unloaded)
+        return unloaded
+
+    def unload(self) -> None:
+        """Drop every loaded reader."""
+        with self._lock:
+            entries = list(self._entries.values())
+        for entry in entries:
+            with entry.lock:
+                entry.reader = None
+        gc.collect()
+
+    def _start_reaper(self) -> None:
+        if self.idle_seconds <= 0 or self._reaper is not None:
+            return
+        interval = min(max(self.idle_seconds / 2, 1.0), 60.0)
+
+        def _run() -> None:
+            while not self._stop.wait(interval):
+                self.unload_idle()
+
+        self._reaper = threading.Thread(target=_run, name="ocr-reaper", daemon=True)
+        self._reaper.start()
+
+    def close(self) -> None:
+        """Stop the reaper thread and drop all readers."""
+        self._stop.set()
+        self.unload()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per language set: loaded flag, load time, resident size and usage.
+
+        ``active`` is the number of OCR jobs currently borrowing the reader.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._entries.items())
+        return [
+            {
+                "languages": list(languages),
+                "gpu": gpu,
+                "loaded": entry.reader is not None,
+                "load_seconds": entry.load_seconds,
+                "resident_bytes": entry.resident_bytes if entry.reader else 0,
+                "idle_seconds": now - entry.last_used if entry.last_used else None,
+                "loads": entry.loads,
+                "uses": entry.uses,
+                "active": entry.active,
+            }
+            for (languages, gpu), entry in entries
+        ]
+
+
+_registry: Optional[OCRModelRegistry] = None
+_registry_pid: Optional[int] = None
+_registry_lock = threading.Lock()
+
+
+def get_ocr_registry() -> OCRModelRegistry:
+    """Return the process-wide :class:`OCRModelRegistry`.
+
+    A forked OCR worker gets its own registry (the parent's reaper thread
+    does not survive the fork).
+    """
+    global _registry, _registry_pid
+    with _registry_lock:
+        if _registry is None or _registry_pid != os.getpid():
+            _registry = OCRModelRegistry()
+            _registry_pid = os.getpid()
+        return _registry
+
+
+def shared_reader(languages: Sequence[str], gpu: bool = False):
+    """Reader factory backed by :func:`get_ocr_registry` (picklable for pools)."""
+    return get_ocr_registry().get(languages, gpu)
+
+
+@contextmanager
+def borrow_reader(
+    factory: Callable, languages: Sequence[str], gpu: bool = False
+) -> Iterator[Any]:
+    """Yield ``factory``'s reader for one OCR job.
+
+    Readers of the shared registry (the default :func:`shared_reader`) are
+    borrowed with :meth:`OCRModelRegistry.use`, so they are not unloaded
+    mid-job; other factories are simply called.
+    """
+    if factory is shared_reader:
+        with get_ocr_registry().use(languages, gpu) as reader:
+            yield reader
+    else:
+        yield factory(languages, gpu)
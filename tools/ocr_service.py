@@ -1,30 +1,70 @@
-import easyocr
 import numpy as np
-from PIL import Image
-import io
 from typing import Union
 
+from tools.ocr_cache import OCRCache, get_ocr_cache
+from tools.ocr_images import decode_image
+from tools.ocr_registry import get_ocr_registry
+
 
 class OCRService:
-    def __init__(self, languages=["ch_sim", "en"]):
-        self.reader = easyocr.Reader(languages, gpu=False)
+    def __init__(self, languages=["ch_sim", "en"], reader=None):
+        self.languages = list(languages)
+        self._reader = reader
+
+    @property
+    def reader(self):
+        # 模型由进程内注册表按语言集合加载并与 PDFOCRLoader 共享，空闲时自动释放
+        if self._reader is not None:
+            return self._reader
+        return get_ocr_registry().get(self.languages)
+
+    @reader.setter
+    def reader(self, reader):
+        self._reader = reader
+
+    def warm_up(self, background: bool = True):
+        """在后台预加载识别模型，避免首个请求等待模型加载"""
+        return get_ocr_registry().warm_up(self.languages, background=background)
+
+    def model_stats(self) -> list:
+        """返回本服务语言集合对应模型的加载耗时、常驻内存等信息"""
+        languages = sorted(self.languages)
+        return [
+            s for s in get_ocr_registry().stats() if sorted(s["languages"]) == languages
+        ]
 
     def extract_text_from_image(self, image_data: Union[bytes, str, np.ndarray]) -> str:
         try:
+            if isinstance(image_data, str):
+                with open(image_data, "rb") as f:
+                    image_data = f.read()
+
+            # 相同图片（按内容哈希）直接返回缓存的识别结果，与 PDF 入库共用
+            cache = get_ocr_cache()
+            key = OCRCache.key(image_data, self.languages) if cache is not None else None
+            if key is not None:
+                cached = cache.get(key)
+                if cached is not None:
+                    return cached
+
+            # 编码后的图片只解码一次，直接得到数组交给 easyocr
             if isinstance(image_data, bytes):
-                image = Image.open(io.BytesIO(image_data))
-                image_array = np.array(image)
-            elif isinstance(image_data, str):
-                image = Image.open(image_data)
-                image_array = np.array(image)
+                image_array = decode_image(image_data)
             else:
                 image_array = image_data
 
-            results = self.reader.readtext(image_array)
+            if self._reader is not None:
+                results = self._reader.readtext(image_array)
+            else:
+                # 识别期间登记为使用中，空闲回收线程不会中途卸载模型
+                with get_ocr_registry().use(self.languages) as reader:
+                    results = reader.readtext(image_array)
 
             text_lines = [result[1] for result in results]
             extracted_text = "\n".join(text_lines)
 
+            if key is not None:
+                cache.set(key, extracted_text)
             return extracted_text
         except Exception as e:
             raise Exception(f"OCR识别失败: {str(e)}")
@@ -1,61 +1,312 @@
 from __future__ import annotations
 
-import io
+import atexit
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
-import easyocr
 import fitz
+import numpy as np
 from PIL import Image
 from langchain_core.documents import Document
 
+from tools.ocr_cache import OCRCache, get_ocr_cache
+from tools.ocr_images import pixmap_array
+from tools.ocr_registry import borrow_reader, shared_reader
+
+logger = logging.getLogger(__name__)
+
+# 文字层少于该字符数的页面视为扫描页，需要 OCR
+MIN_TEXT_CHARS = 50
+# 渲染扫描页时的缩放倍数
+RENDER_ZOOM = 2
+
+
+def _read_array(reader, image: np.ndarray) -> str:
+    result = reader.readtext(image, detail=0)
+    return "\n".join(result)
+
+
+def _ocr_page_image(
+    page, languages: Sequence[str], gpu: bool, reader_factory: Callable
+) -> str:
+    """Render ``page`` and OCR the pixmap samples directly (no PNG round trip).
+
+    Results are looked up in the shared :class:`~tools.ocr_cache.OCRCache`
+    first; a reader is only borrowed from ``reader_factory`` (and the model
+    loaded) on a miss.
+    """
+    pix = page.get_pixmap(matrix=fitz.Matrix(RENDER_ZOOM, RENDER_ZOOM))
+    # pix 在识别结束前保持存活，数组只是其采样缓冲区的视图
+    image = pixmap_array(pix)
+    cache = get_ocr_cache()
+    key = OCRCache.key(image, languages) if cache is not None else None
+    if key is not None:
+        text = cache.get(key)
+        if text is not None:
+            return text
+    with borrow_reader(reader_factory, languages, gpu) as reader:
+        text = _read_array(reader, image)
+    if key is not None:
+        cache.set(key, text)
+    return text
+
+
+# OCR 子进程内的常驻状态：reader 由 reader_factory 管理（默认进程内共享注册表）
+_worker_config: Optional[tuple] = None
+_worker_doc: Optional[tuple] = None
+
+
+def _init_worker(
+    languages: Tuple[str, ...], gpu: bool, reader_factory: Callable
+) -> None:
+    global _worker_config
+    _worker_config = (languages, gpu, reader_factory)
+
+
+def _ocr_page(file_path: str, page_index: int) -> Tuple[str, float]:
+    """Render and OCR one page inside a pool worker; returns ``(text, seconds)``."""
+    global _worker_doc
+    start = time.perf_counter()
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_mtime_ns, stat.st_size)
+    if _worker_doc is None or _worker_doc[0] != key:
+        if _worker_doc is not None:
+            _worker_doc[1].close()
+        _worker_doc = (key, fitz.open(file_path))
+    text = _ocr_page_image(_worker_doc[1][page_index], *_worker_config)
+    return text, time.perf_counter() - start
+
+
+_pools: Dict[tuple, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def _ocr_pool(
+    workers: int, languages: Tuple[str, ...], gpu: bool, reader_factory: Callable
+) -> ProcessPoolExecutor:
+    """Return the shared pool for this configuration, starting it on first use.
+
+    Pools outlive individual loaders so each worker's reader is loaded once
+    per process rather than once per PDF.
+    """
+    key = (workers, languages, gpu, reader_factory)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(languages, gpu, reader_factory),
+            )
+            _pools[key] = pool
+        return pool
+
+
+def shutdown_ocr_pools() -> None:
+    """Stop every OCR worker pool (and release the readers they hold)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+atexit.register(shutdown_ocr_pools)
+
 
 class PDFOCRLoader:
+    """Load a PDF page by page, falling back to OCR for scanned pages.
+
+    Pages whose text layer has fewer than ``MIN_TEXT_CHARS`` characters are
+    rendered and read with easyocr. With ``workers > 1`` (default
+    ``RAG_OCR_WORKERS``, else 1) those pages are spread over a process pool
+    shared by all loaders with the same settings. Readers come from
+    ``reader_factory``; the default :func:`~tools.ocr_registry.shared_reader`
+    keeps one reader per language set per process (shared with
+    :class:`~tools.ocr_service.OCRService`), so each worker loads the model
+    once and releases it when idle; the loader itself keeps no reference to
+    the reader. Pages are returned in
+    order and the seconds spent on each (text layer plus OCR) are kept in
+    ``page_timings``, keyed by 1-based page number. OCR results are cached by
+    page content (see :func:`tools.ocr_cache.get_ocr_cache`), so re-ingesting
+    a scanned book skips recognition entirely.
+    """
 
-    def __init__(self, file_path: str, languages: List[str] = None, gpu: bool = False):
+    def __init__(
+        self,
+        file_path: str,
+        languages: List[str] = None,
+        gpu: bool = False,
+        workers: Optional[int] = None,
+        reader_factory: Callable = shared_reader,
+    ):
         self.file_path = file_path
         self.languages = languages or ["ch_sim", "en"]
         self.gpu = gpu
-        self._reader = None
+        self.workers = workers or int(os.getenv("RAG_OCR_WORKERS", 1))
+        self.reader_factory = reader_factory
+        self.page_timings: Dict[int, float] = {}
 
     @property
     def reader(self):
-        if self._reader is None:
-            self._reader = easyocr.Reader(self.languages, gpu=self.gpu)
-        return self._reader
+        # 每次从 reader_factory 取，不在加载器上持有引用，注册表才能释放空闲模型
+        return self.reader_factory(self.languages, self.gpu)
 
-    def _extract_text_from_image(self, image: Image.Image) -> str:
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format="PNG")
-        img_byte_arr = img_byte_arr.getvalue()
+    def _extract_text_from_image(self, image: Union[Image.Image, np.ndarray]) -> str:
+        if isinstance(image, Image.Image):
+            image = np.asarray(image)
+        with borrow_reader(self.reader_factory, self.languages, self.gpu) as reader:
+            return _read_array(reader, image)
 
-        result = self.reader.readtext(img_byte_arr, detail=0)
-        return "\n".join(result)
+    @staticmethod
+    def _extract_text_layer(page) -> Tuple[str, List[Tuple[int, str]]]:
+        """Return the page text (blocks separated by blank lines) and headings.
 
-    def load(self) -> List[Document]:
-        documents = []
+        Headings are text blocks of at most two short lines whose font is
+        larger than the page's body text (level 1/2) or that start in bold
+        (level 3); they are returned as ``(level, text)`` pairs.
+        """
+        blocks = []
+        sizes: List[float] = []
+        for block in page.get_text("dict").get("blocks", []):
+            if block.get("type") != 0:
+                continue
+            lines = [
+                "".join(span["text"] for span in line["spans"]).strip()
+                for line in block["lines"]
+            ]
+            lines = [line for line in lines if line]
+            spans = [span for line in block["lines"] for span in line["spans"] if span["text"].strip()]
+            if not lines or not spans:
+                continue
+            size = max(span["size"] for span in spans)
+            bold = bool(spans[0]["flags"] & 16)
+            blocks.append(("\n".join(lines), size, bold, len(lines)))
+            sizes.extend(span["size"] for span in spans for _ in span["text"])
+
+        body = statistics.median(sizes) if sizes else 0.0
+        headings: List[Tuple[int, str]] = []
+        for text, size, bold, n_lines in blocks:
+            if n_lines > 2 or len(text) > 60:
+                continue
+            if body and size >= body * 1.4:
+                headings.append((1, text))
+            elif body and size >= body * 1.15:
+                headings.append((2, text))
+            elif bold:
+                headings.append((3, text))
+        return "\n\n".join(b[0] for b in blocks), headings
 
-        doc = fitz.open(self.file_path)
+    def _document(
+        self, page_num: int, text: str, headings: List[Tuple[int, str]]
+    ) -> Optional[Document]:
+        if not text.strip():
+            return None
+        metadata = {
+            "source": str(self.file_path),
+            "page": page_num + 1,
+        }
+        if headings:
+            # 标题以 "级别\t文本" 逐行记录，供分块阶段识别章节
+            metadata["headings"] = "\n".join(
+                f"{level}\t{title}" for level, title in headings
+            )
+        return Document(page_content=text, metadata=metadata)
 
-        for page_num in range(len(doc)):
-            page = doc[page_num]
+    def lazy_load(self) -> Iterator[Document]:
+        """Yield each page's Document, in page order, as soon as it is ready.
 
-            text = page.get_text()
+        Text-layer pages are yielded immediately; with ``workers > 1``
+        scanned pages are submitted to the OCR pool as they are reached, and
+        at most ``2 * workers`` pages wait for earlier OCR results, so memory
+        stays flat for long books and callers can embed early pages while
+        later ones are still being recognised.
+        """
+        start = time.perf_counter()
+        self.page_timings = {}
+        pool = None
+        if self.workers > 1:
+            pool = _ocr_pool(
+                self.workers, tuple(self.languages), self.gpu, self.reader_factory
+            )
+        path = str(Path(self.file_path).resolve())
+        # 按页序排队等待输出的页面：(页码, 文本, 标题, OCR future)
+        queue: Deque[tuple] = deque()
+        scanned = 0
 
-            if len(text.strip()) < 50:
+        def _finish(page_num, text, headings, future) -> Optional[Document]:
+            if future is not None:
+                text, seconds = future.result()
+                self.page_timings[page_num + 1] += seconds
+                logger.debug(
+                    "OCR page %d of %s in %.2fs", page_num + 1, self.file_path, seconds
+                )
+            return self._document(page_num, text, headings)
 
-                pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-                img_data = pix.tobytes("png")
-                image = Image.open(io.BytesIO(img_data))
+        try:
+            with fitz.open(self.file_path) as doc:
+                for page_num in range(len(doc)):
+                    page_start = time.perf_counter()
+                    text, headings = self._extract_text_layer(doc[page_num])
+                    future = None
+                    if len(text.strip()) < MIN_TEXT_CHARS:
+                        scanned += 1
+                        headings = []
+                        if pool is not None:
+                            future = pool.submit(_ocr_page, path, page_num)
+                        else:
+                            text = _ocr_page_image(
+                                doc[page_num],
+                                self.languages,
+                                self.gpu,
+                                self.reader_factory,
+                            )
+                    self.page_timings[page_num + 1] = time.perf_counter() - page_start
+                    queue.append((page_num, text, headings, future))
 
-                text = self._extract_text_from_image(image)
+                    while queue and (
+                        queue[0][3] is None
+                        or queue[0][3].done()
+                        or len(queue) > 2 * self.workers
+                    ):
+                        document = _finish(*queue.popleft())
+                        if document is not None:
+                            yield document
+                while queue:
+                    document = _finish(*queue.popleft())
+                    if document is not None:
+                        yield document
+        finally:
+            for _, _, _, future in queue:
+                if future is not None:
+                    future.cancel()
 
-            if text.strip():
-                metadata = {
-                    "source": str(self.file_path),
-                    "page": page_num + 1,
-                }
-                documents.append(Document(page_content=text, metadata=metadata))
+        if scanned:
+            logger.info(
+                "OCR'd %d of %d page(s) of %s in %.1fs with %d worker(s)",
+                scanned,
+                len(self.page_timings),
+                self.file_path,
+                time.perf_counter() - start,
+                self.workers,
+            )
 
-        doc.close()
-        return documents
+    def load(self) -> List[Document]:
+        return list(self.lazy_load())
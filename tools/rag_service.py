@@ -1,23 +1,57 @@
 from __future__ import annotations
 
-from typing import Iterable, Optional, Tuple, Union
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
+import asyncio
 import logging
 import os
+import random
+import re
 import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
 from hashlib import sha256
 
+import numpy as np
 from langchain_chroma import Chroma
+from langchain_chroma.vectorstores import maximal_marginal_relevance
 from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
 from langchain_core.prompts import PromptTemplate
-from langchain_classic.retrievers import MultiQueryRetriever
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_classic.retrievers.multi_query import LineListOutputParser
+from langchain_openai import ChatOpenAI
 from langchain_community.document_loaders import (
     UnstructuredFileLoader,
     Docx2txtLoader,
 )
+from tools.disk_cache import DiskLRUCache
+from tools.embedding_backends import (
+    create_embeddings,
+    embed_queries,
+    embeddings_namespace,
+)
+from tools.chunking import StructuredChunker
+from tools.context_compressor import ContextCompressor
+from tools.embedding_cache import CachedEmbeddings
+from tools.hybrid_retriever import HybridRetriever, reciprocal_rank_fusion
+from tools.lexical_index import BM25Index
+from tools.memory_cache import TTLCache
+from tools.numpy_index import NumpyVectorIndex
+from tools.near_duplicates import NearDuplicateIndex
+from tools.multi_query import CachedMultiQueryRetriever, normalize_query
 from tools.pdf_ocr_loader import PDFOCRLoader
+from tools.scoped_retriever import ScopedRetriever
+from tools.ingest_manifest import IngestManifest
+from tools.snapshot import (
+    Snapshot,
+    SnapshotError,
+    latest_snapshot,
+    read_snapshot,
+    snapshot_path,
+    write_snapshot,
+)
 
 logging.getLogger("pypdf").setLevel(logging.ERROR)
 logging.getLogger("pdfminer").setLevel(logging.ERROR)
@@ -34,6 +68,26 @@ api_key = os.environ.get("api_key")
 embedding_model = os.environ.get("embedding_model")
 logger = logging.getLogger(__name__)
 
+# 共享课程语料所在的命名空间；学生上传的资料进入各自的 user:<用户名> 命名空间
+COURSE_NAMESPACE = "course"
+
+
+def user_namespace(username: str) -> str:
+    """Return the namespace holding ``username``'s own uploads."""
+    return f"user:{username}"
+
+
+def _namespace_slug(namespace: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "_", namespace).strip("_")
+    if (
+        slug != namespace.replace(":", "_")
+        or not 3 <= len(slug) <= 48
+        or not slug[-1].isalnum()
+    ):
+        # 含中文等字符的用户名用哈希，保证集合名合法且稳定
+        slug = "ns_" + sha256(namespace.encode("utf-8")).hexdigest()[:16]
+    return slug
+
 
 class RAGService:
     """Lazy wrapper around a Chroma vector store."""
@@ -48,17 +102,71 @@ class RAGService:
         mq_llm_model: Optional[str] = None,
         mq_num_queries: Optional[int] = None,
         mq_include_original: Optional[bool] = None,
+        embedding_cache: Optional[bool] = None,
+        embed_batch_size: Optional[int] = None,
+        embed_workers: Optional[int] = None,
+        embed_retries: Optional[int] = None,
+        embedding_backend: Optional[str] = None,
+        compress: Optional[bool] = None,
+        vector_backend: Optional[str] = None,
+        near_duplicates: Optional[bool] = None,
+        hnsw_m: Optional[int] = None,
+        hnsw_ef_construction: Optional[int] = None,
+        hnsw_ef_search: Optional[int] = None,
     ) -> None:
-        # 初始化 OpenAI 嵌入模型
-        self._embeddings = OpenAIEmbeddings(
-            openai_api_base=base_url + "/v1",
-            model=embedding_model,
-            openai_api_key=api_key,
-        )
+        # 初始化嵌入模型：优先使用传入的 embeddings，否则按 RAG_EMBEDDING_BACKEND 构建
+        if embeddings is None:
+            embeddings = create_embeddings(embedding_backend)
+        self._embeddings = embeddings
+        self._embedding_model = embeddings_namespace(embeddings)
         self._persist_directory = persist_directory
-        self._vectorstore: Optional[Chroma] = None
-        self._retriever = None
-        self._retriever_params: Optional[Tuple[int, bool]] = None
+        # 快照目录放在持久化目录之外，重建存储时不会被一并删除
+        self._snapshot_directory = os.getenv("RAG_SNAPSHOT_DIR") or os.path.join(
+            os.path.dirname(os.path.abspath(persist_directory)), "snapshots"
+        )
+
+        # 嵌入缓存：按模型名 + 文本哈希持久化到磁盘，避免重复的远程调用。
+        # 缓存放在持久化目录旁的 cache/ 下，存储损坏重建时不会被删除，重建正好用得上
+        env_cache = os.getenv("RAG_EMBED_CACHE")
+        use_cache = (
+            embedding_cache
+            if embedding_cache is not None
+            else (env_cache is None or env_cache.lower() in {"1", "true", "yes"})
+        )
+        if use_cache:
+            cache_dir = os.getenv("RAG_CACHE_DIR") or os.path.join(
+                os.path.dirname(os.path.abspath(persist_directory)), "cache"
+            )
+            cache_path = os.getenv("RAG_EMBED_CACHE_PATH") or os.path.join(
+                cache_dir, "embedding_cache.sqlite"
+            )
+            max_mb = int(os.getenv("RAG_EMBED_CACHE_MAX_MB", 256))
+            self._embeddings = CachedEmbeddings(
+                self._embeddings,
+                DiskLRUCache(cache_path, max_bytes=max_mb * 1024 * 1024),
+                namespace=self._embedding_model,
+            )
+        # 向量存储后端：chroma（默认）或 numpy（小语料的内存映射暴力检索）
+        self._vector_backend = vector_backend or os.getenv("RAG_VECTOR_BACKEND", "chroma")
+        if self._vector_backend not in {"chroma", "numpy"}:
+            raise ValueError(f"Unknown vector backend: {self._vector_backend}")
+        # 每个命名空间一个向量集合与 BM25 索引，按需创建
+        self._stores: Dict[str, Union[Chroma, NumpyVectorIndex]] = {}
+        self._lexical_indexes: Dict[str, BM25Index] = {}
+        self._near_dup_indexes: Dict[str, NearDuplicateIndex] = {}
+        self._stores_lock = threading.RLock()
+        # HNSW 参数：M 与 ef_construction 只在新建集合时生效，ef_search 可随时调整
+        hnsw = {
+            "max_neighbors": hnsw_m or os.getenv("RAG_HNSW_M"),
+            "ef_construction": hnsw_ef_construction
+            or os.getenv("RAG_HNSW_EF_CONSTRUCTION"),
+            "ef_search": hnsw_ef_search or os.getenv("RAG_HNSW_EF_SEARCH"),
+        }
+        self._hnsw_config: Dict[str, int] = {
+            key: int(value) for key, value in hnsw.items() if value
+        }
+        # 按 (k, 模式, 命名空间) 缓存的默认检索器
+        self._retrievers = TTLCache(max_size=256, ttl=None)
 
         # 默认检索参数
         self._default_k = retriever_k or int(os.getenv("RAG_K", 4))
@@ -82,43 +190,577 @@ class RAGService:
             if mq_include_original is not None
             else env_inc.lower() in {"1", "true", "yes"}
         )
+        # 多查询扩展：按归一化问题缓存生成的变体，短查询/关键词查询直接跳过
+        self._mq_cache = TTLCache(
+            max_size=int(os.getenv("RAG_MQ_CACHE_SIZE", 1024)),
+            ttl=float(os.getenv("RAG_MQ_CACHE_TTL", 24 * 3600)),
+        )
+        self._mq_min_query_units = int(os.getenv("RAG_MQ_MIN_QUERY_UNITS", 6))
+
+        # 批量嵌入参数：批大小、并发数与失败重试次数
+        self._embed_batch_size = embed_batch_size or int(
+            os.getenv("RAG_EMBED_BATCH_SIZE", 64)
+        )
+        self._embed_workers = embed_workers or int(os.getenv("RAG_EMBED_WORKERS", 4))
+        self._embed_retries = (
+            embed_retries
+            if embed_retries is not None
+            else int(os.getenv("RAG_EMBED_RETRIES", 3))
+        )
+        self._embed_backoff = float(os.getenv("RAG_EMBED_BACKOFF", 1.0))
+
+        # 检索模式：similarity / mmr / hybrid（BM25 + 向量，RRF 融合）
+        self._default_mode = os.getenv("RAG_SEARCH_MODE")
+        self._hybrid_fetch_k = int(os.getenv("RAG_HYBRID_FETCH_K", 20))
+        self._mmr_fetch_k = int(os.getenv("RAG_MMR_FETCH_K", 20))
+        self._scoped_retrievers = TTLCache(max_size=256, ttl=None)
+
+        # 检索后按问题抽取相关句子压缩上下文（RAG_COMPRESS 开启）
+        env_compress = os.getenv("RAG_COMPRESS", "false")
+        self._compress = (
+            compress
+            if compress is not None
+            else env_compress.lower() in {"1", "true", "yes"}
+        )
+        self._compressor = ContextCompressor.from_env(self._embeddings)
+
+        # 上传文件与批量导入共用的结构感知分块
+        self._chunker = StructuredChunker()
+        # 写入前用 MinHash LSH 丢弃近似重复的 chunk（页眉、版权页、重复目录等）
+        env_near_dup = os.getenv("RAG_NEAR_DUP", "true")
+        self._near_dup = (
+            near_duplicates
+            if near_duplicates is not None
+            else env_near_dup.lower() in {"1", "true", "yes"}
+        )
+
+        # 检索结果缓存：以索引代数作为键的一部分，写入或删除后自动失效
+        self._result_cache = TTLCache(
+            max_size=int(os.getenv("RAG_RESULT_CACHE_SIZE", 512)),
+            ttl=float(os.getenv("RAG_RESULT_CACHE_TTL", 600)),
+        )
+        self._generation = 0
+        # 最近一次看到的索引代数标记；变化说明其他进程写过，需要重新加载文件索引
+        self._seen_marker: Optional[int] = None
+
+        # 异步检索时 Chroma 查询所用的有界线程池
+        self._search_workers = int(os.getenv("RAG_SEARCH_WORKERS", 8))
+        self._search_pool: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def persist_directory(self) -> str:
+        return self._persist_directory
 
-    def _get_vectorstore(self) -> Chroma:
-        if self._vectorstore is None:
+    @property
+    def manifest_path(self) -> str:
+        """Path of the ingest manifest of the course collection."""
+        return os.path.join(self._persist_directory, "ingest_manifest.json")
+
+    @property
+    def embedding_model(self) -> str:
+        """Identifier of the embedding model; recorded in snapshots."""
+        return self._embedding_model
+
+    @property
+    def snapshot_directory(self) -> str:
+        return self._snapshot_directory
+
+    def _get_vectorstore(
+        self, namespace: str = COURSE_NAMESPACE
+    ) -> Union[Chroma, NumpyVectorIndex]:
+        self._sync_with_disk()
+        store = self._stores.get(namespace)
+        if store is None:
+            with self._stores_lock:
+                store = self._stores.get(namespace)
+                if store is None:
+                    store, wiped = self._open_store(namespace)
+                    self._stores[namespace] = store
+                    if "ef_search" in self._hnsw_config:
+                        self._apply_ef_search(store, self._hnsw_config["ef_search"])
+                    if wiped is not None:
+                        self._restore_wiped_namespaces(wiped)
+        return store
+
+    def _open_store(
+        self, namespace: str
+    ) -> Tuple[Union[Chroma, NumpyVectorIndex], Optional[List[str]]]:
+        """Open ``namespace``'s store.
+
+        If the Chroma persistence is corrupted it is wiped and rebuilt; all
+        collections share one database, so the second item then lists the
+        slugs of the user collections wiped with it (``None`` otherwise).
+        """
+        course = namespace == COURSE_NAMESPACE
+        if self._vector_backend == "numpy":
+            env_resident = os.getenv("RAG_NUMPY_INDEX_RESIDENT", "true")
+            dirname = "numpy_index" if course else f"numpy_index_{_namespace_slug(namespace)}"
+            index = NumpyVectorIndex(
+                os.path.join(self._persist_directory, dirname),
+                dtype=os.getenv("RAG_NUMPY_INDEX_DTYPE", "float16"),
+                resident=env_resident.lower() in {"1", "true", "yes"},
+            )
+            return index, None
+
+        # 课程语料沿用 Chroma 默认集合，兼容已有数据
+        kwargs = {} if course else {"collection_name": _namespace_slug(namespace)}
+        if self._hnsw_config:
+            kwargs["collection_configuration"] = {"hnsw": dict(self._hnsw_config)}
+        try:
+            return (
+                Chroma(
+                    embedding_function=self._embeddings,
+                    persist_directory=self._persist_directory,
+                    **kwargs,
+                ),
+                None,
+            )
+        except Exception:
+            if not course:
+                raise
+            wiped = self._user_collection_slugs()
+            logger.warning("Chroma persistence appears corrupted; rebuilding store")
+            shutil.rmtree(self._persist_directory, ignore_errors=True)
+            self._lexical_indexes.clear()
+            self._near_dup_indexes.clear()
             try:
-                self._vectorstore = Chroma(
+                store = Chroma(
                     embedding_function=self._embeddings,
                     persist_directory=self._persist_directory,
+                    **kwargs,
                 )
             except Exception:
-                logger.warning("Chroma persistence appears corrupted; rebuilding store")
-                shutil.rmtree(self._persist_directory, ignore_errors=True)
-                try:
-                    self._vectorstore = Chroma(
-                        embedding_function=self._embeddings,
-                        persist_directory=self._persist_directory,
-                    )
-                except Exception:
-                    logger.warning(
-                        "Persistent Chroma store unavailable, falling back to in-memory store",
+                logger.warning(
+                    "Persistent Chroma store unavailable, falling back to in-memory store",
+                )
+                store = Chroma(
+                    embedding_function=self._embeddings,
+                )
+            return store, wiped
+
+    def _user_collection_slugs(self) -> List[str]:
+        # 每个用户集合都有自己的词法索引文件，数据库打不开时据此列出集合
+        slugs = set()
+        try:
+            names = os.listdir(self._persist_directory)
+        except OSError:
+            return []
+        for name in names:
+            for prefix, suffix in (
+                ("lexical_index.", ".json"),
+                ("near_duplicates.", ".npz"),
+            ):
+                if name.startswith(prefix) and name.endswith(suffix):
+                    slug = name[len(prefix) : -len(suffix)]
+                    if slug:
+                        slugs.add(slug)
+        return sorted(slugs)
+
+    def _apply_ef_search(self, store, ef_search: int) -> None:
+        # 已存在的集合不会采用创建参数，ef_search 需要单独修改
+        collection = getattr(store, "_collection", None)
+        if collection is None:
+            return
+        current = (collection.configuration or {}).get("hnsw") or {}
+        if current.get("ef_search") != ef_search:
+            collection.modify(configuration={"hnsw": {"ef_search": ef_search}})
+
+    def search_params(self, namespace: str = COURSE_NAMESPACE) -> dict:
+        """Return the retrieval parameters in effect for ``namespace``.
+
+        Includes the default ``k``, the MMR and hybrid candidate pool sizes
+        and, for Chroma, the collection's HNSW configuration
+        (``max_neighbors`` is HNSW ``M``).
+        """
+        params = {
+            "k": self._default_k,
+            "mmr_fetch_k": self._mmr_fetch_k,
+            "hybrid_fetch_k": self._hybrid_fetch_k,
+            "search_mode": self._default_mode,
+            "vector_backend": self._vector_backend,
+        }
+        collection = getattr(self._get_vectorstore(namespace), "_collection", None)
+        if collection is not None:
+            hnsw = (collection.configuration or {}).get("hnsw") or {}
+            params["hnsw"] = {
+                key: hnsw.get(key)
+                for key in ("space", "max_neighbors", "ef_construction", "ef_search")
+            }
+        return params
+
+    def tune(
+        self,
+        k: Optional[int] = None,
+        mmr_fetch_k: Optional[int] = None,
+        hybrid_fetch_k: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> dict:
+        """Change search parameters at runtime and return :meth:`search_params`.
+
+        ``ef_search`` is applied to every open Chroma collection and to
+        collections opened later; cached retrievers and results are dropped.
+        HNSW ``M`` and ``ef_construction`` can only be chosen when a
+        collection is created (``RAG_HNSW_M``, ``RAG_HNSW_EF_CONSTRUCTION``).
+        """
+        with self._stores_lock:
+            if k:
+                self._default_k = k
+            if mmr_fetch_k:
+                self._mmr_fetch_k = mmr_fetch_k
+            if hybrid_fetch_k:
+                self._hybrid_fetch_k = hybrid_fetch_k
+            if ef_search:
+                self._hnsw_config["ef_search"] = ef_search
+                for store in self._stores.values():
+                    self._apply_ef_search(store, ef_search)
+            self._retrievers.clear()
+            self._scoped_retrievers.clear()
+            self._result_cache.clear()
+        return self.search_params()
+
+    @staticmethod
+    def _namespace_stem(namespace: str) -> str:
+        return namespace if namespace == COURSE_NAMESPACE else _namespace_slug(namespace)
+
+    def namespace_embeddings(
+        self, namespace: str = COURSE_NAMESPACE, limit: Optional[int] = None
+    ) -> np.ndarray:
+        """Return the stored vectors of ``namespace`` as a float32 matrix.
+
+        At most ``limit`` rows are read. Works for both vector backends; used
+        by :mod:`tools.index_benchmark` to benchmark on real embeddings.
+        """
+        store = self._get_vectorstore(namespace)
+        data = self._collection_of(store).get(include=["embeddings"], limit=limit)
+        if not len(data["ids"]):
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.asarray(data["embeddings"], dtype=np.float32)
+
+    def export_snapshot(
+        self, path: Optional[str] = None, namespace: str = COURSE_NAMESPACE
+    ) -> str:
+        """Write every chunk of ``namespace`` with its vector to a snapshot.
+
+        ``path`` defaults to a timestamped file in the snapshot directory
+        (``RAG_SNAPSHOT_DIR``, else ``snapshots/`` next to the persist
+        directory). The course snapshot also carries the ingest manifest so a
+        restored store is not re-embedded by the next folder ingest; every
+        snapshot records its namespace so user collections can be restored
+        after corruption too. Returns the path written.
+        """
+        store = self._get_vectorstore(namespace)
+        data = self._collection_of(store).get(
+            include=["embeddings", "documents", "metadatas"]
+        )
+        path = path or snapshot_path(
+            self._snapshot_directory, self._namespace_stem(namespace)
+        )
+        write_snapshot(
+            path,
+            ids=data["ids"],
+            vectors=data["embeddings"] if len(data["ids"]) else [],
+            texts=data["documents"],
+            metadatas=data["metadatas"],
+            model=self._embedding_model,
+            namespace=namespace,
+            manifest=(
+                IngestManifest(self.manifest_path).entries
+                if namespace == COURSE_NAMESPACE
+                else None
+            ),
+        )
+        logger.info("Exported %d chunk(s) of %s to %s", len(data["ids"]), namespace, path)
+        return path
+
+    def import_snapshot(
+        self,
+        path: str,
+        namespace: str = COURSE_NAMESPACE,
+        check_model: bool = True,
+    ) -> int:
+        """Load a snapshot into ``namespace`` without re-embedding anything.
+
+        The checksum is always verified; with ``check_model`` the snapshot
+        must come from the same embedding model as this service. Manifest
+        entries in the snapshot are added for sources the current manifest
+        does not know. Returns the number of chunks written.
+        """
+        snapshot = read_snapshot(
+            path, expected_model=self._embedding_model if check_model else None
+        )
+        return self._load_snapshot(snapshot, namespace, path)
+
+    def _load_snapshot(self, snapshot: Snapshot, namespace: str, path: str) -> int:
+        store = self._get_vectorstore(namespace)
+        vectors = snapshot.vectors.astype(np.float32)
+        for start in range(0, len(snapshot), self._embed_batch_size):
+            end = start + self._embed_batch_size
+            docs = [
+                Document(page_content=text, metadata={**meta, "doc_hash": doc_id})
+                for doc_id, text, meta in zip(
+                    snapshot.ids[start:end],
+                    snapshot.texts[start:end],
+                    snapshot.metadatas[start:end],
+                )
+            ]
+            self._write_batch(namespace, docs, vectors[start:end].tolist())
+        if hasattr(store, "persist"):
+            store.persist()
+        self.lexical_index(namespace).save()
+        near_dup = self.near_duplicate_index(namespace)
+        if near_dup is not None:
+            near_dup.save()
+        if snapshot.manifest and namespace == COURSE_NAMESPACE:
+            # 现有记录优先；只补上缺失的来源，避免下次导入重新嵌入已恢复的文件
+            manifest = IngestManifest(self.manifest_path)
+            manifest.entries = {**snapshot.manifest, **manifest.entries}
+            manifest.save()
+        self._bump_generation()
+        logger.info("Imported %d chunk(s) into %s from %s", len(snapshot), namespace, path)
+        return len(snapshot)
+
+    def latest_snapshot_path(self, namespace: str = COURSE_NAMESPACE) -> Optional[str]:
+        """Return the newest snapshot of ``namespace`` in the snapshot directory."""
+        return latest_snapshot(self._snapshot_directory, self._namespace_stem(namespace))
+
+    def _restore_latest_snapshot(self, namespace: str) -> None:
+        path = self.latest_snapshot_path(namespace)
+        if path is None:
+            logger.warning("No snapshot found to restore %s; store is empty", namespace)
+            return
+        try:
+            self.import_snapshot(path, namespace)
+        except (SnapshotError, ValueError) as exc:
+            logger.error("Could not restore %s from %s: %s", namespace, path, exc)
+
+    def _restore_wiped_namespaces(self, slugs: Sequence[str]) -> None:
+        """Restore the course and every wiped user collection from snapshots.
+
+        User snapshots record their namespace, so a collection is restored
+        when its latest snapshot maps back to the same slug; collections
+        without one are reported as lost.
+        """
+        self._restore_latest_snapshot(COURSE_NAMESPACE)
+        lost = []
+        for slug in slugs:
+            path = latest_snapshot(self._snapshot_directory, slug)
+            if path is None:
+                lost.append(slug)
+                continue
+            try:
+                snapshot = read_snapshot(path, expected_model=self._embedding_model)
+                namespace = snapshot.namespace
+                if not namespace or _namespace_slug(namespace) != slug:
+                    raise SnapshotError(f"snapshot does not record namespace {slug!r}")
+                self._load_snapshot(snapshot, namespace, path)
+            except (SnapshotError, ValueError) as exc:
+                logger.error("Could not restore %s from %s: %s", slug, path, exc)
+                lost.append(slug)
+        if lost:
+            logger.error(
+                "Chroma store was rebuilt and %d user collection(s) could not be "
+                "restored; their uploads are lost and must be re-uploaded: %s",
+                len(lost),
+                ", ".join(lost),
+            )
+
+    @staticmethod
+    def visible_namespaces(
+        username: Optional[str] = None, user_type: Optional[str] = None
+    ) -> List[str]:
+        """Return the namespaces a caller may search.
+
+        Everyone sees the shared course corpus; students additionally see
+        their own uploads.
+        """
+        if username and user_type == "student":
+            return [COURSE_NAMESPACE, user_namespace(username)]
+        return [COURSE_NAMESPACE]
+
+    def _generation_file(self) -> str:
+        return os.path.join(self._persist_directory, "index_generation")
+
+    def index_generation(self) -> Tuple[int, int]:
+        """Return a token that changes whenever the indexed content changes.
+
+        It combines the in-process counter with the mtime of a marker file in
+        the persist directory, so writes from other processes (for example a
+        ``python -m tools.ingest`` run) also invalidate cached results.
+        """
+        try:
+            mtime = os.stat(self._generation_file()).st_mtime_ns
+        except OSError:
+            mtime = 0
+        return self._generation, mtime
+
+    def _sync_with_disk(self) -> None:
+        """Reload file-backed indexes after another process changed them.
+
+        Chroma reads its SQLite files on every query, but the NumPy, BM25
+        and near-duplicate indexes are loaded once; when the generation marker moves, each open
+        index re-reads its files (keeping any unsaved local changes).
+        """
+        marker = self.index_generation()[1]
+        if marker == self._seen_marker:
+            return
+        with self._stores_lock:
+            if marker == self._seen_marker:
+                return
+            self._seen_marker = marker
+            for store in self._stores.values():
+                if isinstance(store, NumpyVectorIndex):
+                    store.refresh()
+            for index in self._lexical_indexes.values():
+                index.refresh()
+            for index in self._near_dup_indexes.values():
+                index.refresh()
+
+    def _bump_generation(self) -> None:
+        self._generation += 1
+        try:
+            os.makedirs(self._persist_directory, exist_ok=True)
+            with open(self._generation_file(), "w", encoding="utf-8") as f:
+                f.write(f"{time.time_ns()}\n")
+        except OSError as exc:  # pragma: no cover - read-only storage
+            logger.warning("Could not update index generation marker: %s", exc)
+
+    def retrieval_cache_stats(self) -> dict:
+        """Return hit/miss statistics of the retrieval result cache."""
+        return {**self._result_cache.stats(), "generation": self._generation}
+
+    def embedding_cache_stats(self) -> Optional[dict]:
+        """Return hit/miss statistics of the embedding cache, if enabled."""
+        if isinstance(self._embeddings, CachedEmbeddings):
+            return self._embeddings.stats()
+        return None
+
+    def lexical_index(self, namespace: str = COURSE_NAMESPACE) -> BM25Index:
+        """Return the BM25 index kept in sync with ``namespace``'s vector store.
+
+        The index is persisted next to Chroma; if it is missing while the
+        store already holds documents, it is rebuilt from the store once.
+        Saves from other processes are merged, not overwritten (see
+        :meth:`BM25Index.save`), and picked up via :meth:`_sync_with_disk`.
+        """
+        self._sync_with_disk()
+        index = self._lexical_indexes.get(namespace)
+        if index is not None:
+            return index
+        with self._stores_lock:
+            index = self._lexical_indexes.get(namespace)
+            if index is not None:
+                return index
+            filename = (
+                "lexical_index.json"
+                if namespace == COURSE_NAMESPACE
+                else f"lexical_index.{_namespace_slug(namespace)}.json"
+            )
+            index = BM25Index(os.path.join(self._persist_directory, filename))
+            if not len(index):
+                data = self._get_vectorstore(namespace).get(
+                    include=["documents", "metadatas"]
+                )
+                if data["ids"]:
+                    index.add(
+                        [
+                            (m or {}).get("doc_hash") or doc_id
+                            for doc_id, m in zip(data["ids"], data["metadatas"])
+                        ],
+                        data["documents"],
+                        data["metadatas"],
                     )
-                    self._vectorstore = Chroma(
-                        embedding_function=self._embeddings,
+                    index.save()
+                    logger.info("Rebuilt lexical index with %d document(s)", len(index))
+            self._lexical_indexes[namespace] = index
+        return index
+
+    def near_duplicate_index(
+        self, namespace: str = COURSE_NAMESPACE
+    ) -> Optional[NearDuplicateIndex]:
+        """Return ``namespace``'s MinHash index, or ``None`` if disabled.
+
+        Like the lexical index it lives next to the vector store and is
+        rebuilt from the stored chunks if it is missing, and merges with
+        other processes' saves.
+        """
+        if not self._near_dup:
+            return None
+        self._sync_with_disk()
+        index = self._near_dup_indexes.get(namespace)
+        if index is not None:
+            return index
+        with self._stores_lock:
+            index = self._near_dup_indexes.get(namespace)
+            if index is not None:
+                return index
+            filename = (
+                "near_duplicates.npz"
+                if namespace == COURSE_NAMESPACE
+                else f"near_duplicates.{_namespace_slug(namespace)}.npz"
+            )
+            scope = os.getenv("RAG_NEAR_DUP_SCOPE", "source")
+            index = NearDuplicateIndex(
+                os.path.join(self._persist_directory, filename),
+                threshold=float(os.getenv("RAG_NEAR_DUP_THRESHOLD", 0.85)),
+                min_chars=int(os.getenv("RAG_NEAR_DUP_MIN_CHARS", 80)),
+                per_source=scope != "namespace",
+            )
+            if not len(index):
+                data = self._get_vectorstore(namespace).get(
+                    include=["documents", "metadatas"]
+                )
+                for doc_id, text, meta in zip(
+                    data["ids"], data["documents"], data["metadatas"]
+                ):
+                    meta = meta or {}
+                    index.add(
+                        meta.get("doc_hash") or doc_id, text, str(meta.get("source") or "")
                     )
-        return self._vectorstore
+                if len(index):
+                    index.save()
+                    logger.info("Rebuilt near-duplicate index with %d chunk(s)", len(index))
+            self._near_dup_indexes[namespace] = index
+        return index
+
+    def get_retriever(
+        self,
+        k: Optional[int] = None,
+        mmr: Optional[bool] = None,
+        mode: Optional[str] = None,
+        namespaces: Optional[Sequence[str]] = None,
+    ):
+        """Return a cached retriever from the vector store.
 
-    def get_retriever(self, k: Optional[int] = None, mmr: Optional[bool] = None):
-        """Return a cached retriever from the vector store."""
+        ``mode`` is one of ``"similarity"``, ``"mmr"`` or ``"hybrid"``; when
+        omitted it follows ``RAG_SEARCH_MODE`` and then the ``mmr`` flag.
+        ``namespaces`` lists the collections to search (default: the course
+        corpus only; pass :meth:`visible_namespaces` so students also search
+        their own uploads). One retriever is kept per combination.
+        """
         k = k or self._default_k
-        mmr = self._default_mmr if mmr is None else mmr
-        params = (k, mmr)
+        if mode is None and mmr is None:
+            mode = self._default_mode
+        if mode is None:
+            mmr = self._default_mmr if mmr is None else mmr
+            mode = "mmr" if mmr else "similarity"
+        if mode not in {"similarity", "mmr", "hybrid"}:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        namespaces_key = self._namespaces_key(namespaces)
+        params = (k, mode, namespaces_key)
 
-        if self._retriever is None or self._retriever_params != params:
-            search_type = "mmr" if mmr else "similarity"
-            base = self._get_vectorstore().as_retriever(
-                search_type=search_type, search_kwargs={"k": k}
-            )
-            self._retriever_params = params
+        retriever = self._retrievers.get(params)
+        if retriever is None:
+            if mode == "hybrid":
+                base = HybridRetriever(
+                    service=self, k=k, namespaces=list(namespaces_key)
+                )
+            else:
+                base = ScopedRetriever(
+                    service=self,
+                    k=k,
+                    search_type=mode,
+                    namespaces=list(namespaces_key),
+                )
 
             if self._use_multiquery:
                 try:
@@ -136,53 +778,524 @@ class RAGService:
                         )
                     )
 
-                    self._retriever = MultiQueryRetriever.from_llm(
+                    retriever = CachedMultiQueryRetriever(
                         retriever=base,
-                        llm=llm,
-                        prompt=prompt,
+                        llm_chain=prompt | llm | LineListOutputParser(),
                         include_original=self._mq_include_original,
+                        query_cache=self._mq_cache,
+                        min_query_units=self._mq_min_query_units,
+                        max_workers=self._mq_num_queries + 1,
                     )
                     logger.info(
-                        "Initialized MultiQueryRetriever with model %s",
+                        "Initialized CachedMultiQueryRetriever with model %s",
                         self._mq_llm_model,
                     )
                 except Exception as exc:  # pragma: no cover - network issues
                     logger.warning("MultiQueryRetriever unavailable: %s", exc)
-                    self._retriever = base
+                    retriever = base
             else:
-                self._retriever = base
-        return self._retriever
+                retriever = base
+            self._retrievers.set(params, retriever)
+        return retriever
+
+    def scoped_retriever(
+        self,
+        sources: Optional[Sequence[str]] = None,
+        k: Optional[int] = None,
+        search_type: str = "similarity",
+        extra_documents: Optional[Sequence[Document]] = None,
+        compress: Optional[bool] = None,
+        namespaces: Optional[Sequence[str]] = None,
+    ) -> ScopedRetriever:
+        """Return a reusable retriever restricted to the files in ``sources``.
+
+        All sources are covered by a single ``$in``-filtered query that embeds
+        the question once. Retrievers are cached per scope, so repeated
+        requests for the same PDF(s) reuse the same instance. ``compress``
+        (default ``RAG_COMPRESS``) enables query-focused compression of the
+        retrieved documents. ``namespaces`` lists the collections to search
+        (default: the course corpus only; see :meth:`visible_namespaces`).
+        """
+        k = k or self._default_k
+        compress = self._compress if compress is None else compress
+        namespaces_key = self._namespaces_key(namespaces)
+        sources_key = tuple(sorted(set(sources))) if sources else None
+        extra = list(extra_documents or [])
+        key = (
+            sources_key,
+            k,
+            search_type,
+            tuple(sha256(d.page_content.encode("utf-8")).hexdigest() for d in extra),
+            compress,
+            namespaces_key,
+        )
+        retriever = self._scoped_retrievers.get(key)
+        if retriever is None:
+            retriever = ScopedRetriever(
+                service=self,
+                k=k,
+                sources=list(sources_key) if sources_key else None,
+                search_type=search_type,
+                extra_documents=extra,
+                compressor=self._compressor if compress else None,
+                namespaces=list(namespaces_key),
+            )
+            self._scoped_retrievers.set(key, retriever)
+        return retriever
+
+    @staticmethod
+    def _source_filter(sources: Optional[Sequence[str]]) -> Optional[dict]:
+        if not sources:
+            return None
+        if len(sources) == 1:
+            return {"source": sources[0]}
+        return {"source": {"$in": list(sources)}}
+
+    @staticmethod
+    def _namespaces_key(namespaces: Optional[Sequence[str]]) -> Tuple[str, ...]:
+        if not namespaces:
+            return (COURSE_NAMESPACE,)
+        return tuple(dict.fromkeys(namespaces))
+
+    def _cache_key(
+        self,
+        query: str,
+        k: int,
+        sources: Optional[Sequence[str]],
+        search_type: str,
+        fetch_k: Optional[int],
+        namespaces: Tuple[str, ...],
+    ) -> tuple:
+        return (
+            normalize_query(query),
+            tuple(sorted(set(sources))) if sources else None,
+            k,
+            search_type,
+            fetch_k,
+            namespaces,
+            self.index_generation(),
+        )
+
+    def _cached_results(self, key: tuple) -> Optional[List[Document]]:
+        cached = self._result_cache.get(key)
+        if cached is None:
+            return None
+        return [
+            Document(page_content=d.page_content, metadata=dict(d.metadata))
+            for d in cached
+        ]
+
+    def search(
+        self,
+        query: str,
+        k: Optional[int] = None,
+        sources: Optional[Sequence[str]] = None,
+        search_type: str = "similarity",
+        fetch_k: Optional[int] = None,
+        timings: Optional[Dict[str, float]] = None,
+        namespaces: Optional[Sequence[str]] = None,
+    ) -> List[Document]:
+        """Search the store for ``query``, optionally restricted to ``sources``.
+
+        ``search_type`` is ``"similarity"``, ``"mmr"`` or ``"hybrid"``. The
+        query is embedded once and every stage's duration in seconds is
+        written into ``timings`` when a dict is passed. ``namespaces``
+        selects the collections to fan out to (default: the course corpus);
+        per-collection hits are merged by score.
+        """
+        k = k or self._default_k
+        timings = timings if timings is not None else {}
+        start = time.perf_counter()
+
+        namespaces = self._namespaces_key(namespaces)
+        cache_key = self._cache_key(
+            query, k, sources, search_type, fetch_k, namespaces
+        )
+        cached = self._cached_results(cache_key)
+        if cached is not None:
+            timings["cache"] = timings["total"] = time.perf_counter() - start
+            return cached
+
+        embedding = self._embeddings.embed_query(query)
+        timings["embed"] = time.perf_counter() - start
+        docs = self._search_by_vector(
+            query, embedding, k, sources, search_type, fetch_k, timings, namespaces
+        )
+        self._finish_search(cache_key, docs, sources, search_type, start, timings)
+        return docs
+
+    async def asearch(
+        self,
+        query: str,
+        k: Optional[int] = None,
+        sources: Optional[Sequence[str]] = None,
+        search_type: str = "similarity",
+        fetch_k: Optional[int] = None,
+        timings: Optional[Dict[str, float]] = None,
+        namespaces: Optional[Sequence[str]] = None,
+    ) -> List[Document]:
+        """Async variant of :meth:`search`.
+
+        The query is embedded with the backend's async API and the blocking
+        Chroma query runs on a bounded thread pool (``RAG_SEARCH_WORKERS``), so
+        the event loop stays free for other requests.
+        """
+        k = k or self._default_k
+        timings = timings if timings is not None else {}
+        start = time.perf_counter()
+
+        namespaces = self._namespaces_key(namespaces)
+        cache_key = self._cache_key(
+            query, k, sources, search_type, fetch_k, namespaces
+        )
+        cached = self._cached_results(cache_key)
+        if cached is not None:
+            timings["cache"] = timings["total"] = time.perf_counter() - start
+            return cached
+
+        embedding = await self._embeddings.aembed_query(query)
+        timings["embed"] = time.perf_counter() - start
+        loop = asyncio.get_running_loop()
+        docs = await loop.run_in_executor(
+            self._search_executor(),
+            partial(
+                self._search_by_vector,
+                query,
+                embedding,
+                k,
+                sources,
+                search_type,
+                fetch_k,
+                timings,
+                namespaces,
+            ),
+        )
+        self._finish_search(cache_key, docs, sources, search_type, start, timings)
+        return docs
+
+    def retrieve_many(
+        self,
+        queries: Sequence[str],
+        scope: Optional[Sequence[str]] = None,
+        k: Optional[int] = None,
+        search_type: str = "similarity",
+        fetch_k: Optional[int] = None,
+        namespaces: Optional[Sequence[str]] = None,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> List[List[Document]]:
+        """Search for several queries at once; one ranking per query, in order.
+
+        Equivalent to calling :meth:`search` for each query with
+        ``sources=scope``, but queries missing from the result cache are
+        embedded in one batched call and every collection receives a single
+        multi-query vector search, so N queries cost one embedding round trip
+        and one query per namespace instead of N of each.
+        """
+        k = k or self._default_k
+        timings = timings if timings is not None else {}
+        start = time.perf_counter()
+
+        namespaces = self._namespaces_key(namespaces)
+        results: List[Optional[List[Document]]] = [None] * len(queries)
+        pending: Dict[str, List[int]] = {}
+        keys: Dict[str, tuple] = {}
+        for position, query in enumerate(queries):
+            if query in pending:
+                pending[query].append(position)
+                continue
+            key = self._cache_key(query, k, scope, search_type, fetch_k, namespaces)
+            cached = self._cached_results(key)
+            if cached is not None:
+                results[position] = cached
+                continue
+            pending[query] = [position]
+            keys[query] = key
+
+        if pending:
+            texts = list(pending)
+            embeddings = embed_queries(self._embeddings, texts)
+            timings["embed"] = time.perf_counter() - start
+            rankings = []
+            for namespace in namespaces:
+                part: Dict[str, float] = {}
+                rankings.append(
+                    self._search_namespace_many(
+                        namespace, texts, embeddings, k, scope, search_type, fetch_k, part
+                    )
+                )
+                for stage, seconds in part.items():
+                    timings[stage] = timings.get(stage, 0.0) + seconds
+            for i, query in enumerate(texts):
+                docs = self._merge_namespace_results([r[i] for r in rankings], k)
+                self._result_cache.set(keys[query], self._copy_documents(docs))
+                for position in pending[query]:
+                    results[position] = self._copy_documents(docs)
+
+        timings["total"] = time.perf_counter() - start
+        logger.debug(
+            "Batched search (%s, %d queries, %d embedded) in %s",
+            search_type,
+            len(queries),
+            len(pending),
+            timings,
+        )
+        return results
+
+    @staticmethod
+    def _copy_documents(docs: Sequence[Document]) -> List[Document]:
+        return [
+            Document(id=d.id, page_content=d.page_content, metadata=dict(d.metadata))
+            for d in docs
+        ]
+
+    def _search_namespace_many(
+        self,
+        namespace: str,
+        queries: Sequence[str],
+        embeddings: Sequence[List[float]],
+        k: int,
+        sources: Optional[Sequence[str]],
+        search_type: str,
+        fetch_k: Optional[int],
+        timings: Dict[str, float],
+    ) -> List[List[Document]]:
+        """Batched :meth:`_search_namespace`: one collection query for all."""
+        if search_type == "similarity":
+            n_results = k
+        elif search_type == "mmr":
+            n_results = max(fetch_k or self._mmr_fetch_k, k)
+        elif search_type == "hybrid":
+            n_results = max(fetch_k or self._hybrid_fetch_k, k)
+        else:
+            raise ValueError(f"Unknown search type: {search_type}")
+
+        store = self._get_vectorstore(namespace)
+        include = ["documents", "metadatas", "distances"]
+        if search_type == "mmr":
+            include.append("embeddings")
+        start = time.perf_counter()
+        hits = self._collection_of(store).query(
+            query_embeddings=[list(e) for e in embeddings],
+            n_results=n_results,
+            where=self._source_filter(sources),
+            include=include,
+        )
+        timings["vector"] = time.perf_counter() - start
 
-    def ingest_paths(self, items: Iterable[Union[str, Document]]) -> Optional[str]:
+        rankings = []
+        for i, query in enumerate(queries):
+            ids = hits["ids"][i]
+            metadatas = hits["metadatas"][i] or [None] * len(ids)
+            candidates = [
+                Document(id=doc_id, page_content=text or "", metadata=dict(meta or {}))
+                for doc_id, text, meta in zip(ids, hits["documents"][i], metadatas)
+            ]
+            if search_type == "similarity":
+                # 与 search() 一致：距离转成越大越好的分数
+                for doc, distance in zip(candidates, hits["distances"][i]):
+                    doc.metadata["score"] = 1.0 / (1.0 + distance)
+                rankings.append(candidates)
+            elif search_type == "mmr":
+                if not candidates:
+                    rankings.append([])
+                    continue
+                selected = maximal_marginal_relevance(
+                    np.array(embeddings[i], dtype=np.float32),
+                    hits["embeddings"][i],
+                    k=k,
+                )
+                rankings.append([candidates[j] for j in selected])
+            else:
+                t_lexical = time.perf_counter()
+                lexical = [
+                    doc
+                    for doc, _ in self.lexical_index(namespace).search(
+                        query, k=n_results, sources=sources
+                    )
+                ]
+                t_fusion = time.perf_counter()
+                rankings.append(reciprocal_rank_fusion([candidates, lexical], k=k))
+                timings["lexical"] = timings.get("lexical", 0.0) + t_fusion - t_lexical
+                timings["fusion"] = (
+                    timings.get("fusion", 0.0) + time.perf_counter() - t_fusion
+                )
+        return rankings
+
+    def _search_executor(self) -> ThreadPoolExecutor:
+        if self._search_pool is None:
+            self._search_pool = ThreadPoolExecutor(
+                max_workers=self._search_workers, thread_name_prefix="rag-search"
+            )
+        return self._search_pool
+
+    def _search_by_vector(
+        self,
+        query: str,
+        embedding: List[float],
+        k: int,
+        sources: Optional[Sequence[str]],
+        search_type: str,
+        fetch_k: Optional[int],
+        timings: Dict[str, float],
+        namespaces: Sequence[str] = (COURSE_NAMESPACE,),
+    ) -> List[Document]:
+        if len(namespaces) == 1:
+            return self._search_namespace(
+                namespaces[0], query, embedding, k, sources, search_type, fetch_k, timings
+            )
+        results = []
+        for namespace in namespaces:
+            part: Dict[str, float] = {}
+            results.append(
+                self._search_namespace(
+                    namespace, query, embedding, k, sources, search_type, fetch_k, part
+                )
+            )
+            for stage, seconds in part.items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+        return self._merge_namespace_results(results, k)
+
+    @staticmethod
+    def _merge_namespace_results(
+        results: Sequence[List[Document]], k: int
+    ) -> List[Document]:
+        """Merge per-collection rankings into one list of at most ``k``."""
+        docs = [doc for ranking in results for doc in ranking]
+        for key in ("score", "rrf_score"):
+            if docs and all(key in d.metadata for d in docs):
+                return sorted(docs, key=lambda d: d.metadata[key], reverse=True)[:k]
+        # 没有可比较的分数（如 MMR）时按名次轮流取
+        merged = []
+        for rank in range(max((len(r) for r in results), default=0)):
+            merged.extend(r[rank] for r in results if rank < len(r))
+        return merged[:k]
+
+    def _search_namespace(
+        self,
+        namespace: str,
+        query: str,
+        embedding: List[float],
+        k: int,
+        sources: Optional[Sequence[str]],
+        search_type: str,
+        fetch_k: Optional[int],
+        timings: Dict[str, float],
+    ) -> List[Document]:
+        search_filter = self._source_filter(sources)
+        store = self._get_vectorstore(namespace)
+        start = time.perf_counter()
+
+        if search_type == "mmr":
+            # 与批量检索共用 MMR 选择，保持选择顺序（langchain_chroma 的实现会按候选原序返回）
+            docs = self._search_namespace_many(
+                namespace, [query], [embedding], k, sources, search_type, fetch_k, timings
+            )[0]
+        elif search_type == "hybrid":
+            fetch_k = max(fetch_k or self._hybrid_fetch_k, k)
+            dense = store.similarity_search_by_vector(
+                embedding, k=fetch_k, filter=search_filter
+            )
+            t_dense = time.perf_counter()
+            lexical = [
+                doc
+                for doc, _ in self.lexical_index(namespace).search(
+                    query, k=fetch_k, sources=sources
+                )
+            ]
+            t_lexical = time.perf_counter()
+            docs = reciprocal_rank_fusion([dense, lexical], k=k)
+            timings["vector"] = t_dense - start
+            timings["lexical"] = t_lexical - t_dense
+            timings["fusion"] = time.perf_counter() - t_lexical
+        elif search_type == "similarity":
+            # 距离转成越大越好的分数，供上下文拼装按分数排序
+            docs = [
+                Document(
+                    page_content=doc.page_content,
+                    metadata={**doc.metadata, "score": 1.0 / (1.0 + distance)},
+                )
+                for doc, distance in store.similarity_search_by_vector_with_relevance_scores(
+                    embedding, k=k, filter=search_filter
+                )
+            ]
+            timings["vector"] = time.perf_counter() - start
+        else:
+            raise ValueError(f"Unknown search type: {search_type}")
+        return docs
+
+    def _finish_search(
+        self,
+        cache_key: tuple,
+        docs: List[Document],
+        sources: Optional[Sequence[str]],
+        search_type: str,
+        start: float,
+        timings: Dict[str, float],
+    ) -> None:
+        self._result_cache.set(
+            cache_key,
+            [Document(page_content=d.page_content, metadata=dict(d.metadata)) for d in docs],
+        )
+        timings["total"] = time.perf_counter() - start
+        logger.debug(
+            "Search (%s, %d source(s)) returned %d docs in %s",
+            search_type,
+            len(sources or []),
+            len(docs),
+            timings,
+        )
+
+    def ingest_paths(
+        self,
+        items: Iterable[Union[str, Document]],
+        namespace: str = COURSE_NAMESPACE,
+    ) -> Optional[str]:
         """Embed documents from ``items`` into the vector store and persist.
 
         ``items`` may be file paths or :class:`~langchain_core.documents.Document`
-        instances. Chunks are deduplicated using a ``doc_hash`` metadata field to
-        avoid embedding the same content multiple times.
+        instances. Files are split by :class:`~tools.chunking.StructuredChunker`
+        (the same chunking as ``python -m tools.ingest``); Documents are stored
+        as given. Chunks are deduplicated using a ``doc_hash`` metadata field to
+        avoid embedding the same content multiple times. ``namespace`` selects
+        the target collection (e.g. :func:`user_namespace` for student uploads).
+        PDF pages are streamed from :meth:`PDFOCRLoader.lazy_load` into
+        :meth:`ingest_documents`, so embedding starts with the first pages.
+        Items before a failing file are still ingested.
 
         Returns an error string if ingestion fails so callers can surface
         actionable feedback to users.
         """
-        store = self._get_vectorstore()
-        documents: list[Document] = []
-        for item in items:
-            if isinstance(item, str):
+        errors: list[str] = []
+        load_failures: list[Exception] = []
+
+        def _documents() -> Iterator[Document]:
+            # 逐文件、逐页流式产出 chunk，边加载边嵌入，内存占用与书的页数无关
+            for item in items:
+                if not isinstance(item, str):
+                    yield item
+                    continue
                 # 根据文件扩展名选择合适的加载器
                 if item.lower().endswith(".pdf"):
                     loader = PDFOCRLoader(item)
+                    pages = loader.lazy_load()
                 elif item.lower().endswith(".docx"):
                     loader = Docx2txtLoader(item)
+                    pages = None
                 else:
                     loader = UnstructuredFileLoader(item)
+                    pages = None
                 try:
-                    documents.extend(loader.load())
+                    yield from self._chunker.iter_chunks(
+                        pages if pages is not None else loader.load()
+                    )
                 except LookupError:
                     msg = (
                         "Missing NLTK data. Run nltk.download('punkt'); "
                         "nltk.download('averaged_perceptron_tagger')"
                     )
                     logger.error("Failed to load %s: %s", item, msg)
-                    return msg
+                    errors.append(msg)
+                    return
                 except ImportError:
                     # 提示用户安装所需的依赖
                     if item.lower().endswith(".docx"):
@@ -193,37 +1306,206 @@ class RAGService:
                             "pip install 'unstructured[pdf]'"
                         )
                     logger.error("Failed to load %s: %s", item, msg)
-                    return msg
-            else:
-                documents.append(item)
+                    errors.append(msg)
+                    return
+                except Exception as exc:
+                    load_failures.append(exc)
+                    raise
+
+        try:
+            self.ingest_documents(_documents(), namespace=namespace)
+        except Exception as exc:
+            # 加载阶段的其他异常照旧抛给调用方，而不是报告为嵌入失败
+            if exc in load_failures:
+                raise
+            msg = f"Embedding failed: {exc}"
+            logger.error("Failed to ingest documents: %s", exc)
+            return msg
+        return errors[0] if errors else None
+
+    def ingest_documents(
+        self, documents: Iterable[Document], namespace: str = COURSE_NAMESPACE
+    ) -> list[str]:
+        """Upsert ``documents`` into ``namespace`` and return their chunk IDs.
+
+        Chunk IDs are the ``doc_hash`` of the content, so re-ingesting the same
+        text is an upsert rather than a duplicate. Existence is checked with one
+        Chroma query per batch; only unseen chunks are embedded, in batches of
+        ``embed_batch_size`` running on up to ``embed_workers`` threads.
 
-        to_add: list[Document] = []
+        Chunks nearly identical to one already ingested (see
+        :meth:`near_duplicate_index`) are not stored: they get a
+        ``duplicate_of`` metadata entry and the kept chunk's ID is returned in
+        their place. An earlier version of the same source never counts as
+        the original, so edited files are replaced rather than skipped.
+        """
+        store = self._get_vectorstore(namespace)
+        near_dup = self.near_duplicate_index(namespace)
+        ids: list[str] = []
         seen_hashes: set[str] = set()
-        for doc in documents:
-            # 使用内容哈希值进行去重
-            doc_hash = (
-                doc.metadata.get("doc_hash")
-                or sha256(doc.page_content.encode("utf-8")).hexdigest()
-            )
-            doc.metadata["doc_hash"] = doc_hash
-            if doc_hash in seen_hashes:
-                continue
-            seen_hashes.add(doc_hash)
+        fresh: set[str] = set()
+        dropped = 0
+        batch: list[Document] = []
+        added = 0
+
+        try:
+            with ThreadPoolExecutor(max_workers=self._embed_workers) as pool:
+                in_flight: dict = {}
+
+                def _drain(block_until: int) -> int:
+                    written = 0
+                    while len(in_flight) > block_until:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            docs = in_flight.pop(future)
+                            self._write_batch(namespace, docs, future.result())
+                            written += len(docs)
+                    return written
+
+                def _submit(docs: list[Document]) -> None:
+                    new_docs = self._filter_existing(store, docs)
+                    if new_docs:
+                        texts = [d.page_content for d in new_docs]
+                        in_flight[pool.submit(self._embed_with_retry, texts)] = new_docs
 
-            # 检查 Chroma 中是否已存在此哈希值的文档
-            if not store.get(where={"doc_hash": doc_hash}, limit=1)["ids"]:
-                to_add.append(doc)
+                for doc in documents:
+                    # 使用内容哈希值作为 chunk ID 进行去重
+                    doc_hash = (
+                        doc.metadata.get("doc_hash")
+                        or sha256(doc.page_content.encode("utf-8")).hexdigest()
+                    )
+                    doc.metadata["doc_hash"] = doc_hash
+                    if doc_hash in seen_hashes:
+                        continue
+                    seen_hashes.add(doc_hash)
+                    original = self._near_duplicate_of(near_dup, doc, fresh)
+                    if original is not None:
+                        doc.metadata["duplicate_of"] = original
+                        ids.append(original)
+                        dropped += 1
+                        continue
+                    ids.append(doc_hash)
+                    batch.append(doc)
+                    if len(batch) >= self._embed_batch_size:
+                        _submit(batch)
+                        batch = []
+                        # 限制同时在途的批次数量，形成背压
+                        added += _drain(self._embed_workers * 2)
+                if batch:
+                    _submit(batch)
+                added += _drain(0)
+        except BaseException:
+            # 写入失败时撤销本次登记的签名，避免重试时把这些内容误判为重复
+            if near_dup is not None:
+                near_dup.rollback()
+            raise
 
-        if to_add:
-            store.add_documents(to_add)
+        if near_dup is not None and fresh:
+            near_dup.save()
+        if dropped:
+            logger.info("Dropped %d near-duplicate chunk(s)", dropped)
+        if added:
             if hasattr(store, "persist"):
                 store.persist()
-            logger.info("Ingested %d new document(s)", len(to_add))
+            self.lexical_index(namespace).save()
+            self._bump_generation()
+            logger.info("Ingested %d new document(s)", added)
         else:
             logger.info("No new documents to ingest")
+        return ids
+
+    def delete_documents(
+        self, ids: Iterable[str], namespace: str = COURSE_NAMESPACE
+    ) -> None:
+        """Remove the chunks with the given IDs (``doc_hash`` values)."""
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return
+        store = self._get_vectorstore(namespace)
+        # 按 doc_hash 删除，同时覆盖旧版本以随机 UUID 写入的记录
+        for start in range(0, len(ids), 500):
+            batch = ids[start : start + 500]
+            self._collection_of(store).delete(where={"doc_hash": {"$in": batch}})
+        if hasattr(store, "persist"):
+            store.persist()
+        lexical = self.lexical_index(namespace)
+        lexical.remove(ids)
+        lexical.save()
+        near_dup = self.near_duplicate_index(namespace)
+        if near_dup is not None:
+            near_dup.remove(ids)
+            near_dup.save()
+        self._bump_generation()
+        logger.info("Deleted %d document(s)", len(ids))
+
+    @staticmethod
+    def _near_duplicate_of(
+        index: Optional[NearDuplicateIndex], doc: Document, fresh: set[str]
+    ) -> Optional[str]:
+        """Return the ID of the chunk ``doc`` duplicates, else register it.
 
+        ``fresh`` holds the IDs registered during the current ingest; older
+        chunks of the same source are not treated as originals.
+        """
+        if index is None:
+            return None
+        doc_hash = doc.metadata["doc_hash"]
+        source = str(doc.metadata.get("source") or "")
+        signature = index.signature(doc.page_content)
+        original = index.find(doc.page_content, source, signature)
+        if original not in (None, doc_hash) and (
+            original in fresh or index.source_of(original) != source
+        ):
+            return original
+        if signature is not None:
+            index.add(doc_hash, doc.page_content, source, signature)
+            fresh.add(doc_hash)
         return None
 
+    @staticmethod
+    def _collection_of(store):
+        """Return the object accepting raw ``upsert``/``delete`` calls."""
+        return getattr(store, "_collection", store)
+
+    def _filter_existing(self, store: Chroma, docs: list[Document]) -> list[Document]:
+        """Drop documents whose ``doc_hash`` is already stored (one query)."""
+        hashes = [d.metadata["doc_hash"] for d in docs]
+        found = store.get(where={"doc_hash": {"$in": hashes}}, include=["metadatas"])
+        existing = {m.get("doc_hash") for m in found.get("metadatas") or [] if m}
+        return [d for d in docs if d.metadata["doc_hash"] not in existing]
+
+    def _embed_with_retry(self, texts: list[str]) -> list[list[float]]:
+        for attempt in range(self._embed_retries + 1):
+            try:
+                return self._embeddings.embed_documents(texts)
+            except Exception as exc:
+                if attempt >= self._embed_retries:
+                    raise
+                delay = self._embed_backoff * (2**attempt) * (1 + random.random())
+                logger.warning(
+                    "Embedding batch of %d failed (%s); retrying in %.1fs",
+                    len(texts),
+                    exc,
+                    delay,
+                )
+                time.sleep(delay)
+        return []  # pragma: no cover - loop always returns or raises
+
+    def _write_batch(
+        self, namespace: str, docs: list[Document], vectors: list[list[float]]
+    ) -> None:
+        ids = [d.metadata["doc_hash"] for d in docs]
+        texts = [d.page_content for d in docs]
+        metadatas = [d.metadata for d in docs]
+        self._collection_of(self._get_vectorstore(namespace)).upsert(
+            ids=ids, embeddings=vectors, metadatas=metadatas, documents=texts
+        )
+        self.lexical_index(namespace).add(ids, texts, metadatas)
+        near_dup = self.near_duplicate_index(namespace)
+        if near_dup is not None:
+            for doc_id, text, meta in zip(ids, texts, metadatas):
+                near_dup.add(doc_id, text, str(meta.get("source") or ""))
+
 
 _instance: Optional[RAGService] = None
 
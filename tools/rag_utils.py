@@ -1,32 +1,139 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 import re
-from typing import Any
+from typing import Any, List, Optional
 
+from tools.context_builder import BuiltContext, build_context, default_context_budget
 
-def get_context_or_empty(query: str, retriever: Any | None) -> str:
-    if not retriever:
-        return ""
 
+def _retrieve(query: str, retriever: Any) -> List[Any]:
     try:
         if hasattr(retriever, "get_relevant_documents"):
-            docs = retriever.get_relevant_documents(query)
-        else:
-            docs = retriever.invoke(query)
+            return retriever.get_relevant_documents(query) or []
+        return retriever.invoke(query) or []
     except Exception as exc:  # pragma: no cover - retrieval errors
         logging.getLogger(__name__).warning("Retrieval failed: %s", exc)
+        return []
+
+
+def _build(
+    query: str,
+    docs: List[Any],
+    max_tokens: Optional[int],
+    compressor: Any | None = None,
+) -> BuiltContext:
+    stats = None
+    if compressor is not None and docs:
+        docs, stats = compressor.compress_with_stats(docs, query)
+    budget = max_tokens if max_tokens is not None else default_context_budget()
+    built = build_context(docs, max_tokens=budget)
+    if stats is not None:
+        built.compression = stats.as_dict()
+    return built
+
+
+def get_context_with_sources(
+    query: str,
+    retriever: Any | None,
+    max_tokens: Optional[int] = None,
+    compressor: Any | None = None,
+) -> BuiltContext:
+    """Retrieve for ``query`` and assemble a budgeted context with provenance.
+
+    ``max_tokens`` defaults to ``RAG_CONTEXT_MAX_TOKENS``; see
+    :func:`tools.context_builder.build_context`. An optional ``compressor``
+    (:class:`~tools.context_compressor.ContextCompressor`) shrinks the
+    documents first and its stats are reported in ``compression``.
+    """
+    docs = _retrieve(query, retriever) if retriever else []
+    return _build(query, docs, max_tokens, compressor)
+
+
+def get_context_or_empty(
+    query: str,
+    retriever: Any | None,
+    max_tokens: Optional[int] = None,
+    compressor: Any | None = None,
+) -> str:
+    if not retriever:
         return ""
 
+    docs = _retrieve(query, retriever)
     if not docs:
         return ""
 
-    relevant_contents = []
-    for doc in docs:
-        text = getattr(doc, "page_content", str(doc))
-        relevant_contents.append(text)
+    return _build(query, docs, max_tokens, compressor).text
 
-    if not relevant_contents:
-        return ""
 
-    return "\n\n".join(relevant_contents)
+def _retrieve_many(queries: List[str], retriever: Any) -> List[List[Any]]:
+    if hasattr(retriever, "retrieve_many"):
+        try:
+            return [docs or [] for docs in retriever.retrieve_many(list(queries))]
+        except Exception as exc:  # pragma: no cover - retrieval errors
+            logging.getLogger(__name__).warning("Batched retrieval failed: %s", exc)
+    return [_retrieve(query, retriever) for query in queries]
+
+
+def get_contexts_or_empty(
+    queries: List[str],
+    retriever: Any | None,
+    max_tokens: Optional[int] = None,
+    compressor: Any | None = None,
+) -> List[str]:
+    """Batched :func:`get_context_or_empty`: one context string per query.
+
+    Retrievers with a ``retrieve_many`` method (scoped, hybrid and
+    multi-query retrievers from :class:`~tools.rag_service.RAGService`) serve
+    every query from one batched search; others are queried one by one.
+    """
+    if not retriever or not queries:
+        return ["" for _ in queries]
+    return [
+        _build(query, docs, max_tokens, compressor).text if docs else ""
+        for query, docs in zip(queries, _retrieve_many(queries, retriever))
+    ]
+
+
+async def aget_context_with_sources(
+    query: str,
+    retriever: Any | None,
+    max_tokens: Optional[int] = None,
+    compressor: Any | None = None,
+) -> BuiltContext:
+    """Async variant of :func:`get_context_with_sources`."""
+    if not retriever:
+        return _build(query, [], max_tokens)
+    if not hasattr(retriever, "ainvoke"):
+        return await asyncio.to_thread(
+            get_context_with_sources, query, retriever, max_tokens, compressor
+        )
+
+    try:
+        docs = await retriever.ainvoke(query)
+    except Exception as exc:  # pragma: no cover - retrieval errors
+        logging.getLogger(__name__).warning("Retrieval failed: %s", exc)
+        docs = []
+    if not docs:
+        return _build(query, [], max_tokens)
+    # 计数与压缩是 CPU 工作，首次加载 tiktoken 词表还可能阻塞数秒，放到线程中执行
+    return await asyncio.to_thread(_build, query, docs, max_tokens, compressor)
+
+
+async def aget_context_or_empty(
+    query: str,
+    retriever: Any | None,
+    max_tokens: Optional[int] = None,
+    compressor: Any | None = None,
+) -> str:
+    """Async variant of :func:`get_context_or_empty`.
+
+    Uses the retriever's ``ainvoke`` so retrievers with a native async path
+    (e.g. :class:`~tools.scoped_retriever.ScopedRetriever`) do not block the
+    event loop.
+    """
+    if not retriever:
+        return ""
+    built = await aget_context_with_sources(query, retriever, max_tokens, compressor)
+    return built.text
@@ -0,0 +1,534 @@
+"""Offline retrieval quality and latency benchmark.
+
+Usage::
+
+    python -m tools.retrieval_benchmark --k 4 --output data/Log/retrieval_benchmark.json
+
+The query set is built from the exam questions in ``data/Question/Q*.txt``
+and the user queries recorded in ``data/Log/llm_log.json``. Each query is
+mapped to the PDFs it should retrieve through the knowledge tree in
+``data/course/big_data.json``: the node whose name best matches the query
+(restricted to the question file's chapter) and its descendants; if that
+node has no PDF, the nearest ancestor with one is used.
+
+The book PDFs are indexed into a temporary store with
+:class:`~tools.embedding_backends.HashingEmbeddings` (text layer only, no
+OCR), and every retriever mode runs with a deterministic query rewriter in
+place of the LLM, so the benchmark needs no network access. For each mode it
+reports hit-rate@k, MRR and p50/p95 latency, plus the mean duration of every
+stage the retriever records.
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import fitz
+import numpy as np
+from langchain_classic.retrievers.multi_query import LineListOutputParser
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+
+from tools.chunking import StructuredChunker
+from tools.embedding_backends import HashingEmbeddings
+from tools.lexical_index import tokenize
+from tools.multi_query import CachedMultiQueryRetriever
+from tools.pdf_ocr_loader import PDFOCRLoader
+
+logger = logging.getLogger(__name__)
+
+MODES = ("similarity", "mmr", "multi_query", "scoped", "hybrid")
+
+# 答案标记，如 "( B )"、"（D）"、"( √ )"
+_ANSWER_RE = re.compile(r"[（(]\s*([A-Fa-f]{1,4}|√|×|对|错)\s*[)）]")
+_BLANK_RE = re.compile(r"[（(]\s*[)）]")
+_NUMBER_RE = re.compile(r"^\s*\d+\s*[.、．]\s*")
+_OPTION_RE = re.compile(r"^\s*[A-Fa-f]\s*[.、．]")
+_SECTION_RE = re.compile(r"^\s*([一二三四五六七八九十]+、)?\s*\S{0,4}题\s*$")
+_CONTEXT_RE = re.compile(r"\s+Context:", re.S)
+_PROMPT_RE = re.compile(r"^(请|试)?(简要|简单)?(简述|解释|说明|论述|列举|阐述|描述|分析)?")
+
+
+@dataclass
+class BenchmarkQuery:
+    """One query with the PDFs a good retriever should return."""
+
+    text: str
+    origin: str
+    expected: List[str]
+    topic: Optional[str] = None
+    chapter: Optional[str] = None
+
+
+@dataclass
+class ModeResult:
+    """Aggregated metrics of one retriever mode."""
+
+    mode: str
+    k: int
+    queries: int
+    hit_rate: float
+    mrr: float
+    p50_ms: float
+    p95_ms: float
+    # 该模式无法评测的查询数（scoped 模式下没有章节映射的查询）
+    skipped: int = 0
+    stages_ms: Dict[str, float] = field(default_factory=dict)
+    ranks: List[Optional[int]] = field(default_factory=list)
+
+    def as_dict(self, per_query: bool = True) -> dict:
+        data = asdict(self)
+        if not per_query:
+            data.pop("ranks")
+        return data
+
+
+# ---------------------------------------------------------------------- 查询集
+def parse_question_file(path: str) -> List[str]:
+    """Return the question stems of an exam file, without options or answers."""
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    stems = []
+    for line in lines:
+        if not line.strip() or _SECTION_RE.match(line) or _OPTION_RE.match(line):
+            continue
+        # 题干以编号开头或带答案标记；无编号的选项行两者都没有
+        if not (_NUMBER_RE.match(line) or _ANSWER_RE.search(line)):
+            continue
+        text = _NUMBER_RE.sub("", line)
+        text = _ANSWER_RE.sub("", text)
+        text = _BLANK_RE.sub("（）", text)
+        text = re.sub(r"\s+", " ", text).strip(" .．")
+        if len(text) >= 6:
+            stems.append(text)
+    return stems
+
+
+def log_queries(path: str) -> List[Tuple[str, str, Optional[str]]]:
+    """Return ``(text, origin, topic)`` for the user queries in an LLM log."""
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    queries = []
+    for entry in entries:
+        meta = entry.get("metadata") or {}
+        origin = f"{entry.get('module')}.{meta.get('function')}"
+        if meta.get("question"):
+            queries.append((meta["question"], origin, meta.get("topic")))
+        elif meta.get("topic"):
+            queries.append((meta["topic"], origin, meta["topic"]))
+        elif entry.get("module", "").startswith("AgentModule"):
+            messages = (entry.get("request") or {}).get("messages") or []
+            users = [m["content"] for m in messages if m.get("role") == "user"]
+            if users:
+                text = _CONTEXT_RE.split(users[-1])[0].strip()
+                if text:
+                    queries.append((text, origin, None))
+    # 同一问题多次出现时只保留一次
+    seen = set()
+    unique = []
+    for text, origin, topic in queries:
+        if text not in seen:
+            seen.add(text)
+            unique.append((text, origin, topic))
+    return unique
+
+
+def _terms(text: str) -> set:
+    return {t for t in tokenize(text) if len(t) >= 2}
+
+
+@dataclass
+class _Node:
+    name: str
+    chapter: str
+    pdfs: List[str]
+    parent: Optional["_Node"]
+    terms: set
+
+
+class CourseMap:
+    """Knowledge tree of ``big_data.json`` with the PDFs behind every node."""
+
+    def __init__(self, course_path: str, book_dir: str = "data/Book") -> None:
+        with open(course_path, encoding="utf-8") as f:
+            tree = json.load(f)
+        # 知识树中的文件名大小写与磁盘不一定一致
+        self._files = {
+            os.path.basename(p).lower(): p
+            for p in glob.glob(os.path.join(glob.escape(book_dir), "*"))
+        }
+        self.nodes: List[_Node] = []
+        self.chapters: Dict[str, List[str]] = {}
+        for child in tree.get("children", []):
+            self._walk(child, child["name"], None)
+        for node in self.nodes:
+            self.chapters.setdefault(node.chapter, [])
+            for pdf in node.pdfs:
+                if pdf not in self.chapters[node.chapter]:
+                    self.chapters[node.chapter].append(pdf)
+
+    def _resolve(self, paths) -> List[str]:
+        if not isinstance(paths, list):
+            return []
+        resolved = []
+        for path in paths:
+            if str(path).lower().endswith(".pdf"):
+                found = self._files.get(os.path.basename(path).lower())
+                if found:
+                    resolved.append(found)
+        return resolved
+
+    def _walk(self, data: dict, chapter: str, parent: Optional[_Node]) -> _Node:
+        node = _Node(
+            name=data["name"],
+            chapter=chapter,
+            pdfs=self._resolve(data.get("resource_path")),
+            parent=parent,
+            terms=_terms(data["name"]),
+        )
+        self.nodes.append(node)
+        for key in ("children", "grandchildren", "great-grandchildren"):
+            for child in data.get(key) or []:
+                self._walk(child, chapter, node)
+        return node
+
+    def all_pdfs(self) -> List[str]:
+        """Every PDF in the book directory, including unreferenced ones."""
+        return sorted(p for p in self._files.values() if p.lower().endswith(".pdf"))
+
+    def _subtree_pdfs(self, node: _Node) -> List[str]:
+        pdfs = []
+        for other in self.nodes:
+            current: Optional[_Node] = other
+            while current is not None and current is not node:
+                current = current.parent
+            if current is node:
+                pdfs.extend(p for p in other.pdfs if p not in pdfs)
+        return pdfs
+
+    def expected_pdfs(self, node: _Node) -> List[str]:
+        current: Optional[_Node] = node
+        while current is not None:
+            pdfs = self._subtree_pdfs(current)
+            if pdfs:
+                return pdfs
+            current = current.parent
+        return list(self.chapters.get(node.chapter, []))
+
+    def match(
+        self, text: str, chapter: Optional[str] = None, min_coverage: float = 0.5
+    ) -> Optional[_Node]:
+        """Return the node whose name is best covered by ``text``."""
+        if not text:
+            return None
+        exact = [n for n in self.nodes if n.name == text.strip()]
+        if exact:
+            return exact[0]
+        terms = _terms(text)
+        best, best_key = None, (0.0, 0.0)
+        for node in self.nodes:
+            if chapter and node.chapter != chapter or not node.terms:
+                continue
+            shared = len(node.terms & terms)
+            coverage = shared / len(node.terms)
+            key = (shared * coverage, coverage)
+            if coverage >= min_coverage and key > best_key:
+                best, best_key = node, key
+        return best
+
+
+def build_query_set(
+    question_dir: str = "data/Question",
+    log_path: str = "data/Log/llm_log.json",
+    course_path: str = "data/course/big_data.json",
+    book_dir: str = "data/Book",
+) -> List[BenchmarkQuery]:
+    """Parse exam questions and logged queries and attach expected PDFs."""
+    course = CourseMap(course_path, book_dir)
+    queries: List[BenchmarkQuery] = []
+
+    for path in sorted(glob.glob(os.path.join(glob.escape(question_dir), "Q*.txt"))):
+        stems = parse_question_file(path)
+        matches = [course.match(s) for s in stems]
+        # 每份题目对应一个章节：取匹配结果中出现最多的章节
+        votes: Dict[str, int] = {}
+        for node in matches:
+            if node is not None:
+                votes[node.chapter] = votes.get(node.chapter, 0) + 1
+        if not votes:
+            logger.warning("Could not map %s to a chapter", path)
+            continue
+        chapter = max(votes, key=votes.get)
+        origin = os.path.splitext(os.path.basename(path))[0]
+        for stem in stems:
+            node = course.match(stem, chapter=chapter)
+            expected = (
+                course.expected_pdfs(node) if node else list(course.chapters[chapter])
+            )
+            if expected:
+                queries.append(
+                    BenchmarkQuery(
+                        stem, origin, expected, node.name if node else None, chapter
+                    )
+                )
+
+    if os.path.exists(log_path):
+        for text, origin, topic in log_queries(log_path):
+            node = course.match(topic or text)
+            if node is None:
+                continue
+            expected = course.expected_pdfs(node)
+            if expected:
+                queries.append(
+                    BenchmarkQuery(text, origin, expected, node.name, node.chapter)
+                )
+    return queries
+
+
+# ---------------------------------------------------------------------- 语料与检索
+def load_text_pages(paths: Iterable[str]) -> Iterator[Document]:
+    """Yield one Document per page from the PDF text layers (no OCR)."""
+    for path in paths:
+        with fitz.open(path) as pdf:
+            for number, page in enumerate(pdf, start=1):
+                text, headings = PDFOCRLoader._extract_text_layer(page)
+                if len(text.strip()) < 50:
+                    continue
+                metadata = {"source": path, "page": number}
+                if headings:
+                    metadata["headings"] = "\n".join(
+                        f"{level}\t{title}" for level, title in headings
+                    )
+                yield Document(page_content=text, metadata=metadata)
+
+
+def fake_query_variants(inputs) -> str:
+    """Deterministic stand-in for the multi-query LLM: one rewrite per line."""
+    question = inputs["question"] if isinstance(inputs, dict) else str(inputs)
+    core = _PROMPT_RE.sub("", question).strip(" ？?。.，,")
+    runs = re.findall(r"[A-Za-z][A-Za-z0-9\-]+|[一-鿿]{2,}", core)
+    keywords = " ".join(sorted(runs, key=len, reverse=True)[:4])
+    return "\n".join(v for v in (core, keywords, f"{core}的概念与原理") if v)
+
+
+@contextmanager
+def _env(**values: str):
+    old = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key, value in old.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def build_service(pdfs: Sequence[str], persist_directory: str, embed_size: int = 256):
+    """Index ``pdfs`` into a fresh offline :class:`RAGService`."""
+    from tools.rag_service import RAGService
+
+    # 关闭结果缓存，避免不同模式之间互相命中缓存而低估延迟
+    with _env(RAG_RESULT_CACHE_SIZE="0"):
+        service = RAGService(
+            embeddings=HashingEmbeddings(size=embed_size),
+            persist_directory=persist_directory,
+            use_multiquery=False,
+            embedding_cache=False,
+        )
+    chunks = StructuredChunker().iter_chunks(load_text_pages(pdfs))
+    service.ingest_documents(chunks)
+    return service
+
+
+def _retriever(
+    service, mode: str, k: int, query: BenchmarkQuery, course_pdfs, timings: dict
+):
+    """Return the retriever for ``mode``; extra stage timings go to ``timings``."""
+    if mode in {"similarity", "mmr", "hybrid"}:
+        return service.get_retriever(k=k, mode=mode)
+    if mode == "scoped":
+        # 模拟按当前章节资料检索；范围只来自章节映射，不能用标准答案补齐
+        return service.scoped_retriever(sources=course_pdfs[query.chapter], k=k)
+    if mode == "multi_query":
+
+        def expand(inputs):
+            start = time.perf_counter()
+            try:
+                return fake_query_variants(inputs)
+            finally:
+                timings["expand"] = time.perf_counter() - start
+
+        return CachedMultiQueryRetriever(
+            retriever=service.get_retriever(k=k, mode="similarity"),
+            llm_chain=RunnableLambda(expand) | LineListOutputParser(),
+            include_original=True,
+        )
+    raise ValueError(f"Unknown benchmark mode: {mode}")
+
+
+def _norm(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+def first_hit_rank(docs: Sequence[Document], expected: Sequence[str]) -> Optional[int]:
+    """1-based rank of the first document from an expected source."""
+    targets = {_norm(p) for p in expected}
+    for rank, doc in enumerate(docs, start=1):
+        if _norm(str(doc.metadata.get("source", ""))) in targets:
+            return rank
+    return None
+
+
+def evaluate_mode(
+    service,
+    mode: str,
+    queries: Sequence[BenchmarkQuery],
+    k: int,
+    course_pdfs: Dict[str, List[str]],
+) -> ModeResult:
+    """Run ``mode`` on every query and aggregate hit-rate, MRR and latency.
+
+    The scoped mode searches the PDFs of the query's chapter; queries whose
+    chapter has no PDFs cannot be scoped, so they are left out of its metrics
+    (rank ``None``) and counted in ``skipped``.
+    """
+    latencies: List[float] = []
+    stages: Dict[str, List[float]] = {}
+    ranks: List[Optional[int]] = []
+    skipped = 0
+    for query in queries:
+        if mode == "scoped" and not course_pdfs.get(query.chapter):
+            skipped += 1
+            ranks.append(None)
+            continue
+        extra: Dict[str, float] = {}
+        retriever = _retriever(service, mode, k, query, course_pdfs, extra)
+        start = time.perf_counter()
+        docs = retriever.invoke(query.text)[:k]
+        latencies.append(time.perf_counter() - start)
+        timings = {**(getattr(retriever, "last_timings", None) or {}), **extra}
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+        ranks.append(first_hit_rank(docs, query.expected))
+
+    if skipped:
+        logger.warning(
+            "%s: skipped %d query(ies) whose chapter has no PDFs", mode, skipped
+        )
+    found = [r for r in ranks if r is not None]
+    evaluated = len(queries) - skipped
+    p50, p95 = (
+        np.percentile(np.asarray(latencies) * 1000.0, [50, 95]) if latencies else (0, 0)
+    )
+    return ModeResult(
+        mode=mode,
+        k=k,
+        queries=evaluated,
+        hit_rate=len(found) / evaluated if evaluated else 0.0,
+        mrr=sum(1.0 / r for r in found) / evaluated if evaluated else 0.0,
+        p50_ms=float(p50),
+        p95_ms=float(p95),
+        skipped=skipped,
+        stages_ms={s: float(np.mean(v) * 1000.0) for s, v in sorted(stages.items())},
+        ranks=ranks,
+    )
+
+
+def run_benchmark(
+    queries: Sequence[BenchmarkQuery],
+    course: CourseMap,
+    k: int = 4,
+    modes: Sequence[str] = MODES,
+    workdir: Optional[str] = None,
+) -> List[ModeResult]:
+    """Index the book PDFs offline and evaluate every mode on ``queries``.
+
+    PDFs not referenced by the knowledge tree are indexed too and act as
+    distractors, as they would in the real store.
+    """
+    with tempfile.TemporaryDirectory(prefix="retrieval_benchmark_", dir=workdir) as tmp:
+        start = time.perf_counter()
+        service = build_service(course.all_pdfs(), os.path.join(tmp, "chroma_db"))
+        logger.info("Indexed course PDFs in %.1fs", time.perf_counter() - start)
+        return [evaluate_mode(service, m, queries, k, course.chapters) for m in modes]
+
+
+def format_results(results: Sequence[ModeResult]) -> str:
+    lines = [
+        f"{'mode':<12} {'k':>3} {'n':>5} {'skip':>5} {'hit@k':>6} {'MRR':>6} "
+        f"{'p50ms':>7} {'p95ms':>7}  stages(ms)"
+    ]
+    for r in results:
+        stages = ", ".join(f"{s}={v:.2f}" for s, v in r.stages_ms.items())
+        lines.append(
+            f"{r.mode:<12} {r.k:>3} {r.queries:>5} {r.skipped:>5} {r.hit_rate:>6.3f} "
+            f"{r.mrr:>6.3f} {r.p50_ms:>7.2f} {r.p95_ms:>7.2f}  {stages}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> List[ModeResult]:
+    parser = argparse.ArgumentParser(
+        prog="python -m tools.retrieval_benchmark",
+        description="Offline hit-rate@k / MRR / latency benchmark of all retriever modes",
+    )
+    parser.add_argument("--questions", default="data/Question")
+    parser.add_argument("--log", default="data/Log/llm_log.json")
+    parser.add_argument("--course", default="data/course/big_data.json")
+    parser.add_argument("--books", default="data/Book")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--limit", type=int, default=0, help="Use only the first N queries")
+    parser.add_argument(
+        "--output",
+        default="data/Log/retrieval_benchmark.json",
+        help="JSON results file (empty to skip)",
+    )
+    args = parser.parse_args(argv)
+
+    queries = build_query_set(args.questions, args.log, args.course, args.books)
+    if args.limit:
+        queries = queries[: args.limit]
+    if not queries:
+        raise SystemExit("No benchmark queries could be mapped to course PDFs")
+    course = CourseMap(args.course, args.books)
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    results = run_benchmark(queries, course, k=args.k, modes=modes)
+    print(format_results(results))
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "k": args.k,
+                    "embeddings": HashingEmbeddings().namespace,
+                    "queries": [asdict(q) for q in queries],
+                    "results": [r.as_dict() for r in results],
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # 每次查询扩展都会记录一条生成结果，基准运行时关闭
+    logging.getLogger("langchain_classic.retrievers.multi_query").setLevel(logging.WARNING)
+    main(sys.argv[1:])
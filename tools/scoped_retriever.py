@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict, Field
+
+# 每次调用的统计按上下文（线程 / asyncio 任务）保存：实例在请求间共享，写在实例上会互相覆盖。
+# 键为检索器 id，值为 (各阶段耗时, 压缩统计)；只整体替换，不原地修改
+_last_stats: ContextVar[Dict[int, Tuple[Dict[str, float], Optional[Dict[str, float]]]]] = (
+    ContextVar("retriever_last_stats", default={})
+)
+
+
+class ScopedRetriever(BaseRetriever):
+    """Retriever over :meth:`RAGService.search` restricted to ``sources``.
+
+    ``sources`` of ``None`` searches the whole store; otherwise a single
+    ``$in``-filtered query covers every listed file. ``namespaces`` lists the
+    collections to search (``None`` is the shared course corpus). ``extra_documents`` are
+    appended to every result (e.g. the quiz question bank). When a
+    ``compressor`` (:class:`~tools.context_compressor.ContextCompressor`) is
+    set, retrieved documents are compressed against the query.
+
+    Instances are created and reused across requests by
+    :meth:`RAGService.scoped_retriever`, so per-call stats are not stored on
+    them: ``last_timings`` and ``last_compression`` report the last call this
+    retriever made from the current thread or asyncio task.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    service: Any
+    k: int = 4
+    sources: Optional[List[str]] = None
+    search_type: str = "similarity"
+    fetch_k: Optional[int] = None
+    extra_documents: List[Document] = Field(default_factory=list)
+    compressor: Optional[Any] = None
+    namespaces: Optional[List[str]] = None
+
+    @property
+    def last_timings(self) -> Dict[str, float]:
+        """Seconds per stage of this retriever's last call in this context."""
+        return _last_stats.get().get(id(self), ({}, None))[0]
+
+    @property
+    def last_compression(self) -> Optional[Dict[str, float]]:
+        """Compressor stats of this retriever's last call in this context."""
+        return _last_stats.get().get(id(self), ({}, None))[1]
+
+    def _record(
+        self, timings: Dict[str, float], compression: Optional[Dict[str, float]]
+    ) -> None:
+        stats = dict(_last_stats.get())
+        stats[id(self)] = (timings, compression)
+        _last_stats.set(stats)
+
+    def _compress(
+        self, query: str, docs: List[Document], timings: Dict[str, float]
+    ) -> Tuple[List[Document], Optional[Dict[str, float]]]:
+        if self.compressor is None or not docs:
+            return docs, None
+        docs, stats = self.compressor.compress_with_stats(docs, query)
+        timings["compression"] = stats.seconds
+        return docs, stats.as_dict()
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun = None
+    ) -> List[Document]:
+        timings: Dict[str, float] = {}
+        docs = self.service.search(
+            query,
+            k=self.k,
+            sources=self.sources,
+            search_type=self.search_type,
+            fetch_k=self.fetch_k,
+            timings=timings,
+            namespaces=self.namespaces,
+        )
+        docs, compression = self._compress(query, docs, timings)
+        self._record(timings, compression)
+        return docs + list(self.extra_documents)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun = None
+    ) -> List[Document]:
+        timings: Dict[str, float] = {}
+        docs = await self.service.asearch(
+            query,
+            k=self.k,
+            sources=self.sources,
+            search_type=self.search_type,
+            fetch_k=self.fetch_k,
+            timings=timings,
+            namespaces=self.namespaces,
+        )
+        compression = None
+        if self.compressor is not None and docs:
+            docs, compression = await asyncio.to_thread(
+                self._compress, query, docs, timings
+            )
+        self._record(timings, compression)
+        return docs + list(self.extra_documents)
+
+    def retrieve_many(self, queries: List[str]) -> List[List[Document]]:
+        """Retrieve for every query with one :meth:`RAGService.retrieve_many` call."""
+        timings: Dict[str, float] = {}
+        rankings = self.service.retrieve_many(
+            queries,
+            scope=self.sources,
+            k=self.k,
+            search_type=self.search_type,
+            fetch_k=self.fetch_k,
+            namespaces=self.namespaces,
+            timings=timings,
+        )
+        results = []
+        compression = None
+        for query, docs in zip(queries, rankings):
+            docs, stats = self._compress(query, docs, timings)
+            compression = stats or compression
+            results.append(docs + list(self.extra_documents))
+        self._record(timings, compression)
+        return results
+
+    def get_relevant_documents(self, query: str) -> List[Document]:
+        """Compatibility alias for the pre-1.0 LangChain retriever API."""
+        return self.invoke(query)
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import glob
+import json
+import os
+import time
+from dataclasses import dataclass
+from hashlib import sha256
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_SUFFIX = ".rag.npz"
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot is unreadable, corrupted or incompatible."""
+
+
+@dataclass
+class Snapshot:
+    """Embedded chunks of one collection, as written by :func:`write_snapshot`."""
+
+    ids: List[str]
+    vectors: np.ndarray
+    texts: List[str]
+    metadatas: List[dict]
+    model: str
+    created: float
+    manifest: Optional[dict] = None
+    namespace: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def _json_bytes(value) -> np.ndarray:
+    data = json.dumps(value, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+def _checksum(vectors: np.ndarray, records: np.ndarray) -> str:
+    digest = sha256()
+    digest.update(np.ascontiguousarray(vectors).tobytes())
+    digest.update(records.tobytes())
+    return digest.hexdigest()
+
+
+def write_snapshot(
+    path: str,
+    ids: Sequence[str],
+    vectors,
+    texts: Sequence[str],
+    metadatas: Sequence[Optional[dict]],
+    model: str,
+    manifest: Optional[dict] = None,
+    namespace: Optional[str] = None,
+) -> str:
+    """Write a compressed, self-describing snapshot to ``path`` and return it.
+
+    The ``.npz`` holds the vectors as ``float16``, a JSON ``records`` blob
+    with ids, chunk text, metadata, the optional ingest ``manifest``
+    entries and the ``namespace`` the chunks came from, and a JSON ``header`` with the format version, embedding model,
+    shape and a SHA-256 over vectors and records. The file is written to a
+    temporary name and renamed into place.
+    """
+    matrix = np.asarray(vectors, dtype=np.float16)
+    if len(ids):
+        matrix = matrix.reshape(len(ids), -1)
+    else:
+        matrix = matrix.reshape(0, 0)
+    records = _json_bytes(
+        {
+            "ids": list(ids),
+            "texts": list(texts),
+            "metadatas": [m or {} for m in metadatas],
+            "manifest": manifest,
+            "namespace": namespace,
+        }
+    )
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "model": model,
+        "count": len(ids),
+        "dim": int(matrix.shape[1]),
+        "dtype": "float16",
+        "created": time.time(),
+        "checksum": _checksum(matrix, records),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(
+            f, header=_json_bytes(header), vectors=matrix, records=records
+        )
+    os.replace(tmp, path)
+    return path
+
+
+def read_snapshot(path: str, expected_model: Optional[str] = None) -> Snapshot:
+    """Load and verify the snapshot at ``path``.
+
+    Raises :class:`SnapshotError` if the checksum does not match, the format
+    is unknown or ``expected_model`` differs from the recorded model.
+    """
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(data["header"].tobytes().decode("utf-8"))
+            vectors = data["vectors"]
+            records = data["records"]
+    except (OSError, ValueError, KeyError) as exc:
+        raise SnapshotError(f"Cannot read snapshot {path}: {exc}") from exc
+
+    if header.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"Unsupported snapshot format {header.get('format')!r}")
+    if _checksum(vectors, records) != header.get("checksum"):
+        raise SnapshotError(f"Checksum mismatch in snapshot {path}")
+    if expected_model is not None and header.get("model") != expected_model:
+        raise SnapshotError(
+            f"Snapshot {path} was built with {header.get('model')!r}, "
+            f"not {expected_model!r}"
+        )
+    payload = json.loads(records.tobytes().decode("utf-8"))
+    return Snapshot(
+        ids=payload["ids"],
+        vectors=vectors,
+        texts=payload["texts"],
+        metadatas=payload["metadatas"],
+        model=header["model"],
+        created=header["created"],
+        manifest=payload.get("manifest"),
+        namespace=payload.get("namespace"),
+    )
+
+
+def snapshot_path(directory: str, namespace: str) -> str:
+    """Return a new timestamped snapshot path for ``namespace``."""
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return os.path.join(directory, f"{namespace}-{stamp}{SNAPSHOT_SUFFIX}")
+
+
+def latest_snapshot(directory: str, namespace: str) -> Optional[str]:
+    """Return the most recently written snapshot of ``namespace``, if any."""
+    pattern = os.path.join(glob.escape(directory), f"{namespace}-*{SNAPSHOT_SUFFIX}")
+    candidates = glob.glob(pattern)
+    if not candidates:
+        return None
+    return max(candidates, key=os.path.getmtime)